@@ -1,5 +1,4 @@
 from abc import ABC, abstractmethod
-from asyncio import Lock
 from io import BytesIO
 from logging import Logger
 from typing import List
@@ -9,6 +8,21 @@ from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from redbot.core import Config, commands
 from redbot.core.bot import Red
 
+from .announcements import AnnouncementQueue
+from .avatar_cache import AvatarCache
+from .card_cache import CardCache
+from .guild_settings import GuildSettingsCache
+from .image_cache import ImageCache
+from .indexes import IndexManager
+from .known_users import KnownUsers
+from .leaderboard import LeaderboardCache
+from .locks import StripedLock
+from .members import MembersStore
+from .render_pool import RenderPool
+from .rewards import RewardIndex
+from .spam_gate import SpamGate
+from .xp_buffer import XPBuffer
+
 
 class MixinMeta(ABC):
     """
@@ -22,10 +36,23 @@ class MixinMeta(ABC):
     config: Config
 
     _db_ready: bool
-    _db_lock: Lock
+    _user_locks: StripedLock
     client: AsyncIOMotorClient
     db: AsyncIOMotorDatabase
     session: ClientSession
+    _xp_buffer: XPBuffer
+    _indexes: IndexManager
+    _leaderboards: LeaderboardCache
+    _images: ImageCache
+    _avatars: AvatarCache
+    _cards: CardCache
+    _render_pool: RenderPool
+    _guild_settings: GuildSettingsCache
+    _spam_gate: SpamGate
+    _known_users: KnownUsers
+    _rewards: RewardIndex
+    _announcements: AnnouncementQueue
+    _members: MembersStore
 
     @abstractmethod
     async def _connect_to_mongo(self):
@@ -55,18 +82,6 @@ class MixinMeta(ABC):
     async def asyncify(self, func, *args, **kwargs):
         raise NotImplementedError
 
-    @abstractmethod
-    async def asyncify_thread(self, func, *args, **kwargs):
-        raise NotImplementedError
-
-    @abstractmethod
-    async def asyncify_process(self, func, *args, **kwargs):
-        raise NotImplementedError
-
-    @abstractmethod
-    async def hash_with_md5(self, string):
-        raise NotImplementedError
-
     @abstractmethod
     async def _handle_levelup(self, user, userinfo, server, channel):
         raise NotImplementedError
@@ -119,6 +134,14 @@ class MixinMeta(ABC):
     async def _process_exp(self, message, userinfo, exp: int):
         raise NotImplementedError
 
+    @abstractmethod
+    async def _flush_xp_buffer(self, *user_ids: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _evict_xp_state(self, user_id: str):
+        raise NotImplementedError
+
     @abstractmethod
     async def _give_chat_credit(self, user, server):
         raise NotImplementedError
@@ -135,10 +158,6 @@ class MixinMeta(ABC):
     def _center(self, start, end, text, font) -> int:
         raise NotImplementedError
 
-    @abstractmethod
-    def char_in_font(self, unicode_char, font) -> bool:
-        raise NotImplementedError
-
     @abstractmethod
     def _contrast(self, bg_color, color1, color2):
         raise NotImplementedError
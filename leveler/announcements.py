@@ -0,0 +1,104 @@
+import asyncio
+from collections import deque
+from logging import getLogger
+from typing import Awaitable, Callable, Deque, Dict, List, NamedTuple, Tuple
+
+import discord
+
+log = getLogger("red.fixator10-cogs.leveler")
+
+
+class LevelUp(NamedTuple):
+    """Level-up waiting to be announced"""
+
+    user: discord.Member
+    server: discord.Guild
+    name: str
+    server_identifier: str
+    level: str
+    text_only: bool
+
+
+class AnnouncementQueue:
+    """Per-channel queues of level-up announcements
+
+    Level-ups that land in same channel within `window` seconds are sent in one message,
+    up to `batch_size` level-ups per message (Discord's limit of attachments),
+    and messages to one channel are sent at most once per `min_interval` seconds.
+    If channel's queue is longer than `max_queued`, oldest level-ups are dropped."""
+
+    def __init__(
+        self,
+        send: Callable[[discord.abc.Messageable, List[LevelUp]], Awaitable],
+        window: float = 2.0,
+        batch_size: int = 10,
+        min_interval: float = 1.0,
+        max_queued: int = 50,
+    ):
+        self._send = send
+        self.window = window
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.max_queued = max_queued
+        # channel id -> (level-up, time when it was queued)
+        self._queues: Dict[int, Deque[Tuple[LevelUp, float]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self.queued_max = 0
+        self.announced = 0
+        self.messages = 0
+        self.dropped = 0
+        self.failed = 0
+        self.delay = 0.0
+        self.throttled = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def average_delay(self) -> float:
+        """Average time between queueing and sending of level-up"""
+        return self.delay / ((self.announced + self.failed) or 1)
+
+    def push(self, channel: discord.abc.Messageable, levelup: LevelUp):
+        queue = self._queues.setdefault(channel.id, deque())
+        queue.append((levelup, asyncio.get_running_loop().time()))
+        if len(queue) > self.max_queued:
+            queue.popleft()
+            self.dropped += 1
+        self.queued_max = max(self.queued_max, len(queue))
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.create_task(self._deliver(channel))
+
+    async def _deliver(self, channel: discord.abc.Messageable):
+        loop = asyncio.get_running_loop()
+        queue = self._queues[channel.id]
+        next_send = 0.0
+        try:
+            while queue:
+                # wait for other level-ups to coalesce with first one
+                await asyncio.sleep(self.window)
+                if (throttle := next_send - loop.time()) > 0:
+                    self.throttled += throttle
+                    await asyncio.sleep(throttle)
+                batch = [queue.popleft() for _ in range(min(len(queue), self.batch_size))]
+                now = loop.time()
+                self.delay += sum(now - queued_at for _, queued_at in batch)
+                try:
+                    await self._send(channel, [levelup for levelup, _ in batch])
+                except Exception as e:
+                    self.failed += len(batch)
+                    log.error(f"Unable to announce level-ups in {channel}", exc_info=e)
+                else:
+                    self.announced += len(batch)
+                    self.messages += 1
+                next_send = loop.time() + self.min_interval
+        finally:
+            del self._workers[channel.id]
+            if not queue:
+                del self._queues[channel.id]
+
+    def close(self):
+        """Stop delivery. Queued level-ups are not announced."""
+        for task in self._workers.values():
+            task.cancel()
@@ -0,0 +1,118 @@
+import asyncio
+from io import BytesIO
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import discord
+
+from . import render_assets
+from .lru import SizedLRU, image_size
+from .pillow import LANCZOS, Image, ImageChops, ImageOps, pil_features
+
+log = getLogger("red.fixator10-cogs.leveler")
+
+AVATAR_FORMAT = "webp" if pil_features.check("webp_anim") else "jpg"
+log.debug(f"using {AVATAR_FORMAT} avatar format")
+# largest avatar drawn by generators is 110px
+AVATAR_DOWNLOAD_SIZE = 128
+# circles are drawn supersampled, same as in generators
+MASK_MULTIPLIER = 6
+
+
+def circle_avatar(source: Union[bytes, Path], size: int) -> Image.Image:
+    """Crop avatar to circle of `size` diameter, as RGBA image with transparent corners"""
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as original:
+        avatar = original.convert("RGBA")
+    temp = avatar
+    avatar = ImageOps.fit(avatar, (size, size), LANCZOS, centering=(0.5, 0.5))
+    temp.close()
+    mask = render_assets.circle_mask(size * MASK_MULTIPLIER, size)
+    avatar.putalpha(ImageChops.multiply(avatar.getchannel("A"), mask))
+    return avatar
+
+
+class AvatarCache:
+    """Cache of users' avatars, already cropped to circles of sizes used by generators
+
+    Avatars are keyed by user's avatar hash, so changed avatar is downloaded again.
+    Images returned by cache are shared, and should never be modified or closed."""
+
+    def __init__(
+        self,
+        default_avatar: Path,
+        max_raw_size: int = 16 * 1024 * 1024,
+        max_images_size: int = 32 * 1024 * 1024,
+    ):
+        self.default_avatar = default_avatar
+        self._raw: SizedLRU[bytes] = SizedLRU(max_raw_size, len)
+        self._images: SizedLRU[Image.Image] = SizedLRU(max_images_size, image_size)
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._images)
+
+    @property
+    def size(self) -> int:
+        return self._raw.size + self._images.size
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _forget(self, user_id: int, avatar: Optional[str]):
+        """Drop cached avatars of user, that have other avatar hash"""
+        for cache in (self._raw, self._images):
+            for key in [k for k in cache if k[0] == user_id and k[1] != avatar]:
+                cache.pop(key)
+
+    async def _download(self, user: Union[discord.User, discord.Member], key: tuple):
+        try:
+            data = await user.avatar_url_as(format=AVATAR_FORMAT, size=AVATAR_DOWNLOAD_SIZE).read()
+        except discord.HTTPException as e:
+            self.failed += 1
+            log.debug("Unable to download avatar of %s: %s", user.id, e)
+            return None
+        self.downloads += 1
+        self._raw.put(key, data)
+        return data
+
+    async def _render(self, user, key: tuple, size: int) -> Image.Image:
+        raw_key = key[:3]
+        self._forget(user.id, user.avatar)
+        data = self._raw.get(raw_key)
+        if data is None:
+            data = await self._download(user, raw_key)
+        if data is not None:
+            try:
+                image = await self._run(circle_avatar, data, size)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                log.debug("Unable to decode avatar of %s: %s", user.id, e)
+                self._raw.pop(raw_key)
+            else:
+                self._images.put(key, image)
+                return image
+        # default avatar is not cached for user, so it's downloaded again next time
+        default_key = (None, None, None, size)
+        image = self._images.get(default_key)
+        if image is None:
+            image = await self._run(circle_avatar, self.default_avatar, size)
+            self._images.put(default_key, image)
+        return image
+
+    async def get(self, user: Union[discord.User, discord.Member], size: int) -> Image.Image:
+        """Get user's avatar, cropped to circle of `size` diameter"""
+        key = (user.id, user.avatar, AVATAR_FORMAT, size)
+        image = self._images.get(key)
+        if image is not None:
+            self.hits += 1
+            return image
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._render(user, key, size))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
@@ -0,0 +1,112 @@
+from typing import Awaitable, Callable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+# user ids per update_many, when badge is given to or taken from many users
+CHUNK_SIZE = 1000
+
+# badges of old users may be stored in other format, such users are converted on profile view
+OBJECT_BADGES = {"badges": {"$type": "object"}}
+
+
+def badge_key(name: str, server_id) -> str:
+    """Key of badge in user's `badges`"""
+    return "{}_{}".format(name, server_id)
+
+
+def merge_badges_pipeline(badges: dict) -> List[dict]:
+    """Update pipeline that adds badges to user, converting badges of old format"""
+    return [
+        {
+            "$set": {
+                "badges": {
+                    "$mergeObjects": [
+                        {"$cond": [{"$eq": [{"$type": "$badges"}, "object"]}, "$badges", {}]},
+                        {"$literal": badges},
+                    ]
+                }
+            }
+        }
+    ]
+
+
+async def update_badge(users: AsyncIOMotorCollection, key: str, badge: dict) -> int:
+    """Replace badge data of every user that has badge, keeping priority set by user
+
+    Returns count of updated users."""
+    result = await users.update_many(
+        {f"badges.{key}": {"$exists": True}, **OBJECT_BADGES},
+        {
+            "$set": {
+                f"badges.{key}.{field}": value
+                for field, value in badge.items()
+                if field != "priority_num"
+            }
+        },
+    )
+    return result.modified_count
+
+
+async def remove_badge(users: AsyncIOMotorCollection, key: str) -> int:
+    """Remove badge from every user that has it
+
+    Returns count of updated users."""
+    result = await users.update_many(
+        {f"badges.{key}": {"$exists": True}, **OBJECT_BADGES}, {"$unset": {f"badges.{key}": ""}}
+    )
+    return result.modified_count
+
+
+async def _update_chunks(
+    users: AsyncIOMotorCollection,
+    user_ids: List[int],
+    query: dict,
+    update,
+    progress: Optional[Callable[[int, int], Awaitable]],
+) -> int:
+    updated = 0
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = [str(user_id) for user_id in user_ids[start : start + CHUNK_SIZE]]
+        result = await users.update_many({"user_id": {"$in": chunk}, **query}, update)
+        updated += result.modified_count
+        if progress is not None:
+            await progress(start + len(chunk), len(user_ids))
+    return updated
+
+
+async def give_badge(
+    users: AsyncIOMotorCollection,
+    user_ids: List[int],
+    key: str,
+    badge: dict,
+    progress: Callable[[int, int], Awaitable] = None,
+) -> int:
+    """Give badge to users that don't have it yet, in chunks of `CHUNK_SIZE` users
+
+    `progress` is called with count of processed and total users after every chunk.
+    Returns count of users that got badge."""
+    return await _update_chunks(
+        users,
+        user_ids,
+        {f"badges.{key}": {"$exists": False}},
+        merge_badges_pipeline({key: badge}),
+        progress,
+    )
+
+
+async def take_badge(
+    users: AsyncIOMotorCollection,
+    user_ids: List[int],
+    key: str,
+    progress: Callable[[int, int], Awaitable] = None,
+) -> int:
+    """Take badge from users, if it's not purchasable, in chunks of `CHUNK_SIZE` users
+
+    Returns count of users that lost badge."""
+    return await _update_chunks(
+        users,
+        user_ids,
+        {f"badges.{key}.price": -1, **OBJECT_BADGES},
+        {"$unset": {f"badges.{key}": ""}},
+        progress,
+    )
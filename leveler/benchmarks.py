@@ -0,0 +1,193 @@
+import asyncio
+import random
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter, thread_time
+from typing import Callable, Dict, List, Tuple
+
+from redbot.core.utils import AsyncIter
+
+from . import card_templates, render_assets
+from .avatar_cache import circle_avatar
+from .encoders import ENCODERS, encode, resolve
+from .image_generators import make_levelup_image, make_profile_image, make_rank_image
+from .levels import (
+    find_level,
+    level_exp,
+    numpy,
+    required_exp,
+    server_exp,
+    server_exp_batch,
+)
+from .pillow import Image
+
+
+async def _legacy_server_exp(level: int, current_exp: int) -> int:
+    # per-level summing, as it was done before closed-form functions
+    total = 0
+    async for i in AsyncIter(range(level)):
+        total += required_exp(i)
+    return total + current_exp
+
+
+async def bench_levels(
+    users: int = 100_000, legacy_sample: int = 2000, max_level: int = 60
+) -> List[Tuple[str, int, float, float]]:
+    """Compare ways to calculate server XP for whole leaderboard
+
+    Per-level summing is measured on `legacy_sample` users and extrapolated.
+    Returns list of (method, measured users, seconds for `users`, microseconds per user)."""
+    rng = random.Random(0)
+    levels = [rng.randint(0, max_level) for _ in range(users)]
+    current_exps = [rng.randrange(required_exp(level)) for level in levels]
+    sample = min(users, legacy_sample)
+    results = []
+
+    start = perf_counter()
+    legacy = [
+        await _legacy_server_exp(level, exp)
+        for level, exp in zip(levels[:sample], current_exps[:sample])
+    ]
+    elapsed = (perf_counter() - start) / sample
+    results.append(("Per-level async loop", sample, elapsed * users, elapsed * 1e6))
+
+    start = perf_counter()
+    closed = [server_exp(level, exp) for level, exp in zip(levels, current_exps)]
+    elapsed = perf_counter() - start
+    results.append(("Closed form", users, elapsed, elapsed / users * 1e6))
+
+    start = perf_counter()
+    batch = server_exp_batch(levels, current_exps)
+    elapsed = perf_counter() - start
+    results.append(
+        (
+            "Batch ({})".format("numpy" if numpy is not None else "no numpy, closed form"),
+            users,
+            elapsed,
+            elapsed / users * 1e6,
+        )
+    )
+
+    if not legacy == closed[:sample] == batch[:sample] or closed != batch:
+        raise ValueError("Server XP calculation methods returned different results")
+    return results
+
+
+def _card_cpu_time(render, runs: int) -> Tuple[float, float]:
+    """Average CPU time of render without and with cached templates and assets, in seconds
+
+    Renders use their own caches, so shared ones are not affected by benchmark."""
+    cold = warm = 0.0
+    with card_templates.isolated() as templates, render_assets.isolated() as assets:
+        for _ in range(runs):
+            templates.clear()
+            assets.clear()
+            start = thread_time()
+            render().close()
+            cold += thread_time() - start
+        for _ in range(runs):
+            start = thread_time()
+            render().close()
+            warm += thread_time() - start
+    return cold / runs, warm / runs
+
+
+def _sample_cards(data_path: str) -> Dict[str, Callable[[], BytesIO]]:
+    """Renders of rank, levelup and profile cards with generated backgrounds and default avatar"""
+    avatar = Path(data_path) / "defaultavatar.png"
+    userinfo = {
+        "servers": {"0": {"level": 10, "current_exp": 700}},
+        "total_exp": 20000,
+        "rep": 42,
+        "title": "Benchmark",
+        "info": "I am a mysterious person.",
+    }
+    level = find_level(userinfo["total_exp"])
+    gradient = Image.linear_gradient("L").convert("RGBA")
+    return {
+        "rank": partial(
+            make_rank_image,
+            data_path,
+            gradient.resize((390, 100)),
+            "benchmark",
+            circle_avatar(avatar, 94),
+            "Benchmark",
+            "0",
+            userinfo,
+            required_exp(10),
+            1,
+            100,
+            "credits",
+        ),
+        "levelup": partial(
+            make_levelup_image,
+            data_path,
+            gradient.resize((176, 67)),
+            "benchmark",
+            circle_avatar(avatar, 58),
+            userinfo,
+            "0",
+        ),
+        "profile": partial(
+            make_profile_image,
+            data_path,
+            gradient.resize((340, 305)),
+            "benchmark",
+            circle_avatar(avatar, 110),
+            "Benchmark",
+            userinfo,
+            1,
+            level,
+            level_exp(level),
+            required_exp(level),
+            100,
+            "credits",
+            [({"border_color": "#ffffff"}, 1)],
+            [gradient.resize((228, 228))],
+        ),
+    }
+
+
+async def bench_cards(data_path: str, runs: int = 20) -> List[Tuple[str, float, float, float]]:
+    """Compare CPU time of card renders with and without cached templates and assets
+
+    Returns list of (card, ms uncached, ms cached, speedup)."""
+    cards = _sample_cards(data_path)
+    loop = asyncio.get_running_loop()
+    results = []
+    for card, render in cards.items():
+        cold, warm = await loop.run_in_executor(None, _card_cpu_time, render, runs)
+        results.append((card, cold * 1000, warm * 1000, cold / warm))
+    return results
+
+
+def _encode_time(image: Image.Image, encoder: str, runs: int) -> Tuple[float, int]:
+    """Average encode time in seconds, and size of encoded image"""
+    start = perf_counter()
+    for _ in range(runs):
+        file = encode(image, encoder)
+    elapsed = (perf_counter() - start) / runs
+    size = len(file.getvalue())
+    file.close()
+    return elapsed, size
+
+
+async def bench_encoders(data_path: str, runs: int = 10) -> List[Tuple[str, str, float, int]]:
+    """Compare encode time and size of cards for every available encoder
+
+    Returns list of (card, encoder, ms, bytes)."""
+    loop = asyncio.get_running_loop()
+    results = []
+    for card, render in _sample_cards(data_path).items():
+        file = await loop.run_in_executor(None, partial(render, encoder="png-fast"))
+        with Image.open(file) as image:
+            image.load()
+            for encoder in ENCODERS:
+                if resolve(encoder) != encoder:
+                    continue
+                elapsed, size = await loop.run_in_executor(
+                    None, _encode_time, image, encoder, runs
+                )
+                results.append((card, encoder, elapsed * 1000, size))
+    return results
@@ -0,0 +1,42 @@
+from hashlib import sha256
+
+from .lru import SizedLRU
+
+
+def card_key(*inputs) -> bytes:
+    """Digest of render inputs
+
+    Inputs should be built from plain values with stable repr: str, int, float, tuple, list, dict."""
+    return sha256(repr(inputs).encode()).digest()
+
+
+class CardCache:
+    """LRU cache of rendered cards, keyed by digest of everything they are rendered from"""
+
+    def __init__(self, max_size: int = 32 * 1024 * 1024):
+        self._cards: SizedLRU[bytes] = SizedLRU(max_size, len)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cards)
+
+    @property
+    def size(self) -> int:
+        return self._cards.size
+
+    def get(self, key: bytes):
+        card = self._cards.get(key)
+        if card is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return card
+
+    def put(self, key: bytes, card: bytes):
+        if len(card) > self._cards.max_size:
+            return
+        self._cards.put(key, card)
+
+    def clear(self):
+        self._cards.clear()
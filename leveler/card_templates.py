@@ -0,0 +1,273 @@
+import threading
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Hashable, Iterator, Optional, Tuple
+
+from . import render_assets
+from .def_imgen_utils import add_corners
+from .lru import SizedLRU, image_size
+from .pillow import LANCZOS, Image, ImageDraw, ImageOps
+
+Color = Tuple[int, ...]
+Layers = Tuple[Image.Image, ...]
+
+# templates are few hundred KB each
+MAX_TEMPLATES_SIZE = 32 * 1024 * 1024
+BG_COLOR = (255, 255, 255, 0)
+
+
+def _layers_size(layers: Layers) -> int:
+    return sum(image_size(layer) for layer in layers)
+
+
+class TemplateCache:
+    """LRU cache of card templates, limited by size of layers"""
+
+    def __init__(self, max_size: int = MAX_TEMPLATES_SIZE):
+        # (card, background key, colors) -> static layers
+        self._templates: SizedLRU[Layers] = SizedLRU(max_size, _layers_size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(self, key: Tuple[Hashable, ...], build: Callable[[], Layers]) -> Layers:
+        """Get layers of card template, building them on miss
+
+        Layers are shared between renders, and should be copied before drawing on them."""
+        with self._lock:
+            layers = self._templates.get(key)
+            if layers is not None:
+                self.hits += 1
+                return layers
+            self.misses += 1
+        # template may be built twice by concurrent renders, that's cheaper than waiting
+        layers = build()
+        with self._lock:
+            if key not in self._templates:
+                self._templates.put(key, layers)
+        return layers
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+
+_templates = TemplateCache()
+# cache used by renders in current thread instead of shared one, see `isolated`
+_local = threading.local()
+
+
+def _cached(key: Tuple[Hashable, ...], build: Callable[[], Layers]) -> Layers:
+    cache = getattr(_local, "cache", None)
+    return (_templates if cache is None else cache).get(key, build)
+
+
+@contextmanager
+def isolated() -> Iterator[TemplateCache]:
+    """Use separate empty cache for renders in current thread, e.g. for benchmarks"""
+    _local.cache = cache = TemplateCache()
+    try:
+        yield cache
+    finally:
+        _local.cache = None
+        cache.clear()
+
+
+def rank_layers(
+    background_key: Optional[str], background: Optional[Image.Image], exp_color: Color
+) -> Layers:
+    """Rank card without avatar and text, with empty and full exp bar"""
+
+    def build():
+        width = 390
+        height = 100
+        bg_width = width - 50
+        layers = []
+        for bar_color in (None, exp_color):
+            process = Image.new("RGBA", (width, height), BG_COLOR)
+            # info section
+            info_section = Image.new("RGBA", (bg_width, height), BG_COLOR)
+            info_section_process = Image.new("RGBA", (bg_width, height), BG_COLOR)
+            if background is not None:
+                info_section.paste(background, (0, 0))
+
+            # draw transparent overlays
+            draw_overlay = ImageDraw.Draw(info_section_process)
+            draw_overlay.rectangle([(0, 0), (bg_width, 20)], fill=(230, 230, 230, 200))
+            draw_overlay.rectangle(
+                [(0, 20), (bg_width, 30)], fill=(120, 120, 120, 180)
+            )  # Level bar
+            if bar_color is not None:
+                draw_overlay.rectangle([(0, 20), (bg_width, 30)], fill=bar_color)  # Exp bar
+            draw_overlay.rectangle([(0, 30), (bg_width, 31)], fill=(0, 0, 0, 255))  # Divider
+            for i in range(0, 70):
+                draw_overlay.rectangle(
+                    [(0, height - i), (bg_width, height - i)],
+                    fill=(20, 20, 20, 255 - i * 3),
+                )  # title overlay
+
+            # draw corners and finalize
+            info_section = Image.alpha_composite(info_section, info_section_process)
+            info_section = add_corners(info_section, 25)
+            process.paste(info_section, (35, 0))
+            info_section.close()
+            info_section_process.close()
+
+            # draw level circle
+            lvl_circle_dia = 100
+            raw_length = lvl_circle_dia * 6
+            lvl_circle = render_assets.filled_circle(
+                raw_length, lvl_circle_dia, (250, 250, 250, 250)
+            )
+            lvl_bar_mask = render_assets.circle_mask(raw_length, lvl_circle_dia)
+            process.paste(lvl_circle, (0, int((height - lvl_circle_dia) / 2)), lvl_bar_mask)
+            layers.append(process)
+        return tuple(layers)
+
+    return _cached(("rank", background_key, exp_color), build)
+
+
+def levelup_layers(
+    background_key: Optional[str], background: Optional[Image.Image], info_color: Color
+) -> Layers:
+    """Levelup card background, and overlay with level circle, without avatar and text"""
+
+    def build():
+        width = 176
+        height = 67
+        result = Image.new("RGBA", (width, height), BG_COLOR)
+        process = Image.new("RGBA", (width, height), BG_COLOR)
+        draw = ImageDraw.Draw(process)
+        if background is not None:
+            result.paste(background, (0, 0))
+
+        # info section
+        lvl_circle_dia = 60
+        border = 1
+        info_section = Image.new("RGBA", (165, 55), (230, 230, 230, 20))
+        info_section = add_corners(info_section, int(lvl_circle_dia / 2))
+        process.paste(info_section, (border, border))
+        info_section.close()
+
+        # draw transparent overlay
+        for i in range(0, height):
+            draw.rectangle(
+                [(0, height - i), (width, height - i)],
+                fill=(info_color[0], info_color[1], info_color[2], 255 - i * 3),
+            )  # title overlay
+
+        # border
+        raw_length = lvl_circle_dia * 6
+        lvl_circle = render_assets.filled_circle(raw_length, lvl_circle_dia, (250, 250, 250, 180))
+        lvl_bar_mask = render_assets.circle_mask(raw_length, lvl_circle_dia)
+        process.paste(lvl_circle, (4, int((height - lvl_circle_dia) / 2)), lvl_bar_mask)
+        return result, process
+
+    return _cached(("levelup", background_key, info_color), build)
+
+
+def profile_layers(
+    background_key: Optional[str],
+    background: Optional[Image.Image],
+    info_fill: Color,
+    level_fill: Color,
+) -> Layers:
+    """Profile card background, and overlay with boxes and profile circle, without avatar, text,
+    exp bar and badges"""
+
+    def build():
+        result = Image.new("RGBA", (340, 390), BG_COLOR)
+        process = Image.new("RGBA", (340, 390), BG_COLOR)
+        draw = ImageDraw.Draw(process)
+        if background is not None:
+            result.paste(background, (0, 0))
+
+        # draw filter
+        draw.rectangle([(0, 0), (340, 340)], fill=(0, 0, 0, 10))
+        draw.rectangle(
+            [(0, 134), (340, 325)], fill=(info_fill[0], info_fill[1], info_fill[2], 150)
+        )  # general content
+
+        # profile circle border
+        lvl_circle_dia = 116
+        raw_length = lvl_circle_dia * 8
+        lvl_circle = render_assets.filled_circle(
+            raw_length,
+            lvl_circle_dia,
+            (255, 255, 255, 255),
+            (255, 255, 255, 250),
+        )
+        lvl_bar_mask = render_assets.circle_mask(raw_length, lvl_circle_dia)
+        process.paste(lvl_circle, (14, 48), lvl_bar_mask)
+
+        # draw divider
+        draw.rectangle([(0, 323), (340, 324)], fill=(0, 0, 0, 255))  # box
+        # draw text box
+        draw.rectangle(
+            [(0, 324), (340, 390)], fill=(info_fill[0], info_fill[1], info_fill[2], 255)
+        )  # box
+        draw.rectangle(
+            [(0, 305), (340, 323)],
+            fill=(level_fill[0], level_fill[1], level_fill[2], 245),
+        )  # level box
+        return result, process
+
+    return _cached(("profile", background_key, info_fill, level_fill), build)
+
+
+def plus_badge(size: int, fill: Color, plus_fill: Color, multiplier: int = 6) -> Image.Image:
+    """Empty badge slot with plus sign, drawn supersampled and resized to `size`
+
+    Should be pasted with `render_assets.circle_mask(size * multiplier, size)`."""
+    return _cached(
+        ("plus_badge", size, fill, plus_fill, multiplier),
+        partial(_plus_badge, size, fill, plus_fill, multiplier),
+    )[0]
+
+
+def _plus_badge(size: int, fill: Color, plus_fill: Color, multiplier: int) -> Layers:
+    raw_length = size * multiplier
+    plus_square = Image.new("RGBA", (raw_length, raw_length))
+    plus_draw = ImageDraw.Draw(plus_square)
+    plus_draw.rectangle(
+        [(0, 0), (raw_length, raw_length)],
+        fill=(fill[0], fill[1], fill[2], 245),
+    )
+    # draw plus signs
+    margin = 60
+    thickness = 40
+    v_left = int(raw_length / 2 - thickness / 2)
+    v_right = v_left + thickness
+    v_top = margin
+    v_bottom = raw_length - margin
+    plus_draw.rectangle(
+        [(v_left, v_top), (v_right, v_bottom)],
+        fill=(plus_fill[0], plus_fill[1], plus_fill[2], 245),
+    )
+    h_left = margin
+    h_right = raw_length - margin
+    h_top = int(raw_length / 2 - thickness / 2)
+    h_bottom = h_top + thickness
+    plus_draw.rectangle(
+        [(h_left, h_top), (h_right, h_bottom)],
+        fill=(plus_fill[0], plus_fill[1], plus_fill[2], 245),
+    )
+    output = ImageOps.fit(plus_square, (raw_length, raw_length), centering=(0.5, 0.5))
+    plus_square.close()
+    temp = output
+    output = output.resize((size, size), LANCZOS)
+    temp.close()
+    return (output,)
+
+
+def cache_stats() -> list:
+    """Rows of (asset, cached, hits, misses) for debug info"""
+    return [("card_templates", len(_templates), _templates.hits, _templates.misses)]
+
+
+def clear():
+    """Drop all cached templates"""
+    _templates.clear()
@@ -1,8 +1,19 @@
+import time
+from typing import Dict
+
+import discord
 from redbot.core import commands
 from redbot.core.utils import AsyncIter
-from redbot.core.utils.predicates import MessagePredicate
+from redbot.core.utils import chat_formatting as chat
+from tabulate import tabulate
 
 from leveler.abc import MixinMeta
+from leveler.badge_updates import give_badge
+from leveler.leaderboard import GLOBAL
+from leveler.mee6_import import ImportStats, Mee6Error, fetch_players, level_ops
+from leveler.members import exp_op, member_ops
+from leveler.mongodb import new_user_fields
+from leveler.rewards import reached_roles
 
 from .basecmd import DBConvertersBaseCMD
 
@@ -19,79 +30,126 @@ class MeeSix(MixinMeta):
 
     @mee6.command(name="levels")
     @commands.guild_only()
-    async def convertlevels(self, ctx, pages: int):
+    async def convertlevels(self, ctx, pages: int, dry_run: bool = False):
         """Convert Mee6 levels.
         Each page returns 999 users at most.
+        Level-up messages are not sent.
+        Role and badge rewards are given after all pages are converted.
+        With `dry_run`, nothing is changed, only report of conversion is shown.
         This command must be run in a channel in the guild to be converted."""
-        if await self.config.guild(ctx.guild).mentions():
-            msg = (
-                "{}, levelup mentions are on in this server.\n"
-                "The bot will ping every user that will be leveled up through this process if you continue.\n"
-                "Reply with `yes` if you want this conversion to continue.\n"
-                "If not, reply with `no` and then run `{}lvladmin mention` "
-                "to turn off mentions before running this command again."
-            ).format(ctx.author.display_name, ctx.prefix)
-            await ctx.send(msg)
-            pred = MessagePredicate.yes_or_no(ctx)
-            try:
-                await self.bot.wait_for("message", check=pred, timeout=15)
-            except TimeoutError:
-                return await ctx.send("Timed out waiting for a response.")
-            if pred.result is False:
-                return await ctx.send("Command cancelled.")
+        stats = ImportStats(dry_run)
+        # member id -> level on Mee6
+        levels: Dict[int, int] = {}
+        new_user = new_user_fields(await self.config.backgrounds())
         async with ctx.typing():
-            failed = 0
-            async for i in AsyncIter(range(pages)):
-                async with self.session.get(
-                    f"https://mee6.xyz/api/plugins/levels/leaderboard/{ctx.guild.id}?page={i}&limit=999"
-                ) as r:
-                    if r.status == 200:
-                        data = await r.json()
-                    else:
-                        return await ctx.send("No data was found within the Mee6 API.")
-
-                async for userdata in AsyncIter(data["players"]):
-                    # _handle_levelup requires a Member
-                    user = ctx.guild.get_member(int(userdata["id"]))
-
-                    if not user:
-                        failed += 1
-                        continue
-
-                    level = userdata["level"]
-                    server = ctx.guild
-                    channel = ctx.channel
-
-                    # creates user if doesn't exist
-                    await self._create_user(user, server)
-                    userinfo = await self.db.users.find_one({"user_id": str(user.id)})
-
-                    # get rid of old level exp
-                    old_server_exp = 0
-                    async for _i in AsyncIter(range(userinfo["servers"][str(server.id)]["level"])):
-                        old_server_exp += await self._required_exp(_i)
-                    userinfo["total_exp"] -= old_server_exp
-                    userinfo["total_exp"] -= userinfo["servers"][str(server.id)]["current_exp"]
-
-                    # add in new exp
-                    total_exp = await self._level_exp(level)
-                    userinfo["servers"][str(server.id)]["current_exp"] = 0
-                    userinfo["servers"][str(server.id)]["level"] = level
-                    userinfo["total_exp"] += total_exp
-
-                    if userinfo["total_exp"] > 0:
-                        await self.db.users.update_one(
-                            {"user_id": str(user.id)},
-                            {
-                                "$set": {
-                                    "servers.{}.level".format(server.id): level,
-                                    "servers.{}.current_exp".format(server.id): 0,
-                                    "total_exp": userinfo["total_exp"],
-                                }
-                            },
-                        )
-                        await self._handle_levelup(user, userinfo, server, channel)
-            await ctx.send(f"{failed} users could not be found and were skipped.")
+            try:
+                async for players in fetch_players(self.session, ctx.guild.id, pages, stats):
+                    members = []
+                    for player in players:
+                        member = ctx.guild.get_member(int(player["id"]))
+                        if member is None or member.bot:
+                            stats.skipped += 1
+                            continue
+                        levels[member.id] = player["level"]
+                        members.append(member)
+                    if members and not dry_run:
+                        await self._mee6_write(ctx.guild, members, levels, new_user, stats)
+            except Mee6Error as e:
+                if not stats.pages:
+                    return await ctx.send("No data was found within the Mee6 API.")
+                await ctx.send(chat.warning(f"{e} Next pages were not converted."))
+            stats.imported = len(levels)
+            if levels and not dry_run:
+                self._leaderboards.invalidate(ctx.guild.id)
+                self._leaderboards.invalidate(GLOBAL)
+            await self._mee6_rewards(ctx, levels, stats)
+        await ctx.send(chat.box(tabulate(stats.rows())))
+
+    async def _mee6_write(self, guild, members, levels, new_user, stats):
+        started = time.monotonic()
+        await self.db.users.bulk_write(
+            [
+                op
+                for member in members
+                for op in level_ops(member.id, member.name, guild.id, levels[member.id], new_user)
+            ],
+            ordered=True,
+        )
+        if self._members.writing:
+            user_ids = [str(member.id) for member in members]
+            # new members are copied from user documents, existing ones only get new level
+            await self._members.write(
+                [
+                    op
+                    async for userinfo in self.db.users.find(
+                        {"user_id": {"$in": user_ids}},
+                        projection={
+                            "user_id": 1,
+                            "username": 1,
+                            "rep": 1,
+                            f"servers.{guild.id}": 1,
+                        },
+                    )
+                    for op in member_ops(userinfo)
+                ]
+            )
+            await self._members.write(
+                [exp_op(guild.id, member.id, levels[member.id], 0) for member in members]
+            )
+        for member in members:
+            if str(member.id) in self._xp_buffer:
+                await self._evict_xp_state(str(member.id))
+        stats.write_time += time.monotonic() - started
+
+    async def _mee6_rewards(self, ctx, levels, stats):
+        """Give role and badge rewards of every level reached by converted members"""
+        started = time.monotonic()
+        rewards = await self._rewards.get(self.db, ctx.guild)
+        if not rewards:
+            return
+        forbidden = False
+        async for member_id, level in AsyncIter(levels.items(), steps=500):
+            member = ctx.guild.get_member(member_id)
+            if member is None:
+                continue
+            current = {role.id for role in member.roles[1:]}
+            reached = reached_roles(rewards, level, current)
+            if reached == current:
+                continue
+            if forbidden:
+                # remaining members are only counted, every update would fail the same way
+                stats.roles_skipped += 1
+                continue
+            stats.roles_updated += 1
+            if stats.dry_run:
+                continue
+            roles = [role for role in member.roles[1:] if role.id in reached] + [
+                role
+                for role_id in reached - current
+                if (role := ctx.guild.get_role(role_id)) is not None
+            ]
+            try:
+                await member.edit(roles=roles, reason="Mee6 levels conversion")
+            except discord.Forbidden:
+                stats.roles_failed += 1
+                forbidden = True
+            except discord.HTTPException:
+                stats.roles_failed += 1
+        if forbidden:
+            await ctx.send(
+                "Levelup roles update failed: Missing Permissions. "
+                f"Roles of {stats.roles_skipped} more members were not updated."
+            )
+        for reward_level, reward in rewards.items():
+            user_ids = [user_id for user_id, level in levels.items() if level >= reward_level]
+            if not reward.badges or not user_ids:
+                continue
+            for key, badge in reward.badges.items():
+                if stats.dry_run:
+                    stats.badges_given += len(user_ids)
+                else:
+                    stats.badges_given += await give_badge(self.db.users, user_ids, key, badge)
+        stats.rewards_time += time.monotonic() - started
 
     @mee6.command(name="roles", aliases=["ranks"])
     @commands.guild_only()
@@ -132,6 +190,7 @@ class MeeSix(MixinMeta):
                     await self.db.roles.update_one(
                         {"server_id": str(server.id)}, {"$set": {"roles": server_roles["roles"]}}
                     )
+                self._rewards.invalidate(server.id)
 
                 await ctx.send(
                     "The `{}` role has been linked to level `{}`".format(role_name, level)
@@ -1,5 +1,5 @@
 from collections import OrderedDict
-from typing import Optional
+from typing import Optional, Union
 
 import discord
 from redbot.core import commands
@@ -7,6 +7,7 @@ from redbot.core.utils import chat_formatting as chat
 from redbot.core.utils.menus import DEFAULT_CONTROLS, menu
 
 from leveler.abc import MixinMeta
+from leveler.badge_updates import badge_key, give_badge, remove_badge, take_badge, update_badge
 
 from .basecmd import LevelAdminBaseCMD
 
@@ -106,6 +107,7 @@ class Badge(MixinMeta):
             await self.db.badges.update_one(
                 {"server_id": str(serverid)}, {"$set": {"badges": badges["badges"]}}
             )
+            self._rewards.invalidate(server.id)
             await ctx.send("`{}` Badge added in `{}` server.".format(name, servername))
         else:
             # update badge in the server
@@ -113,29 +115,13 @@ class Badge(MixinMeta):
             await self.db.badges.update_one(
                 {"server_id": str(serverid)}, {"$set": {"badges": badges["badges"]}}
             )
+            self._rewards.invalidate(server.id)
 
-            # go though all users and update the badge.
+            # badge is copied to users, so it's updated for all users that have it.
             # Doing it this way because dynamic does more accesses when doing profile
-            async for user in self.db.users.find({}):
-                try:
-                    user = await self._badge_convert_dict(user)
-                    userbadges = user["badges"]
-                    badge_name = "{}_{}".format(name, serverid)
-                    if badge_name in userbadges.keys():
-                        user_priority_num = userbadges[badge_name]["priority_num"]
-                        new_badge["priority_num"] = (
-                            user_priority_num  # maintain old priority number set by user
-                        )
-                        userbadges[badge_name] = new_badge
-                        await self.db.users.update_one(
-                            {"user_id": user["user_id"]},
-                            {"$set": {"badges": userbadges}},
-                        )
-                except Exception as exc:
-                    self.log.error(
-                        f"Unable to update badge {name} for {user['user_id']}", exc_info=exc
-                    )
-            await ctx.send("The `{}` badge has been updated".format(name))
+            async with ctx.typing():
+                updated = await update_badge(self.db.users, badge_key(name, serverid), new_badge)
+            await ctx.send("The `{}` badge has been updated for {} users".format(name, updated))
 
     @commands.is_owner()
     @badge.command()
@@ -170,43 +156,38 @@ class Badge(MixinMeta):
                 {"server_id": serverbadges["server_id"]},
                 {"$set": {"badges": serverbadges["badges"]}},
             )
+            self._rewards.invalidate(server.id)
             # remove the badge if there
             async with ctx.typing():
-                async for user_info_temp in self.db.users.find({}):
-                    try:
-                        user_info_temp = await self._badge_convert_dict(user_info_temp)
-
-                        badge_name = "{}_{}".format(name, serverid)
-                        if badge_name in user_info_temp["badges"].keys():
-                            del user_info_temp["badges"][badge_name]
-                            await self.db.users.update_one(
-                                {"user_id": user_info_temp["user_id"]},
-                                {"$set": {"badges": user_info_temp["badges"]}},
-                            )
-                    except Exception as exc:
-                        self.log.error(
-                            f"Unable to delete badge {name} from {user_info_temp['user_id']}",
-                            exc_info=exc,
-                        )
-
-            await ctx.send("The `{}` badge has been removed.".format(name))
+                removed = await remove_badge(self.db.users, badge_key(name, serverid))
+
+            await ctx.send("The `{}` badge has been removed from {} users.".format(name, removed))
         else:
             await ctx.send("That badge does not exist.")
 
     @commands.mod_or_permissions(manage_roles=True)
     @badge.command()
     @commands.guild_only()
-    async def give(self, ctx, user: discord.Member, is_global: Optional[bool], name: str):
+    async def give(
+        self,
+        ctx,
+        user: Union[discord.Member, discord.Role],
+        is_global: Optional[bool],
+        name: str,
+    ):
         """Give a user a badge by its name.
 
         Options:
-        `user`: User to get a badge
+        `user`: User to get a badge, or role to give badge to all its members
         `is_global`: Owner-only. Give global badge.
         `name`: Badge name."""
         org_user = ctx.message.author
         server_id = (
             "global" if is_global and await self.bot.is_owner(org_user) else str(ctx.guild.id)
         )
+        if isinstance(user, discord.Role):
+            await self._role_badge(ctx, user, server_id, name, give=True)
+            return
         if user.bot:
             await ctx.send_help()
             return
@@ -237,10 +218,13 @@ class Badge(MixinMeta):
     @commands.mod_or_permissions(manage_roles=True)
     @badge.command()
     @commands.guild_only()
-    async def take(self, ctx, user: discord.Member, name: str):
+    async def take(self, ctx, user: Union[discord.Member, discord.Role], name: str):
         """Take a user's badge.
 
-        Indicate the user and the badge's name."""
+        Indicate the user (or role, to take badge from all its members) and the badge's name."""
+        if isinstance(user, discord.Role):
+            await self._role_badge(ctx, user, str(ctx.guild.id), name, give=False)
+            return
         if user.bot:
             await ctx.send_help()
             return
@@ -276,6 +260,44 @@ class Badge(MixinMeta):
             else:
                 await ctx.send("You can't take away purchasable badges!")
 
+    async def _role_badge(self, ctx, role: discord.Role, server_id: str, name: str, give: bool):
+        """Give or take badge from all members of role, with bulk updates
+
+        Members that are not in database are skipped. Purchasable badges are not taken."""
+        serverbadges = await self.db.badges.find_one({"server_id": server_id})
+        if not serverbadges or name not in serverbadges["badges"]:
+            await ctx.send("That badge doesn't exist in this server!")
+            return
+        members = [member.id for member in role.members if not member.bot]
+        action = "Giving" if give else "Taking"
+        message = await ctx.send(
+            "{} the `{}` badge: 0/{} members...".format(action, name, len(members))
+        )
+
+        async def progress(done, total):
+            await message.edit(
+                content="{} the `{}` badge: {}/{} members...".format(action, name, done, total)
+            )
+
+        key = badge_key(name, server_id)
+        async with ctx.typing():
+            if give:
+                changed = await give_badge(
+                    self.db.users, members, key, serverbadges["badges"][name], progress
+                )
+            else:
+                changed = await take_badge(self.db.users, members, key, progress)
+        await message.edit(
+            content="{} has {} the `{}` badge {} {} members of {}!".format(
+                ctx.author.mention,
+                "given" if give else "taken",
+                name,
+                "to" if give else "from",
+                changed,
+                chat.escape(role.name, mass_mentions=True),
+            )
+        )
+
     @commands.mod_or_permissions(manage_roles=True)
     @badge.command(name="link")
     @commands.guild_only()
@@ -302,6 +324,7 @@ class Badge(MixinMeta):
                 {"server_id": str(server.id)},
                 {"$set": {"badges": server_linked_badges["badges"]}},
             )
+        self._rewards.invalidate(server.id)
         await ctx.send("The `{}` badge has been linked to level `{}`".format(badge_name, level))
 
     @commands.admin_or_permissions(manage_roles=True)
@@ -320,6 +343,7 @@ class Badge(MixinMeta):
             await self.db.badgelinks.update_one(
                 {"server_id": str(server.id)}, {"$set": {"badges": badge_links}}
             )
+            self._rewards.invalidate(server.id)
             await ctx.send(
                 "Badge/Level association `{}`/`{}` removed.".format(
                     badge_name, badge_links[badge_name]
@@ -1,14 +1,23 @@
-from collections import Counter
+import asyncio
+import time
+from contextlib import suppress
 
 from motor import version as motorversion
 from PIL import features as pilfeatures
 from pymongo import version as pymongoversion
 from redbot.core import commands
+from redbot.core.data_manager import bundled_data_path
 from redbot.core.utils import AsyncIter
 from redbot.core.utils import chat_formatting as chat
+from redbot.vendored.discord.ext import menus
 from tabulate import tabulate
 
+from leveler import card_templates, integrity, render_assets, text_layout
 from leveler.abc import MixinMeta
+from leveler.benchmarks import bench_cards, bench_encoders, bench_levels
+from leveler.indexes import MAX_GUILD_INDEXES
+from leveler.members import MIGRATING, OFF, READY
+from leveler.menus.integrity import IntegrityPager
 
 from .basecmd import LevelAdminBaseCMD
 
@@ -42,18 +51,212 @@ class Debugging(MixinMeta):
             except Exception as e:
                 feature = (feature, type(e))
             pil_features.append(feature)
-        # noinspection PyProtectedMember
-        await ctx.send(
-            chat.box(
+        await ctx.send_interactive(
+            chat.pagify(
                 tabulate(
                     [
-                        ("DB lock locked", self._db_lock.locked()),
                         (
-                            "DB lock queue",
+                            "User locks",
+                            "{} stripes, {} locked, {} waiting".format(
+                                len(self._user_locks.stripes),
+                                self._user_locks.locked_count,
+                                self._user_locks.waiters,
+                            ),
+                        ),
+                        (
+                            "User locks contention",
+                            "{}/{} acquisitions".format(
+                                self._user_locks.contended, self._user_locks.acquisitions
+                            ),
+                        ),
+                        (
+                            "Most contended stripes",
+                            tabulate(
+                                self._user_locks.stats(),
+                                headers=[
+                                    "#",
+                                    "Locked",
+                                    "Waiting",
+                                    "Max waiting",
+                                    "Acquired",
+                                    "Contended",
+                                ],
+                                tablefmt="psql",
+                            ),
+                        ),
+                        (
+                            "Guild settings snapshots",
+                            "{} cached, {} built".format(
+                                len(self._guild_settings), self._guild_settings.builds
+                            ),
+                        ),
+                        (
+                            "Spam gate",
+                            "{} users, {} blocked, {} passed, {} unknown".format(
+                                len(self._spam_gate),
+                                self._spam_gate.blocked,
+                                self._spam_gate.passed,
+                                self._spam_gate.unknown,
+                            ),
+                        ),
+                        (
+                            "Known users",
+                            "{} users, {} hits, {} misses".format(
+                                len(self._known_users),
+                                self._known_users.hits,
+                                self._known_users.misses,
+                            ),
+                        ),
+                        (
+                            "Level rewards index",
+                            "{} guilds, {} builds".format(
+                                len(self._rewards), self._rewards.builds
+                            ),
+                        ),
+                        (
+                            "Level-up announcements",
+                            "{} queued (max {}), {} in {} messages, {} dropped, {} failed".format(
+                                self._announcements.queued,
+                                self._announcements.queued_max,
+                                self._announcements.announced,
+                                self._announcements.messages,
+                                self._announcements.dropped,
+                                self._announcements.failed,
+                            ),
+                        ),
+                        (
+                            "Level-up announcement delay",
+                            "{:.2f}s average, {:.2f}s throttled".format(
+                                self._announcements.average_delay,
+                                self._announcements.throttled,
+                            ),
+                        ),
+                        (
+                            "Members layout",
+                            "{}{}, {} writes, {} failed".format(
+                                self._members.state,
+                                " (copying)" if self._members.migrating else "",
+                                self._members.writes,
+                                self._members.failed_writes,
+                            ),
+                        ),
+                        ("XP cache users", len(self._xp_buffer)),
+                        ("XP pending users", self._xp_buffer.pending_count),
+                        (
+                            "XP last flush",
+                            (
+                                "N/A"
+                                if self._xp_buffer.last_flush is None
+                                else "{} ago ({:.3f}s, {} writes total, {} failed)".format(
+                                    chat.humanize_timedelta(
+                                        seconds=time.time() - self._xp_buffer.last_flush
+                                    )
+                                    or "0 seconds",
+                                    self._xp_buffer.last_flush_duration,
+                                    self._xp_buffer.flushed_ops,
+                                    self._xp_buffer.failed_flushes,
+                                )
+                            ),
+                        ),
+                        (
+                            "Leaderboard cache",
+                            "{} boards, {} hits, {} misses".format(
+                                len(self._leaderboards),
+                                self._leaderboards.hits,
+                                self._leaderboards.misses,
+                            ),
+                        ),
+                        (
+                            "Global leaderboards",
                             (
                                 "N/A"
-                                if self._db_lock._waiters is None
-                                else len(self._db_lock._waiters)
+                                if self._leaderboards.global_boards.last_refresh is None
+                                else "refreshed {} ago ({:.3f}s), every {}s\n"
+                                "built {} ago, {} builds, {} incremental refreshes\n"
+                                "{} changed users pending, stale for {}".format(
+                                    chat.humanize_timedelta(
+                                        seconds=time.time()
+                                        - self._leaderboards.global_boards.last_refresh
+                                    )
+                                    or "0 seconds",
+                                    self._leaderboards.global_boards.last_refresh_duration,
+                                    self._leaderboards.global_boards.interval,
+                                    chat.humanize_timedelta(
+                                        seconds=time.time()
+                                        - self._leaderboards.global_boards.last_build
+                                    )
+                                    or "0 seconds",
+                                    self._leaderboards.global_boards.builds,
+                                    self._leaderboards.global_boards.refreshes,
+                                    self._leaderboards.global_boards.changed_count,
+                                    chat.humanize_timedelta(
+                                        seconds=self._leaderboards.global_boards.staleness
+                                    )
+                                    or "0 seconds",
+                                )
+                            ),
+                        ),
+                        (
+                            "Render pool",
+                            "{} {} workers, {} running, {} queued (max {})\n"
+                            "{} renders, {} failed, avg wait {:.3f}s, avg render {:.3f}s".format(
+                                self._render_pool.workers,
+                                self._render_pool.pool_type,
+                                self._render_pool.running,
+                                self._render_pool.queued,
+                                self._render_pool.max_queued,
+                                self._render_pool.completed,
+                                self._render_pool.failed,
+                                self._render_pool.wait_time
+                                / (self._render_pool.completed + self._render_pool.failed or 1),
+                                self._render_pool.render_time / (self._render_pool.completed or 1),
+                            ),
+                        ),
+                        (
+                            "Image cache",
+                            "{} in memory ({} hits, {} misses)\n"
+                            "{} files on disk ({}), {} disk hits\n"
+                            "{} downloads, {} revalidated, {} failed".format(
+                                len(self._images),
+                                self._images.memory_hits,
+                                self._images.memory_misses,
+                                self._images.disk_files,
+                                chat.humanize_number(self._images.disk_size) + " bytes",
+                                self._images.disk_hits,
+                                self._images.downloads,
+                                self._images.revalidated,
+                                self._images.failed,
+                            ),
+                        ),
+                        (
+                            "Card cache",
+                            "{} cards ({} bytes), {} hits, {} misses".format(
+                                len(self._cards),
+                                chat.humanize_number(self._cards.size),
+                                self._cards.hits,
+                                self._cards.misses,
+                            ),
+                        ),
+                        (
+                            "Avatar cache",
+                            "{} avatars ({} bytes), {} hits, {} misses, "
+                            "{} downloads, {} failed".format(
+                                len(self._avatars),
+                                chat.humanize_number(self._avatars.size),
+                                self._avatars.hits,
+                                self._avatars.misses,
+                                self._avatars.downloads,
+                                self._avatars.failed,
+                            ),
+                        ),
+                        (
+                            "Render assets cache",
+                            tabulate(
+                                render_assets.cache_stats()
+                                + card_templates.cache_stats()
+                                + text_layout.cache_stats(),
+                                headers=["Asset", "Cached", "Hits", "Misses"],
+                                tablefmt="psql",
                             ),
                         ),
                         ("pymongo version", pymongoversion),
@@ -70,8 +273,10 @@ class Debugging(MixinMeta):
                         ),
                     ],
                     tablefmt="psql",
-                )
-            )
+                ),
+                page_length=1992,
+            ),
+            box_lang="",
         )
 
     @debug_commands.group(name="database", aliases=["db"])
@@ -109,6 +314,186 @@ class Debugging(MixinMeta):
             box_lang="",
         )
 
+    @db_commands.command(name="indexes")
+    async def db_indexes(self, ctx):
+        """Show database indexes and query plans of most used queries
+
+        Every plan should end with IXSCAN. COLLSCAN means that query reads whole collection."""
+        server = ctx.guild
+        async with ctx.typing():
+            indexes = await self._indexes.describe()
+            plans = [
+                ("User lookup", await self._indexes.explain_find({"user_id": str(ctx.author.id)})),
+                (
+                    "Global rank",
+                    await self._indexes.explain_count({"total_exp": {"$gt": 0}}),
+                ),
+                (
+                    "Global rep rank",
+                    await self._indexes.explain_count({"rep": {"$gt": 0}}),
+                ),
+                (
+                    "Global leaderboard",
+                    await self._indexes.explain_find({}, [("total_exp", -1)]),
+                ),
+            ]
+            if server and self._members.reading:
+                plans.extend(
+                    [
+                        (
+                            "Server rank",
+                            await self._indexes.explain_count(
+                                {"guild_id": str(server.id), "level": {"$gt": 0}},
+                                self._members.members,
+                            ),
+                        ),
+                        (
+                            "Server leaderboard",
+                            await self._indexes.explain_find(
+                                {"guild_id": str(server.id)},
+                                [("level", -1), ("current_exp", -1)],
+                                self._members.members,
+                            ),
+                        ),
+                    ]
+                )
+            elif server:
+                plans.extend(
+                    [
+                        (
+                            "Server rank",
+                            await self._indexes.explain_count(
+                                {f"servers.{server.id}.level": {"$gt": 0}}
+                            ),
+                        ),
+                        (
+                            "Server leaderboard",
+                            await self._indexes.explain_find(
+                                {f"servers.{server.id}.level": {"$exists": True}},
+                                [
+                                    (f"servers.{server.id}.level", -1),
+                                    (f"servers.{server.id}.current_exp", -1),
+                                ],
+                            ),
+                        ),
+                    ]
+                )
+        await ctx.send_interactive(
+            chat.pagify(
+                "\n\n".join(
+                    [
+                        tabulate(indexes, headers=["Index", "Keys", "Options"]),
+                        tabulate(
+                            self._indexes.status.items(),
+                            headers=["Managed index", "Status"],
+                        ),
+                        "Server leaderboard indexes: {}/{}".format(
+                            len(self._indexes.guild_indexes), MAX_GUILD_INDEXES
+                        ),
+                        tabulate(plans, headers=["Query", "Plan"]),
+                    ]
+                ),
+                page_length=1992,
+            ),
+            box_lang="",
+        )
+
+    @db_commands.group(name="members")
+    async def db_members(self, ctx):
+        """Per-guild data layout commands.
+
+        By default, levels and XP of user on every guild are stored in user's document.
+        Members layout stores them as separate documents with same indexes for all guilds,
+        so server leaderboards and ranks don't need per-guild indexes.
+
+        Migration copies existing data in background, and can be paused and continued.
+        User documents are written in both layouts, so migration can be reverted."""
+
+    @db_members.command(name="status")
+    async def db_members_status(self, ctx):
+        """Show migration progress"""
+        progress = await self.config.members_migration()
+        await ctx.send(
+            chat.box(
+                tabulate(
+                    [
+                        ("State", progress["state"]),
+                        ("Copying", self._members.migrating),
+                        ("Last copied user document", progress["last_id"] or "N/A"),
+                        ("Users copied", progress["users"]),
+                        ("Members copied", progress["members"]),
+                        ("User documents", await self.db.users.estimated_document_count()),
+                        (
+                            "Member documents",
+                            await self.db.members.estimated_document_count(),
+                        ),
+                        ("Writes to members", self._members.writes),
+                        ("Failed writes to members", self._members.failed_writes),
+                    ]
+                )
+            )
+        )
+
+    @db_members.command(name="migrate")
+    async def db_members_migrate(self, ctx, batch_size: int = 500):
+        """Start or continue migration to members layout
+
+        Server leaderboards and ranks are read from members when migration finishes."""
+        if not 0 < batch_size <= 10000:
+            await ctx.send(chat.error("Batch size should be between 1 and 10000."))
+            return
+        if self._members.migrating:
+            await ctx.send(chat.info("Migration is already running."))
+            return
+        if self._members.state == READY:
+            await ctx.send(chat.info("Members are already migrated."))
+            return
+        async with ctx.typing():
+            await self._indexes.setup_members(self.db.members)
+            if self._members.state == OFF:
+                # no XP changes are in flight when both layouts start being written
+                async with self._user_locks.all():
+                    await self._flush_xp_buffer()
+                    await self.config.members_migration.state.set(MIGRATING)
+                    self._members.setup(self.db, MIGRATING)
+        self._members.migration = asyncio.create_task(self._migrate_members(batch_size))
+        await ctx.send(
+            chat.info(
+                "Migration started. Use `{}lvladmin debug db members status` "
+                "to see its progress.".format(ctx.clean_prefix)
+            )
+        )
+
+    @db_members.command(name="pause")
+    async def db_members_pause(self, ctx):
+        """Pause migration
+
+        Both layouts are still written, and migration can be continued later."""
+        if not self._members.migrating:
+            await ctx.send(chat.info("Migration is not running."))
+            return
+        self._members.stop()
+        await ctx.tick()
+
+    @db_members.command(name="disable")
+    async def db_members_disable(self, ctx):
+        """Switch back to user documents layout and drop members collection
+
+        User documents are always up to date, so no data is lost."""
+        if self._members.migrating:
+            migration = self._members.migration
+            self._members.stop()
+            with suppress(asyncio.CancelledError):
+                await migration
+        async with ctx.typing():
+            async with self._user_locks.all():
+                await self._flush_xp_buffer()
+                await self.config.members_migration.clear()
+                self._members.setup(self.db, OFF)
+                await self.db.members.drop()
+            self._leaderboards.invalidate()
+        await ctx.tick()
+
     @db_commands.group(name="integrity")
     async def db_integrity(self, ctx):
         """Database integrity commands."""
@@ -118,53 +503,95 @@ class Debugging(MixinMeta):
         """Check Database integrity.
 
         Everything should be True. Otherwise there is malfunction somewhere in XP handling."""
-        c = Counter()
-        invalid_users = []
         async with ctx.typing():
-            async for user in self.db.users.find({}):
-                total_xp = 0
-                for server in user["servers"]:
-                    xp = await self._level_exp(user["servers"][server]["level"])
-                    total_xp += xp
-                    total_xp += user["servers"][server]["current_exp"]
-                valid = total_xp == user["total_exp"]
-                c[valid] += 1
-                if not valid:
-                    invalid_users.append(
-                        (
-                            user["username"],
-                            user["user_id"],
-                            total_xp,
-                            user["total_exp"],
-                            user["total_exp"] - total_xp,
-                        )
-                    )
-        await ctx.send(chat.box(tabulate(c.most_common())))
-        if invalid_users:
-            await ctx.send_interactive(
-                chat.pagify(
-                    tabulate(
-                        invalid_users,
-                        headers=["Username", "ID", "Calculated total XP", "Total XP", "Diff"],
-                    ),
-                    page_length=1992,
-                ),
-                box_lang="",
-            )
+            summary = await self.db.users.aggregate(
+                integrity.summary_pipeline(), allowDiskUse=True
+            ).to_list(None)
+        await ctx.send(chat.box(tabulate([(row["_id"], row["count"]) for row in summary])))
+        if any(not row["_id"] for row in summary):
+            cursor = self.db.users.aggregate(integrity.mismatch_pipeline(), allowDiskUse=True)
+            await menus.MenuPages(
+                IntegrityPager(cursor), timeout=60, clear_reactions_after=True
+            ).start(ctx)
 
     @db_integrity.command(name="fix")
     async def db_integrity_fix(self, ctx):
-        """Artificially fix Database integrity."""
+        """Artificially fix Database integrity.
+
+        Total XP is recalculated by database, XP processing is not stopped."""
+
+        async def repaired(user_ids):
+            for user_id in user_ids:
+                if user_id in self._xp_buffer:
+                    await self._evict_xp_state(user_id)
+
         async with ctx.typing():
-            async with self._db_lock:
-                async for user in self.db.users.find({}):
-                    total_xp = 0
-                    for server in user["servers"]:
-                        xp = await self._level_exp(user["servers"][server]["level"])
-                        total_xp += xp
-                        total_xp += user["servers"][server]["current_exp"]
-                    if total_xp != user["total_exp"]:
-                        await self.db.users.update_one(
-                            {"user_id": user["user_id"]}, {"$set": {"total_exp": total_xp}}
-                        )
-        await ctx.tick()
+            fixed = await integrity.repair(self.db.users, repaired)
+        if fixed:
+            self._leaderboards.invalidate()
+        await ctx.send(chat.info("Fixed total XP of {} users.".format(fixed)))
+
+    @debug_commands.group(name="benchmark", aliases=["bench"])
+    async def benchmark_commands(self, ctx):
+        """Measure performance of leveler internals"""
+
+    @benchmark_commands.command(name="levels")
+    async def benchmark_levels(self, ctx, users: int = 100_000):
+        """Compare ways of calculating server XP for leaderboard of `users` users
+
+        Blocks the bot while running."""
+        if not 0 < users <= 1_000_000:
+            await ctx.send(chat.error("Number of users should be between 1 and 1000000."))
+            return
+        async with ctx.typing():
+            results = await bench_levels(users)
+        await ctx.send(
+            chat.box(
+                tabulate(
+                    results,
+                    headers=["Method", "Measured users", f"Seconds for {users} users", "µs/user"],
+                    floatfmt=".4f",
+                )
+            )
+        )
+
+    @benchmark_commands.command(name="cards")
+    async def benchmark_cards(self, ctx, runs: int = 20):
+        """Compare CPU time of rank, levelup and profile renders with and without caches
+
+        Each card is rendered `runs` times for each mode.
+        Benchmark uses its own templates and assets caches, shared ones are not affected."""
+        if not 0 < runs <= 500:
+            await ctx.send(chat.error("Number of runs should be between 1 and 500."))
+            return
+        async with ctx.typing():
+            results = await bench_cards(str(bundled_data_path(self)), runs)
+        await ctx.send(
+            chat.box(
+                tabulate(
+                    results,
+                    headers=["Card", "ms uncached", "ms cached", "Speedup"],
+                    floatfmt=".2f",
+                )
+            )
+        )
+
+    @benchmark_commands.command(name="encoders")
+    async def benchmark_encoders(self, ctx, runs: int = 10):
+        """Compare encode time and size of rank, levelup and profile cards for each encoder
+
+        Each card is encoded `runs` times with each encoder."""
+        if not 0 < runs <= 100:
+            await ctx.send(chat.error("Number of runs should be between 1 and 100."))
+            return
+        async with ctx.typing():
+            results = await bench_encoders(str(bundled_data_path(self)), runs)
+        await ctx.send(
+            chat.box(
+                tabulate(
+                    results,
+                    headers=["Card", "Encoder", "ms", "Bytes"],
+                    floatfmt=".2f",
+                )
+            )
+        )
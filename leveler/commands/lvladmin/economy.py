@@ -34,6 +34,7 @@ class Economy(MixinMeta):
             return
 
         await self.config.guild(server).msg_credits.set(currency)
+        self._guild_settings.invalidate(server.id)
         await ctx.send("Credits per message logged set to `{}`.".format(currency))
 
     @commands.is_owner()
@@ -56,6 +56,7 @@ class Roles(MixinMeta):
                 {"server_id": str(server.id)},
                 {"$set": {"roles": server_roles["roles"]}},
             )
+        self._rewards.invalidate(server.id)
 
         if remove_role:
             await ctx.send(
@@ -88,6 +89,7 @@ class Roles(MixinMeta):
             await self.db.roles.update_one(
                 {"server_id": str(server.id)}, {"$set": {"roles": roles}}
             )
+            self._rewards.invalidate(server.id)
         else:
             await ctx.send("The `{}` role is not linked to any levels!".format(role_to_unlink))
 
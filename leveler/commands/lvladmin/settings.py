@@ -2,11 +2,14 @@ from functools import partial
 
 import discord
 from fixcogsutils.formatting import bool_emojify
+from pymongo import UpdateMany
 from redbot.core import commands
 from redbot.core.utils import chat_formatting as chat
 from tabulate import tabulate
 
 from leveler.abc import MixinMeta
+from leveler.encoders import ENCODER_NAMES, ENCODERS, resolve
+from leveler.render_pool import POOL_TYPES
 
 from .basecmd import LevelAdminBaseCMD
 
@@ -38,6 +41,14 @@ class Settings(MixinMeta):
                     "Unique registered users": str(await self.db.users.count_documents({})),
                     "XP per message": "{}-{}".format(*await self.config.xp()),
                     "Min message length": str(await self.config.message_length()),
+                    "XP write interval": "{}s".format(await self.config.xp_flush_interval()),
+                    "Global top refresh interval": "{}s".format(
+                        await self.config.global_top_interval()
+                    ),
+                    "Render pool": "{} {}".format(
+                        await self.config.render_workers(), await self.config.render_pool()
+                    ),
+                    "Card encoder": await self.config.card_encoder(),
                     "Global top": bool_emojify(await self.config.allow_global_top()),
                     "Mentions": bool_emojify(await self.config.mention()),
                     "Rep users rotation": bool_emojify(await self.config.rep_rotation()),
@@ -66,6 +77,8 @@ class Settings(MixinMeta):
         """Resets all reputation points from MongoDB."""
         async with ctx.typing():
             await self.db.users.update_many({}, {"$set": {"rep": 0}})
+            await self._members.write([UpdateMany({}, {"$set": {"rep": 0}})])
+            self._leaderboards.invalidate()
             await ctx.send("All reputation points have been removed.")
 
     @lvladmin.command()
@@ -88,10 +101,12 @@ class Settings(MixinMeta):
         if channel.id in await self.config.guild(server).ignored_channels():
             async with self.config.guild(server).ignored_channels() as channels:
                 channels.remove(channel.id)
+            self._guild_settings.invalidate(server.id)
             await ctx.send(f"Messages in {channel.mention} will give exp now.")
         else:
             async with self.config.guild(server).ignored_channels() as channels:
                 channels.append(channel.id)
+            self._guild_settings.invalidate(server.id)
             await ctx.send(f"Messages in {channel.mention} will not give exp now.")
 
     @commands.is_owner()
@@ -178,6 +193,7 @@ class Settings(MixinMeta):
         if (min_xp or max_xp) < 0:
             return await ctx.send("The XP amounts can't be less then zero.")
         await self.config.xp.set([min_xp, max_xp])
+        self._guild_settings.invalidate()
         await ctx.send(f"XP given has been set to a range of {min_xp} to {max_xp} XP per message.")
 
     @lvladmin.command()
@@ -189,8 +205,77 @@ class Settings(MixinMeta):
         if message_length < 0:
             raise commands.BadArgument
         await self.config.message_length.set(message_length)
+        self._guild_settings.invalidate()
         await ctx.tick()
 
+    @lvladmin.command(name="xpinterval")
+    @commands.is_owner()
+    async def xp_flush_interval(self, ctx, seconds: int = 10):
+        """Set how often XP gained from messages is written to database.
+
+        XP is accumulated in memory and written in batches,
+        so in case of crash, up to this amount of seconds of XP can be lost.
+        Level-ups are always written immediately.
+        Use `0` to write XP on every message, e.g. if several bots share one database."""
+        if not 0 <= seconds <= 300:
+            await ctx.send("Interval must be between 0 and 300 seconds.")
+            return
+        await self.config.xp_flush_interval.set(seconds)
+        self._guild_settings.invalidate()
+        self._xp_buffer.wakeup.set()
+        await ctx.tick()
+
+    @lvladmin.command(name="globalinterval")
+    @commands.is_owner()
+    async def global_top_interval(self, ctx, seconds: int = 300):
+        """Set how often global leaderboards and ranks are refreshed.
+
+        XP changes are shown immediately, but new users and changes of rep
+        are shown after refresh."""
+        if not 10 <= seconds <= 3600:
+            await ctx.send("Interval must be between 10 and 3600 seconds.")
+            return
+        await self.config.global_top_interval.set(seconds)
+        self._leaderboards.global_boards.wakeup.set()
+        await ctx.tick()
+
+    @lvladmin.command(name="renderpool")
+    @commands.is_owner()
+    async def render_pool(self, ctx, pool_type: str = "thread", workers: int = 2):
+        """Set how images are rendered.
+
+        `thread` pool is good enough for most bots.
+        `process` pool renders images in separate processes, bypassing GIL,
+        at cost of memory and transferring images between processes.
+        Renders above `workers` count wait in queue."""
+        pool_type = pool_type.lower()
+        if pool_type not in POOL_TYPES:
+            await ctx.send("Pool type must be one of: {}.".format(chat.humanize_list(POOL_TYPES)))
+            return
+        if not 1 <= workers <= 32:
+            await ctx.send("Workers count must be between 1 and 32.")
+            return
+        await self.config.render_pool.set(pool_type)
+        await self.config.render_workers.set(workers)
+        await self._render_pool.configure(workers, pool_type)
+        await ctx.tick()
+
+    @lvladmin.command(name="encoder")
+    @commands.is_owner()
+    async def card_encoder(self, ctx, encoder: str = "auto"):
+        """Set how rank, profile and levelup cards are encoded.
+
+        `auto` uses lossless WebP if Pillow supports it, and PNG otherwise.
+        Use `[p]lvladmin debug benchmark encoders` to compare encode time and size."""
+        encoder = encoder.lower()
+        if encoder not in ENCODER_NAMES:
+            await ctx.send("Encoder must be one of: {}.".format(chat.humanize_list(ENCODER_NAMES)))
+            return
+        await self.config.card_encoder.set(encoder)
+        await ctx.send(
+            "Cards will be encoded as: {}.".format(ENCODERS[resolve(encoder)].description)
+        )
+
     @lvladmin.command(name="globaltop")
     @commands.is_owner()
     async def allow_global_top(self, ctx):
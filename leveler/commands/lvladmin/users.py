@@ -2,9 +2,12 @@ import time
 from typing import Union
 
 import discord
+from pymongo import ReturnDocument
 from redbot.core import commands
 
 from leveler.abc import MixinMeta
+from leveler.members import exp_op
+from leveler.xp_buffer import set_level_pipeline
 
 from .basecmd import LevelAdminBaseCMD
 
@@ -32,14 +35,22 @@ class Users(MixinMeta):
                 return
             user = discord.Object(user)
         chat_block = time.time() + bantime.total_seconds()
-        try:
-            await self.db.users.update_one(
-                {"user_id": str(user.id)}, {"$set": {"chat_block": chat_block}}
-            )
-        except Exception as exc:
-            await ctx.send("Unable to add chat block: {}".format(exc))
-        else:
-            await ctx.tick()
+        user_id = str(user.id)
+        async with self._user_locks(user_id):
+            # pending XP is written before block, and cached state is dropped after it,
+            # so next message reads chat block from database
+            await self._flush_xp_buffer(user_id)
+            try:
+                await self.db.users.update_one(
+                    {"user_id": user_id}, {"$set": {"chat_block": chat_block}}
+                )
+            except Exception as exc:
+                await ctx.send("Unable to add chat block: {}".format(exc))
+                return
+            finally:
+                self._xp_buffer.discard(user_id)
+                self._spam_gate.discard(user_id)
+        await ctx.tick()
 
     @commands.is_owner()
     @lvladmin.command()
@@ -51,36 +62,26 @@ class Users(MixinMeta):
         if user.bot:
             await ctx.send_help()
             return
-        await self._create_user(user, server)
-        userinfo = await self.db.users.find_one({"user_id": str(user.id)})
-
         if level < 0:
             await ctx.send("Please enter a positive number.")
             return
 
-        # get rid of old level exp
-        old_server_exp = 0
-        for i in range(userinfo["servers"][str(server.id)]["level"]):
-            old_server_exp += await self._required_exp(i)
-        userinfo["total_exp"] -= old_server_exp
-        userinfo["total_exp"] -= userinfo["servers"][str(server.id)]["current_exp"]
-
-        # add in new exp
-        total_exp = await self._level_exp(level)
-        userinfo["servers"][str(server.id)]["current_exp"] = 0
-        userinfo["servers"][str(server.id)]["level"] = level
-        userinfo["total_exp"] += total_exp
-
-        await self.db.users.update_one(
-            {"user_id": str(user.id)},
-            {
-                "$set": {
-                    "servers.{}.level".format(server.id): level,
-                    "servers.{}.current_exp".format(server.id): 0,
-                    "total_exp": userinfo["total_exp"],
-                }
-            },
-        )
+        await self._create_user(user, server)
+        user_id = str(user.id)
+        async with self._user_locks(user_id):
+            # pending XP is written before level change, and cached state is dropped after it
+            await self._flush_xp_buffer(user_id)
+            userinfo = await self.db.users.find_one_and_update(
+                {"user_id": user_id},
+                set_level_pipeline(server.id, level),
+                projection={"user_id": 1, f"servers.{server.id}": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            self._xp_buffer.discard(user_id)
+            self._spam_gate.discard(user_id)
+        await self._members.write([exp_op(server.id, user.id, level, 0)])
+        self._leaderboards.invalidate(server.id)
+        self._leaderboards.changed(user.id)
         await ctx.send(
             "{}'s Level has been set to `{}`.".format(user.mention, level),
             allowed_mentions=discord.AllowedMentions(users=await self.config.mention()),
@@ -5,6 +5,7 @@ from redbot.core import commands
 from redbot.core.utils import chat_formatting as chat
 
 from ..abc import CompositeMetaClass, MixinMeta
+from ..members import rep_op
 from ..menus.backgrounds import BackgroundMenu, BackgroundPager
 
 
@@ -45,6 +46,8 @@ class Other(MixinMeta, metaclass=CompositeMetaClass):
             await self.db.users.update_one(
                 {"user_id": str(user.id)}, {"$set": {"rep": userinfo["rep"] + 1}}
             )
+            await self._members.write([rep_op(user.id, userinfo["rep"] + 1)])
+            self._leaderboards.changed(user.id)
             await ctx.send(
                 "You have just given {} a reputation point!".format(user.mention),
                 allowed_mentions=discord.AllowedMentions(users=await self.config.mention()),
@@ -4,6 +4,7 @@ from redbot.core.utils import chat_formatting as chat
 from tabulate import tabulate
 
 from ..abc import CompositeMetaClass, MixinMeta
+from ..levels import server_exp
 
 
 class Profiles(MixinMeta, metaclass=CompositeMetaClass):
@@ -23,6 +24,7 @@ class Profiles(MixinMeta, metaclass=CompositeMetaClass):
 
         # creates user if doesn't exist
         await self._create_user(user, server)
+        await self._flush_xp_buffer(str(user.id))
         userinfo = await self.db.users.find_one({"user_id": str(user.id)})
 
         if await self.config.guild(ctx.guild).text_only():
@@ -31,7 +33,7 @@ class Profiles(MixinMeta, metaclass=CompositeMetaClass):
         else:
             async with ctx.channel.typing():
                 profile = await self.draw_profile(user, server)
-                file = discord.File(profile, filename="profile.png")
+                file = discord.File(profile, filename=profile.name)
                 await channel.send(
                     "User profile for {}".format(user.mention),
                     file=file,
@@ -84,6 +86,7 @@ class Profiles(MixinMeta, metaclass=CompositeMetaClass):
 
         # creates user if doesn't exist
         await self._create_user(user, server)
+        await self._flush_xp_buffer(str(user.id))
         userinfo = await self.db.users.find_one({"user_id": str(user.id)})
 
         # no cooldown for text only
@@ -93,7 +96,7 @@ class Profiles(MixinMeta, metaclass=CompositeMetaClass):
         else:
             async with channel.typing():
                 rank = await self.draw_rank(user, server)
-                file = discord.File(rank, filename="rank.png")
+                file = discord.File(rank, filename=rank.name)
                 await channel.send(
                     "Ranking & Statistics for {}".format(user.mention),
                     file=file,
@@ -124,14 +127,14 @@ class Profiles(MixinMeta, metaclass=CompositeMetaClass):
             await ctx.send_help()
             return
         server = ctx.guild
-        userinfo = await self.db.users.find_one({"user_id": str(user.id)})
-
         # creates user if doesn't exist
         await self._create_user(user, server)
-        total_server_exp = 0
-        for i in range(userinfo["servers"][str(server.id)]["level"]):
-            total_server_exp += await self._required_exp(i)
-        total_server_exp += userinfo["servers"][str(server.id)]["current_exp"]
+        await self._flush_xp_buffer(str(user.id))
+        userinfo = await self.db.users.find_one({"user_id": str(user.id)})
+        total_server_exp = server_exp(
+            userinfo["servers"][str(server.id)]["level"],
+            userinfo["servers"][str(server.id)]["current_exp"],
+        )
         data = {
             "Name": user.name,
             "Title": userinfo["title"],
@@ -1,16 +1,130 @@
+import asyncio
+import time
 from argparse import Namespace
-from asyncio import sleep
-from textwrap import shorten
+from contextlib import suppress
 
 from redbot.core import commands
-from redbot.core.utils import AsyncIter
 
 from ..abc import CompositeMetaClass, MixinMeta
 from ..argparsers import TopParser
+from ..leaderboard import GLOBAL, Leaderboard, LeaderboardRows
+from ..levels import server_exp_batch
 from ..menus.top import TopMenu, TopPager
 
 
 class Top(MixinMeta, metaclass=CompositeMetaClass):
+    async def _get_leaderboard(self, server, board_type: str) -> Leaderboard:
+        """Get cached leaderboard snapshot or build new one
+
+        `server` is None for global leaderboards.
+        `board_type` is one of "exp" or "rep"."""
+        scope = GLOBAL if server is None else server.id
+        if (board := self._leaderboards.get(scope, board_type)) is not None:
+            return board
+        if server is None:
+            # global boards are not built by background task yet
+            await self._refresh_global_leaderboards()
+            return self._leaderboards.global_boards.get(board_type)
+        # snapshot is built from database, so it should have all XP
+        await self._flush_xp_buffer()
+        board = await self._build_leaderboard(server, board_type)
+        self._leaderboards.put(scope, board_type, board)
+        return board
+
+    async def _build_leaderboard(self, server, board_type: str) -> Leaderboard:
+        collection = self.db.users
+        from_members = server is not None and self._members.reading
+        if server is None:
+            query = {}
+            field = "rep" if board_type == "rep" else "total_exp"
+            sort = [(field, -1)]
+            projection = {"user_id": 1, "username": 1, field: 1}
+        elif from_members:
+            # members have same indexes for all guilds, so server boards are range scans
+            collection = self._members.members
+            query = {"guild_id": str(server.id)}
+            if board_type == "rep":
+                sort = [("rep", -1)]
+            else:
+                sort = [("level", -1), ("current_exp", -1)]
+            projection = {"user_id": 1, "username": 1, "rep": 1, "level": 1, "current_exp": 1}
+        elif board_type == "rep":
+            query = {f"servers.{server.id}": {"$exists": True}}
+            sort = [("rep", -1)]
+            projection = {"user_id": 1, "username": 1, "rep": 1}
+        else:
+            await self._indexes.ensure_guild(server.id)
+            query = {f"servers.{server.id}.level": {"$exists": True}}
+            sort = [(f"servers.{server.id}.level", -1), (f"servers.{server.id}.current_exp", -1)]
+            projection = {"user_id": 1, "username": 1, f"servers.{server.id}": 1}
+        user_ids, names, scores, levels = [], [], [], []
+        async for userinfo in (
+            collection.find(query, projection=projection).allow_disk_use(True).sort(sort)
+        ):
+            user_ids.append(userinfo["user_id"])
+            names.append(userinfo.get("username", userinfo["user_id"]))
+            if board_type == "rep":
+                scores.append(userinfo.get("rep", 0))
+            elif server is None:
+                scores.append(userinfo.get("total_exp", 0))
+            elif from_members:
+                levels.append(userinfo.get("level", 0))
+                scores.append(userinfo.get("current_exp", 0))
+            else:
+                server_info = userinfo["servers"][str(server.id)]
+                levels.append(server_info.get("level", 0))
+                scores.append(server_info.get("current_exp", 0))
+        if board_type == "rep" or server is None:
+            levels = None
+        else:
+            scores = server_exp_batch(levels, scores)
+        return Leaderboard.from_columns(user_ids, names, scores, levels)
+
+    async def _refresh_global_leaderboards(self):
+        """Rebuild global leaderboards, or re-read changed users on them"""
+        boards = self._leaderboards.global_boards
+        async with boards.lock:
+            full, user_ids = boards.take(full=not boards.ready)
+            if not full and not user_ids:
+                return
+            started = time.monotonic()
+            try:
+                if full:
+                    await self._flush_xp_buffer()
+                    boards.replace(
+                        {
+                            "exp": await self._build_leaderboard(None, "exp"),
+                            "rep": await self._build_leaderboard(None, "rep"),
+                        },
+                        started,
+                    )
+                else:
+                    await self._flush_xp_buffer(*user_ids)
+                    userinfos = dict.fromkeys(user_ids)
+                    async for userinfo in self.db.users.find(
+                        {"user_id": {"$in": list(user_ids)}},
+                        projection={"user_id": 1, "username": 1, "total_exp": 1, "rep": 1},
+                    ):
+                        userinfos[userinfo["user_id"]] = userinfo
+                    boards.apply(userinfos, started)
+            except BaseException:
+                boards.restore(full, user_ids)
+                raise
+
+    async def _global_leaderboards_loop(self):
+        boards = self._leaderboards.global_boards
+        while True:
+            try:
+                if self._db_ready:
+                    await self._refresh_global_leaderboards()
+            # task should keep running, otherwise global boards are never refreshed again
+            except Exception as e:
+                self.log.error("Unable to refresh global leaderboards", exc_info=e)
+            boards.interval = await self.config.global_top_interval()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(boards.wakeup.wait(), timeout=boards.interval)
+            boards.wakeup.clear()
+
     @commands.command(usage="[page] [--global] [--rep] [--server SERVER]")
     @commands.guild_only()
     @commands.cooldown(1, 30, commands.BucketType.guild)
@@ -35,151 +149,41 @@ class Top(MixinMeta, metaclass=CompositeMetaClass):
         owner = is_owner if not await self.config.allow_global_top() else True
 
         async with ctx.typing():
-            users = []
-            user_stat = []
             is_level = False
-            pos = 0
+            total_levels = False
             if options.rep and options.global_top and owner:
                 title = "Global Rep Leaderboard for {}\n".format(self.bot.user.name)
-                async for userinfo in self.db.users.find({}).allow_disk_use(True).sort("rep", -1):
-                    pos += 1
-                    users.append(
-                        (
-                            pos,
-                            userinfo["rep"],
-                            shorten(
-                                userinfo.get("username", userinfo["user_id"]),
-                                20,
-                                placeholder="\N{HORIZONTAL ELLIPSIS}",
-                            ),
-                        )
-                    )
-
-                    if str(user.id) == userinfo["user_id"]:
-                        user_stat = [await self._find_global_rep_rank(user), userinfo["rep"]]
-                    await sleep(0)
-
+                board = await self._get_leaderboard(None, "rep")
                 board_type = "Rep"
                 icon_url = self.bot.user.avatar_url
             elif options.global_top and owner:
                 is_level = True if await self.config.global_levels() else False
+                # global board has no levels, they are calculated from total XP
+                total_levels = is_level
                 title = "Global Exp Leaderboard for {}\n".format(self.bot.user.name)
-                async for userinfo in (
-                    self.db.users.find({}).allow_disk_use(True).sort("total_exp", -1)
-                ):
-                    pos += 1
-                    if is_level:
-                        users.append(
-                            (
-                                pos,
-                                userinfo["total_exp"],
-                                await self._find_level(userinfo["total_exp"]),
-                                shorten(
-                                    userinfo.get("username", userinfo["user_id"]),
-                                    20,
-                                    placeholder="\N{HORIZONTAL ELLIPSIS}",
-                                ),
-                            )
-                        )
-                    else:
-                        users.append(
-                            (
-                                pos,
-                                userinfo["total_exp"],
-                                shorten(
-                                    userinfo.get("username", userinfo["user_id"]),
-                                    20,
-                                    placeholder="\N{HORIZONTAL ELLIPSIS}",
-                                ),
-                            )
-                        )
-
-                    if str(user.id) == userinfo["user_id"]:
-                        if is_level:
-                            user_stat = [
-                                await self._find_global_rank(user),
-                                userinfo["total_exp"],
-                                await self._find_level(userinfo["total_exp"]),
-                            ]
-                        else:
-                            user_stat = [await self._find_global_rank(user), userinfo["total_exp"]]
-                    await sleep(0)
-
+                board = await self._get_leaderboard(None, "exp")
                 board_type = "Points"
                 icon_url = self.bot.user.avatar_url
             elif options.rep:
                 title = "Rep Leaderboard for {}\n".format(server.name)
-                async for userinfo in (
-                    self.db.users.find({f"servers.{server.id}": {"$exists": True}})
-                    .allow_disk_use(True)
-                    .sort("rep", -1)
-                ):
-                    pos += 1
-                    users.append(
-                        (
-                            pos,
-                            userinfo["rep"],
-                            shorten(
-                                userinfo.get("username", userinfo["user_id"]),
-                                20,
-                                placeholder="\N{HORIZONTAL ELLIPSIS}",
-                            ),
-                        )
-                    )
-
-                    if str(user.id) == userinfo["user_id"]:
-                        user_stat = [
-                            await self._find_server_rep_rank(user, server),
-                            userinfo["rep"],
-                        ]
-                    await sleep(0)
-
+                board = await self._get_leaderboard(server, "rep")
                 board_type = "Rep"
                 icon_url = server.icon_url
             else:
                 is_level = True
                 title = "Exp Leaderboard for {}\n".format(server.name)
-                async for userinfo in (
-                    self.db.users.find({f"servers.{server.id}": {"$exists": True}})
-                    .allow_disk_use(True)
-                    .sort(
-                        [
-                            (f"servers.{server.id}.level", -1),
-                            (f"servers.{server.id}.current_exp", -1),
-                        ]
-                    )
-                ):
-                    pos += 1
-                    if str(user.id) == userinfo["user_id"]:
-                        user_stat = [
-                            await self._find_server_rank(user, server),
-                            await self._find_server_exp(user, server),
-                            userinfo["servers"].get(str(server.id), {}).get("level"),
-                        ]
-                    if userinfo.get("servers", {}).get(str(server.id)):
-                        server_exp = 0
-                        async for i in AsyncIter(
-                            range(userinfo["servers"][str(server.id)].get("level", 0))
-                        ):
-                            server_exp += await self._required_exp(i)
-                        server_exp += userinfo["servers"][str(server.id)].get("current_exp", 0)
-                        users.append(
-                            (
-                                pos,
-                                server_exp,
-                                userinfo["servers"][str(server.id)].get("level", 0),
-                                shorten(
-                                    userinfo.get("username", userinfo["user_id"]),
-                                    20,
-                                    placeholder="\N{HORIZONTAL ELLIPSIS}",
-                                ),
-                            )
-                        )
-                    await sleep(0)
+                board = await self._get_leaderboard(server, "exp")
                 board_type = "Points"
                 icon_url = server.icon_url
 
-            pages = TopPager(users, board_type, is_level, user_stat, icon_url, title)
+            pages = TopPager(
+                LeaderboardRows(board, total_levels),
+                board_type,
+                is_level,
+                board.stat(str(user.id)),
+                icon_url,
+                title,
+            )
             menu = TopMenu(pages)
             await menu.start(ctx)
             page = options.page
@@ -7,10 +7,12 @@ from math import floor, log
 
 from redbot.core.errors import CogLoadError
 
+from . import render_assets
 from .abc import MixinMeta
+from .utils import get_character_pixel_width
 
 try:
-    from PIL import Image, ImageDraw
+    from PIL import Image
 except Exception as e:
     raise CogLoadError(
         f"Can't load pillow: {e}\n"
@@ -19,13 +21,6 @@ except Exception as e:
         "Installing-Leveler#my-bot-throws-error-on-load-something-related-to-pillow."
     )
 
-try:
-    from PIL import Image
-
-    LANCZOS = Image.Resampling.LANCZOS
-except AttributeError:
-    from PIL.Image import LANCZOS
-
 try:
     import numpy
     from scipy import cluster
@@ -37,20 +32,67 @@ except Exception as e:
     )
 
 
+# Drawing helpers are plain functions, so generators can run in process pool.
+
+
+# changes large numbers into smaller strings, ie "10000" becomes 10k
+# https://github.com/gabzin/django-ytdownloader/blob/e59e728aeac459b73fd4fb9ca663560855af19fd/YouTubeDownloader/views.py#L25
+def humanize_number(number):
+    if not number:
+        return 0
+    negative = "-" if number < 0 else ""
+    if number < 0:
+        number *= -1
+
+    units = ["", "K", "M", "B", "T", "Q"]
+    k = 1000.0
+    magnitude = int(floor(log(number, k)))
+    if magnitude >= len(units):
+        return f">999{units[-1]}"
+    return f"{negative}{number / k**magnitude:.0f}{units[magnitude]}"
+
+
+# finds the the pixel to center the text
+def center(start, end, text, font):
+    dist = end - start
+    width = get_character_pixel_width(font, text)
+    start_pos = start + ((dist - width) / 2)
+    return int(start_pos)
+
+
+def contrast(bg_color, color1, color2):
+    """returns color that contrasts better in background"""
+    color1_ratio = contrast_ratio(bg_color, color1)
+    color2_ratio = contrast_ratio(bg_color, color2)
+    if color1_ratio >= color2_ratio:
+        return color1
+    return color2
+
+
+def luminance(color):
+    # convert to greyscale
+    return float((0.2126 * color[0]) + (0.7152 * color[1]) + (0.0722 * color[2]))
+
+
+def contrast_ratio(bgcolor, foreground):
+    f_lum = float(luminance(foreground) + 0.05)
+    bg_lum = float(luminance(bgcolor) + 0.05)
+
+    if bg_lum > f_lum:
+        return bg_lum / f_lum
+    return f_lum / bg_lum
+
+
+def add_corners(im, rad, multiplier=6):
+    im.putalpha(render_assets.corners_alpha(im.size, rad, multiplier))
+    return im
+
+
 class DefaultImageGeneratorsUtils(MixinMeta):
     """Utils for default image generators"""
 
     async def _valid_image_url(self, url):
-        try:
-            async with self.session.get(url) as r:
-                image = await r.content.read()
-            image = BytesIO(image)
-            await self.asyncify((im := await self.asyncify(Image.open, image)).convert, "RGBA")
-            im.close()
-            image.close()
-            return True
-        except IOError:
-            return False
+        return await self._images.validate(url)
 
     # uses k-means algorithm to find color from bg, rank is abundance of color, descending
     async def _auto_color(self, ctx, url: str, ranks):
@@ -91,56 +133,21 @@ class DefaultImageGeneratorsUtils(MixinMeta):
         im.close()
         return colors  # returns array
 
-    # changes large numbers into smaller strings, ie "10000" becomes 10k
-    # https://github.com/gabzin/django-ytdownloader/blob/e59e728aeac459b73fd4fb9ca663560855af19fd/YouTubeDownloader/views.py#L25
     def _humanize_number(self, number):
-        if not number:
-            return 0
-        negative = "-" if number < 0 else ""
-        if number < 0:
-            number *= -1
-
-        units = ["", "K", "M", "B", "T", "Q"]
-        k = 1000.0
-        magnitude = int(floor(log(number, k)))
-        if magnitude >= len(units):
-            return f">999{units[-1]}"
-        return f"{negative}{number / k**magnitude:.0f}{units[magnitude]}"
-
-    # finds the the pixel to center the text
+        return humanize_number(number)
+
     def _center(self, start, end, text, font):
-        dist = end - start
-        width = self._get_character_pixel_width(font, text)
-        start_pos = start + ((dist - width) / 2)
-        return int(start_pos)
-
-    def char_in_font(self, unicode_char, font):
-        for cmap in font["cmap"].tables:
-            if cmap.isUnicode():
-                if ord(unicode_char) in cmap.cmap:
-                    return True
-        return False
+        return center(start, end, text, font)
 
     def _contrast(self, bg_color, color1, color2):
         """returns color that contrasts better in background"""
-        color1_ratio = self._contrast_ratio(bg_color, color1)
-        color2_ratio = self._contrast_ratio(bg_color, color2)
-        if color1_ratio >= color2_ratio:
-            return color1
-        return color2
+        return contrast(bg_color, color1, color2)
 
     def _luminance(self, color):
-        # convert to greyscale
-        luminance = float((0.2126 * color[0]) + (0.7152 * color[1]) + (0.0722 * color[2]))
-        return luminance
+        return luminance(color)
 
     def _contrast_ratio(self, bgcolor, foreground):
-        f_lum = float(self._luminance(foreground) + 0.05)
-        bg_lum = float(self._luminance(bgcolor) + 0.05)
-
-        if bg_lum > f_lum:
-            return bg_lum / f_lum
-        return f_lum / bg_lum
+        return contrast_ratio(bgcolor, foreground)
 
     def _name(self, user, max_length):
         """returns a string with possibly a nickname"""
@@ -152,19 +159,4 @@ class DefaultImageGeneratorsUtils(MixinMeta):
         )
 
     def _add_corners(self, im, rad, multiplier=6):
-        raw_length = rad * 2 * multiplier
-        circle = Image.new("L", (raw_length, raw_length), 0)
-        draw = ImageDraw.Draw(circle)
-        draw.ellipse((0, 0, raw_length, raw_length), fill=255)
-        circle = circle.resize((rad * 2, rad * 2), LANCZOS)
-
-        alpha = Image.new("L", im.size, 255)
-        w, h = im.size
-        alpha.paste(circle.crop((0, 0, rad, rad)), (0, 0))
-        alpha.paste(circle.crop((0, rad, rad, rad * 2)), (0, h - rad))
-        alpha.paste(circle.crop((rad, 0, rad * 2, rad)), (w - rad, 0))
-        alpha.paste(circle.crop((rad, rad, rad * 2, rad * 2)), (w - rad, h - rad))
-        im.putalpha(alpha)
-        circle.close()
-        alpha.close()
-        return im
+        return add_corners(im, rad, multiplier)
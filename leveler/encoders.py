@@ -0,0 +1,53 @@
+from io import BytesIO
+from typing import Dict, NamedTuple
+
+from .pillow import Image, pil_features
+
+
+class Encoder(NamedTuple):
+    """Pillow format and save options of card encoder"""
+
+    format: str
+    extension: str
+    options: dict
+    description: str
+
+
+ENCODERS: Dict[str, Encoder] = {
+    "png-fast": Encoder("PNG", "png", {"compress_level": 1}, "PNG, fastest zlib level"),
+    "png": Encoder("PNG", "png", {"compress_level": 6}, "PNG, default zlib level"),
+    "png-optimized": Encoder("PNG", "png", {"optimize": True}, "PNG, smallest, slowest to encode"),
+    # lowest WebP effort is faster than default PNG and still smaller than optimized one
+    "webp": Encoder(
+        "WEBP",
+        "webp",
+        {"lossless": True, "quality": 50, "method": 0},
+        "Lossless WebP, fast",
+    ),
+    "webp-optimized": Encoder(
+        "WEBP",
+        "webp",
+        {"lossless": True, "quality": 80, "method": 4},
+        "Lossless WebP, smallest, slowest to encode",
+    ),
+}
+# "auto" is resolved to webp if pillow is built with it
+ENCODER_NAMES = ("auto", *ENCODERS)
+
+
+def resolve(name: str) -> str:
+    """Name of encoder to use for configured encoder name"""
+    if name == "auto" or name not in ENCODERS:
+        return "webp" if pil_features.check("webp") else "png"
+    if ENCODERS[name].format == "WEBP" and not pil_features.check("webp"):
+        return "png"
+    return name
+
+
+def encode(image: Image.Image, encoder: str = "png") -> BytesIO:
+    """Save card with encoder, `encoder` should be already resolved"""
+    encoder = ENCODERS[encoder]
+    file = BytesIO()
+    image.save(file, encoder.format, **encoder.options)
+    file.seek(0)
+    return file
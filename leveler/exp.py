@@ -1,30 +1,40 @@
-import math
+import asyncio
 import random
 import time
+from contextlib import suppress
+from typing import List, Set
 
 import discord
+from pymongo import ReturnDocument
+from pymongo import errors as mongoerrors
 from redbot.core import bank, commands
-from redbot.core.utils import AsyncIter
 
 from .abc import MixinMeta
+from .announcements import LevelUp
+from .badge_updates import merge_badges_pipeline
+from .leaderboard import GLOBAL
+from .levels import find_level, level_exp, required_exp, server_exp
+from .members import exp_op
+from .rewards import LevelRewards
+from .spam_gate import CHAT_COOLDOWN, message_digest
+from .xp_buffer import apply_exp, exp_pipeline
 
 
 class XP(MixinMeta):
     """XP/levels handling"""
 
-    # calculates required exp for next level
+    # kept for compatibility, use functions from .levels instead
     async def _required_exp(self, level: int):
-        return 0 if level < 0 else 139 * level + 65
+        return required_exp(level)
 
     async def _level_exp(self, level: int):
-        return level * 65 + 139 * level * (level - 1) // 2
+        return level_exp(level)
 
     async def _find_level(self, total_exp):
-        # this is specific to the function above
-        return int((1 / 278) * (9 + math.sqrt(81 + 1112 * total_exp)))
+        return find_level(total_exp)
 
     async def _give_chat_credit(self, user, server):
-        msg_credits = await self.config.guild(server).msg_credits()
+        msg_credits = (await self._guild_settings.get(server.id)).msg_credits
         if msg_credits and not await bank.is_global():
             await bank.deposit_credits(user, msg_credits)
 
@@ -40,75 +50,220 @@ class XP(MixinMeta):
             return
         if user.bot:
             return
-        xp = await self.config.xp()
+        curr_time = time.time()
+        digest = message_digest(message.content)
+        # messages on cooldown or duplicates of last message are dropped before db access
+        gate = self._spam_gate.check(str(user.id), curr_time, digest)
+        if gate is False:
+            return
+        settings = await self._guild_settings.get(server.id)
         # creates user if doesn't exist, bots are not logged.
 
         await self._create_user(user, server)
-        curr_time = time.time()
-        async with self._db_lock:
+        if message.channel.id in settings.ignored_channels:
+            return
+        if len(message.content) <= settings.message_length and not message.attachments:
+            return
+        async with self._user_locks(user.id):
             self.log.debug("XP handling: lock for %s", user.id)
-            userinfo = await self.db.users.find_one({"user_id": str(user.id)})
-
-            if all(
-                [
-                    float(curr_time) - float(userinfo.get("chat_block", 0)) >= 120,
-                    len(message.content) > await self.config.message_length()
-                    or message.attachments,
-                    await self.hash_with_md5(message.content) != userinfo.get("last_message"),
-                    message.channel.id not in await self.config.guild(server).ignored_channels(),
-                ]
-            ):
-                await self._process_exp(message, userinfo, random.randint(xp[0], xp[1]))
+            userinfo = self._xp_buffer.get(str(user.id), str(server.id))
+            if userinfo is None:
+                userinfo = self._xp_buffer.seed(
+                    await self.db.users.find_one({"user_id": str(user.id)}), str(server.id)
+                )
+            if gate is None:
+                self._spam_gate.update(
+                    userinfo["user_id"], userinfo.get("chat_block"), userinfo.get("last_message")
+                )
+
+            on_cooldown = curr_time - float(userinfo.get("chat_block", 0)) < CHAT_COOLDOWN
+            if not on_cooldown and digest != userinfo.get("last_message"):
+                await self._process_exp(
+                    message, userinfo, random.randint(settings.xp_min, settings.xp_max)
+                )
                 await self._give_chat_credit(user, server)
             self.log.debug("XP handling: unlock for %s", user.id)
 
     async def _process_exp(self, message, userinfo, exp: int):
+        """Apply XP to cached user state
+
+        Changes are written to database by `_flush_xp_buffer`,
+        XP that may level user up is written immediately by `_write_exp`."""
         server = message.guild
         channel = message.channel
         user = message.author
-        # add to total exp
+        server_id = str(server.id)
+        userinfo["chat_block"] = time.time()
+        userinfo["last_message"] = message_digest(message.content)
+        self._spam_gate.update(
+            userinfo["user_id"], userinfo["chat_block"], userinfo["last_message"]
+        )
+        server_info = userinfo["servers"][server_id]
+        # level-ups are written immediately, since levelup image and rewards are using db data
+        if (
+            server_info["current_exp"] + exp >= required_exp(server_info["level"])
+            or not (await self._guild_settings.get(server.id)).xp_flush_interval
+        ):
+            leveled_up = server_id in await self._write_exp(userinfo, server_id, exp)
+        else:
+            apply_exp(userinfo, server_id, exp)
+            self._xp_buffer.add(userinfo["user_id"], server_id, exp)
+            leveled_up = False
+        await self._patch_leaderboards(userinfo, server)
+        if leveled_up:
+            await self._handle_levelup(user, userinfo, server, channel)
+        self.bot.dispatch("leveler_process_exp", message, exp)
+
+    async def _patch_leaderboards(self, userinfo, server):
+        """Update user's position on cached leaderboards after XP change"""
+        server_info = userinfo["servers"][str(server.id)]
+        self._leaderboards.patch(
+            server.id,
+            "exp",
+            userinfo["user_id"],
+            server_exp(server_info["level"], server_info["current_exp"]),
+            server_info["level"],
+        )
+        self._leaderboards.patch(GLOBAL, "exp", userinfo["user_id"], userinfo["total_exp"])
+
+    async def _flush_xp_buffer(self, *user_ids: str):
+        """Write pending XP changes to database
+
+        Writes changes only for specified users, if any provided,
+        after their changes taken by flush that is already running."""
+        if not self._db_ready:
+            return
+        for user_id in user_ids:
+            await self._xp_buffer.written(user_id)
+        ops, taken = self._xp_buffer.take(user_ids or None)
+        if not ops:
+            return
+        started = time.monotonic()
         try:
-            await self.db.users.update_one(
-                {"user_id": str(user.id)},
-                {"$set": {"total_exp": userinfo["total_exp"] + exp}},
+            await self.db.users.bulk_write(ops, ordered=False)
+        except asyncio.CancelledError:
+            # changes are not restored: motor completes write in its thread anyway
+            self._xp_buffer.flushed(taken, started)
+            raise
+        except Exception as exc:
+            if not (taken := self._xp_write_failed(taken, exc)):
+                return
+        await self._members.write(
+            [
+                exp_op(server_id, user_id, server["level"], server["current_exp"])
+                for user_id, server_id, server in self._xp_buffer.states(taken)
+            ]
+        )
+        self._xp_buffer.flushed(taken, started)
+
+    async def _write_exp(self, userinfo, server_id: str, exp: int) -> Set[str]:
+        """Write XP gained on server, with pending XP of user, in one atomic update
+
+        Level-ups are applied by database, so levels stay correct
+        when several bots share the same database.
+        Returns ids of servers, where user leveled up."""
+        user_id = userinfo["user_id"]
+        # flush may be writing earlier changes of user, they should be applied first
+        await self._xp_buffer.written(user_id)
+        if user_id in self._xp_buffer:
+            self._xp_buffer.add(user_id, server_id, exp)
+            _, taken = self._xp_buffer.take([user_id])
+            servers = taken[user_id]
+        else:
+            # cached state was dropped after failed flush, and is read again on next message
+            taken, servers = {}, {server_id: exp}
+        started = time.monotonic()
+        try:
+            before = await self.db.users.find_one_and_update(
+                {"user_id": user_id},
+                exp_pipeline(
+                    servers,
+                    {
+                        "chat_block": userinfo["chat_block"],
+                        "last_message": userinfo["last_message"],
+                    },
+                ),
+                projection=["total_exp", *(f"servers.{server}" for server in servers)],
+                return_document=ReturnDocument.BEFORE,
             )
+        except asyncio.CancelledError:
+            self._xp_buffer.flushed(taken, started)
+            raise
         except Exception as exc:
-            self.log.error(f"Unable to process xp for {user.id}", exc_info=exc)
-            return
-        required = await self._required_exp(userinfo["servers"][str(server.id)]["level"])
-        if userinfo["servers"][str(server.id)]["current_exp"] + exp >= required:
-            userinfo["servers"][str(server.id)]["level"] += 1
-            await self.db.users.update_one(
-                {"user_id": str(user.id)},
-                {
-                    "$set": {
-                        f"servers.{server.id}.level": userinfo["servers"][str(server.id)]["level"],
-                        f"servers.{server.id}.current_exp": userinfo["servers"][str(server.id)][
-                            "current_exp"
-                        ]
-                        + exp
-                        - required,
-                        "chat_block": time.time(),
-                        "last_message": await self.hash_with_md5(message.content),
-                    }
-                },
+            # XP will be written by next flush, if it's known to be not written,
+            # but level-up will not be announced
+            apply_exp(userinfo, server_id, exp)
+            self._xp_write_failed(taken, exc)
+            return set()
+        if before is None:
+            # user was deleted from database
+            self._xp_buffer.flushed(taken, started)
+            self._xp_buffer.discard(user_id)
+            return set()
+        leveled_up = self._xp_buffer.refresh(userinfo, before, servers)
+        await self._members.write(
+            [
+                exp_op(server_id, user_id, server["level"], server["current_exp"])
+                for server_id, server in userinfo["servers"].items()
+                if server_id in servers
+            ]
+        )
+        self._xp_buffer.flushed(taken, started)
+        return leveled_up
+
+    def _xp_write_failed(self, taken: dict, exc: Exception) -> dict:
+        """Handle failed write of changes detached from XP buffer
+
+        Changes are relative, so they are returned to buffer only if they are known
+        to be not applied. Otherwise cached state of users is dropped and read from database again.
+        Returns changes, that were written anyway."""
+        self._xp_buffer.failed_flushes += 1
+        if isinstance(exc, mongoerrors.BulkWriteError):
+            # operations are built in order of `taken`, ones without write errors are applied
+            user_ids = list(taken)
+            failed = {user_ids[error["index"]] for error in exc.details.get("writeErrors", ())}
+            self._xp_buffer.restore({user_id: taken[user_id] for user_id in failed})
+            self.log.error(
+                f"Unable to write XP changes for {len(failed)} of {len(taken)} users", exc_info=exc
             )
-            await self._handle_levelup(user, userinfo, server, channel)
+            return {user_id: taken[user_id] for user_id in taken if user_id not in failed}
+        if isinstance(exc, mongoerrors.ServerSelectionTimeoutError) or (
+            isinstance(exc, mongoerrors.OperationFailure)
+            and not isinstance(exc, mongoerrors.WriteConcernError)
+        ):
+            # write was not sent, or was rejected by server
+            self._xp_buffer.restore(taken)
+            self.log.error(f"Unable to write XP changes for {len(taken)} users", exc_info=exc)
         else:
-            await self.db.users.update_one(
-                {"user_id": str(user.id)},
-                {
-                    "$set": {
-                        "servers.{}.current_exp".format(server.id): userinfo["servers"][
-                            str(server.id)
-                        ]["current_exp"]
-                        + exp,
-                        "chat_block": time.time(),
-                        "last_message": await self.hash_with_md5(message.content),
-                    }
-                },
+            self._xp_buffer.drop(taken)
+            self.log.error(
+                f"XP changes of {len(taken)} users may be not written, "
+                "their cached state is dropped",
+                exc_info=exc,
             )
-        self.bot.dispatch("leveler_process_exp", message, exp)
+        return {}
+
+    async def _evict_xp_state(self, user_id: str):
+        """Write pending XP changes of user and drop its cached state
+
+        Should be used before changing user's XP data directly in database."""
+        async with self._user_locks(user_id):
+            await self._flush_xp_buffer(user_id)
+            self._xp_buffer.discard(user_id)
+            self._spam_gate.discard(user_id)
+
+    async def _xp_flush_loop(self):
+        try:
+            while True:
+                interval = await self.config.xp_flush_interval()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._xp_buffer.wakeup.wait(), timeout=interval or 1)
+                self._xp_buffer.wakeup.clear()
+                await self._flush_xp_buffer()
+        except asyncio.CancelledError:
+            # cog unload or bot shutdown
+            await self._flush_xp_buffer()
+            raise
 
     async def _handle_levelup(self, user, userinfo, server, channel):
         # channel lock implementation
@@ -125,129 +280,200 @@ class XP(MixinMeta):
 
         new_level = str(userinfo["servers"][str(server.id)]["level"])
         self.bot.dispatch("leveler_levelup", user, new_level)
-        # add to appropriate role if necessary
-        # try:
-        server_roles = await self.db.roles.find_one({"server_id": str(server.id)})
-        if server_roles is not None:
-            for role in server_roles["roles"].keys():
-                if int(server_roles["roles"][role]["level"]) == int(new_level):
-                    add_role = discord.utils.get(server.roles, name=role)
-                    if add_role is not None:
-                        try:
-                            await user.add_roles(add_role, reason="Levelup")
-                        except discord.Forbidden:
-                            await channel.send("Levelup role adding failed: Missing Permissions")
-                        except discord.HTTPException:
-                            await channel.send("Levelup role adding failed")
-                    remove_role = discord.utils.get(
-                        server.roles, name=server_roles["roles"][role]["remove_role"]
-                    )
-                    if remove_role is not None:
-                        try:
-                            await user.remove_roles(remove_role, reason="Levelup")
-                        except discord.Forbidden:
-                            await channel.send("Levelup role removal failed: Missing Permissions")
-                        except discord.HTTPException:
-                            await channel.send("Levelup role removal failed")
-        try:
-            server_linked_badges = await self.db.badgelinks.find_one({"server_id": str(server.id)})
-            if server_linked_badges is not None:
-                for badge_name in server_linked_badges["badges"]:
-                    if int(server_linked_badges["badges"][badge_name]) == int(new_level):
-                        server_badges = await self.db.badges.find_one(
-                            {"server_id": str(server.id)}
-                        )
-                        if (
-                            server_badges is not None
-                            and badge_name in server_badges["badges"].keys()
-                        ):
-                            userinfo_db = await self.db.users.find_one({"user_id": str(user.id)})
-                            new_badge_name = "{}_{}".format(badge_name, server.id)
-                            userinfo_db["badges"][new_badge_name] = server_badges["badges"][
-                                badge_name
-                            ]
-                            await self.db.users.update_one(
-                                {"user_id": str(user.id)},
-                                {"$set": {"badges": userinfo_db["badges"]}},
-                            )
-        except Exception as exc:
-            self.log.error(
-                f"Error on giving a badge.\nServer: {server}\nUser: {user}", exc_info=exc
-            )
-            await channel.send("Error. Badge was not given.")
+        rewards = (await self._rewards.get(self.db, server)).get(int(new_level))
+        if rewards is not None:
+            await self._give_level_rewards(user, server, channel, rewards)
 
         if channel and await self.config.guild(server).lvl_msg():  # if lvl msg is enabled
-            if await self.config.guild(server).text_only():
-                async with channel.typing():
-                    em = discord.Embed(
-                        description="{} just gained a level{}! (LEVEL {})".format(
-                            name, server_identifier, new_level
-                        ),
-                        colour=user.colour,
-                    )
-                    await channel.send(
-                        embed=em,
-                        allowed_mentions=discord.AllowedMentions(
-                            users=await self.config.mention()
-                        ),
+            # announcements are sent in background, grouped with other level-ups in channel
+            self._announcements.push(
+                channel,
+                LevelUp(
+                    user,
+                    server,
+                    name,
+                    server_identifier,
+                    new_level,
+                    await self.config.guild(server).text_only(),
+                ),
+            )
+
+    async def _announce_levelups(self, channel, levelups: List[LevelUp]):
+        """Send level-ups in one message
+
+        Text-only level-ups are grouped in embed, others are attached as images."""
+        text_levelups = [levelup for levelup in levelups if levelup.text_only]
+        image_levelups = [levelup for levelup in levelups if not levelup.text_only]
+        em = None
+        if text_levelups:
+            em = discord.Embed(
+                description="\n".join(
+                    "{} just gained a level{}! (LEVEL {})".format(
+                        levelup.name, levelup.server_identifier, levelup.level
                     )
+                    for levelup in text_levelups
+                ),
+                colour=text_levelups[0].user.colour,
+            )
+        images = []
+        for image in await asyncio.gather(
+            *(self.draw_levelup(levelup.user, levelup.server) for levelup in image_levelups),
+            return_exceptions=True,
+        ):
+            if isinstance(image, Exception):
+                self.log.error("Unable to draw levelup image", exc_info=image)
             else:
-                async with channel.typing():
-                    levelup = await self.draw_levelup(user, server)
-                    file = discord.File(levelup, filename="levelup.png")
-                    await channel.send(
-                        "{} just gained a level{}!".format(name, server_identifier),
-                        file=file,
-                        allowed_mentions=discord.AllowedMentions(
-                            users=await self.config.mention()
-                        ),
-                    )
-                levelup.close()
+                images.append(image)
+        try:
+            await channel.send(
+                "\n".join(
+                    "{} just gained a level{}!".format(levelup.name, levelup.server_identifier)
+                    for levelup in image_levelups
+                )
+                or None,
+                embed=em,
+                files=[
+                    discord.File(image, filename=f"{i}_{image.name}")
+                    for i, image in enumerate(images)
+                ]
+                or None,
+                allowed_mentions=discord.AllowedMentions(users=await self.config.mention()),
+            )
+        finally:
+            for image in images:
+                image.close()
+
+    async def _give_level_rewards(self, user, server, channel, rewards: LevelRewards):
+        user_roles = {role.id for role in user.roles}
+        add_roles = [
+            role
+            for role_id in rewards.add_roles
+            if role_id not in user_roles and (role := server.get_role(role_id)) is not None
+        ]
+        remove_roles = {role_id for role_id in rewards.remove_roles if role_id in user_roles}
+        if add_roles or remove_roles:
+            # all roles are changed in one request
+            roles = [role for role in user.roles[1:] if role.id not in remove_roles] + add_roles
+            try:
+                await user.edit(roles=roles, reason="Levelup")
+            except discord.Forbidden:
+                await channel.send("Levelup roles update failed: Missing Permissions")
+            except discord.HTTPException:
+                await channel.send("Levelup roles update failed")
+        if rewards.badges:
+            try:
+                await self.db.users.update_one(
+                    {"user_id": str(user.id)}, merge_badges_pipeline(rewards.badges)
+                )
+            except Exception as exc:
+                self.log.error(
+                    f"Error on giving a badge.\nServer: {server}\nUser: {user}", exc_info=exc
+                )
+                await channel.send("Error. Badge was not given.")
+
+    # linked roles are resolved by name when reward index is built
+    @commands.Cog.listener("on_guild_role_create")
+    @commands.Cog.listener("on_guild_role_delete")
+    async def _role_changed(self, role):
+        self._rewards.invalidate(role.guild.id)
+
+    @commands.Cog.listener("on_guild_role_update")
+    async def _role_updated(self, before, after):
+        if before.name != after.name:
+            self._rewards.invalidate(after.guild.id)
 
     async def _find_server_rank(self, user, server):
-        rank = 1
-        async for userinfo in (
-            self.db.users.find({f"servers.{server.id}": {"$exists": True}})
-            .allow_disk_use(True)
-            .sort([(f"servers.{server.id}.level", -1), (f"servers.{server.id}.current_exp", -1)])
-        ):
-            if userinfo["user_id"] == str(user.id):
-                return rank
-            rank += 1
+        if member := await self._members.find(server.id, user.id):
+            return (
+                await self._members.members.count_documents(
+                    {
+                        "guild_id": str(server.id),
+                        "$or": [
+                            {"level": {"$gt": member["level"]}},
+                            {
+                                "level": member["level"],
+                                "current_exp": {"$gt": member["current_exp"]},
+                            },
+                        ],
+                    }
+                )
+                + 1
+            )
+        # members that are not migrated yet are read from user document
+        userinfo = await self.db.users.find_one(
+            {"user_id": str(user.id)}, projection={f"servers.{server.id}": 1}
+        )
+        try:
+            server_info = userinfo["servers"][str(server.id)]
+        except (TypeError, KeyError):
+            return None
+        return (
+            await self.db.users.count_documents(
+                {
+                    "$or": [
+                        {f"servers.{server.id}.level": {"$gt": server_info["level"]}},
+                        {
+                            f"servers.{server.id}.level": server_info["level"],
+                            f"servers.{server.id}.current_exp": {
+                                "$gt": server_info["current_exp"]
+                            },
+                        },
+                    ]
+                }
+            )
+            + 1
+        )
 
     async def _find_server_rep_rank(self, user, server):
-        rank = 1
-        async for userinfo in (
-            self.db.users.find({f"servers.{server.id}": {"$exists": True}})
-            .allow_disk_use(True)
-            .sort("rep", -1)
-        ):
-            if userinfo.get("user_id") == str(user.id):
-                return rank
-            rank += 1
+        if member := await self._members.find(server.id, user.id):
+            return (
+                await self._members.members.count_documents(
+                    {"guild_id": str(server.id), "rep": {"$gt": member.get("rep", 0)}}
+                )
+                + 1
+            )
+        userinfo = await self.db.users.find_one(
+            {"user_id": str(user.id)}, projection={"rep": 1, f"servers.{server.id}": 1}
+        )
+        if not userinfo or str(server.id) not in userinfo.get("servers", {}):
+            return None
+        return (
+            await self.db.users.count_documents(
+                {f"servers.{server.id}": {"$exists": True}, "rep": {"$gt": userinfo["rep"]}}
+            )
+            + 1
+        )
 
     async def _find_server_exp(self, user, server):
-        server_exp = 0
-        userinfo = await self.db.users.find_one({"user_id": str(user.id)})
-
+        if member := await self._members.find(server.id, user.id):
+            return server_exp(member["level"], member["current_exp"])
+        userinfo = await self.db.users.find_one(
+            {"user_id": str(user.id)}, projection={f"servers.{server.id}": 1}
+        )
         try:
-            async for i in AsyncIter(range(userinfo["servers"][str(server.id)]["level"])):
-                server_exp += await self._required_exp(i)
-            server_exp += userinfo["servers"][str(server.id)]["current_exp"]
-            return server_exp
-        except KeyError:
-            return server_exp
+            server_info = userinfo["servers"][str(server.id)]
+        except (TypeError, KeyError):
+            return 0
+        return server_exp(server_info["level"], server_info["current_exp"])
 
     async def _find_global_rank(self, user):
-        rank = 1
-        async for userinfo in self.db.users.find({}).allow_disk_use(True).sort("total_exp", -1):
-            if userinfo.get("user_id") == str(user.id):
-                return rank
-            rank += 1
+        board = self._leaderboards.global_boards.get("exp")
+        if board is not None and (rank := board.score_rank(str(user.id))) is not None:
+            return rank
+        userinfo = await self.db.users.find_one(
+            {"user_id": str(user.id)}, projection={"total_exp": 1}
+        )
+        if not userinfo:
+            return None
+        return (
+            await self.db.users.count_documents({"total_exp": {"$gt": userinfo["total_exp"]}}) + 1
+        )
 
     async def _find_global_rep_rank(self, user):
-        rank = 1
-        async for userinfo in self.db.users.find({}).allow_disk_use(True).sort("rep", -1):
-            if userinfo.get("user_id") == str(user.id):
-                return rank
-            rank += 1
+        board = self._leaderboards.global_boards.get("rep")
+        if board is not None and (rank := board.score_rank(str(user.id))) is not None:
+            return rank
+        userinfo = await self.db.users.find_one({"user_id": str(user.id)}, projection={"rep": 1})
+        if not userinfo:
+            return None
+        return await self.db.users.count_documents({"rep": {"$gt": userinfo["rep"]}}) + 1
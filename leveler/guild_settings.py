@@ -0,0 +1,68 @@
+from typing import Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from redbot.core import Config
+
+
+class GuildSettings(NamedTuple):
+    """Settings used for XP handling in guild"""
+
+    xp_min: int
+    xp_max: int
+    message_length: int
+    xp_flush_interval: int
+    ignored_channels: FrozenSet[int]
+    msg_credits: int
+
+
+class GuildSettingsCache:
+    """Snapshots of guild settings for message handling
+
+    Snapshots should be invalidated by every command that changes settings used in them."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._global: Optional[Tuple[int, int, int, int]] = None
+        self._guilds: Dict[int, GuildSettings] = {}
+        # changed on every invalidation, so snapshot built during invalidation is not stored
+        self._generation = 0
+        self.builds = 0
+
+    def __len__(self):
+        return len(self._guilds)
+
+    async def get(self, guild_id: int) -> GuildSettings:
+        settings = self._guilds.get(guild_id)
+        if settings is not None:
+            return settings
+        generation = self._generation
+        global_settings = self._global
+        if global_settings is None:
+            xp_min, xp_max = await self.config.xp()
+            global_settings = (
+                xp_min,
+                xp_max,
+                await self.config.message_length(),
+                await self.config.xp_flush_interval(),
+            )
+        guild = self.config.guild_from_id(guild_id)
+        settings = GuildSettings(
+            *global_settings,
+            ignored_channels=frozenset(await guild.ignored_channels()),
+            msg_credits=await guild.msg_credits(),
+        )
+        self.builds += 1
+        if generation == self._generation:
+            self._global = global_settings
+            self._guilds[guild_id] = settings
+        return settings
+
+    def invalidate(self, guild_id: int = None):
+        """Drop snapshot of guild, or all snapshots if guild is not specified
+
+        Global settings should invalidate all snapshots."""
+        self._generation += 1
+        if guild_id is None:
+            self._global = None
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
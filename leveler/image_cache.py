@@ -0,0 +1,284 @@
+import asyncio
+import json
+import time
+from hashlib import sha256
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+
+from .lru import SizedLRU
+from .pillow import LANCZOS, Image
+
+log = getLogger("red.fixator10-cogs.leveler")
+
+Size = Tuple[int, int]
+Box = Tuple[int, int, int, int]
+
+
+def _decode(path: Path, size: Optional[Size], crop: Optional[Box]) -> Optional[Image.Image]:
+    """Open image file as RGBA, resized to `size` and cropped to `crop`
+
+    Returns None if file is not a valid image."""
+    try:
+        with Image.open(path) as original:
+            image = original.convert("RGBA")
+        if size is not None and image.size != size:
+            temp = image
+            image = image.resize(size, LANCZOS)
+            temp.close()
+        if crop is not None:
+            temp = image
+            image = image.crop(crop)
+            temp.close()
+        return image
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class ImageCache:
+    """Two-tier cache for backgrounds and badges
+
+    Downloaded files are stored on disk by their content hash, so same image on different URLs
+    is stored only once. URLs are revalidated with ETag/Last-Modified after `revalidate_after`
+    seconds. Decoded and resized images are kept in memory LRU.
+
+    Images returned by cache are shared, and should never be modified or closed."""
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        path: Path,
+        max_memory: int = 64,
+        max_disk_size: int = 256 * 1024 * 1024,
+        max_image_size: int = 8 * 1024 * 1024,
+        revalidate_after: int = 24 * 60 * 60,
+    ):
+        self.session = session
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self.max_image_size = max_image_size
+        self.revalidate_after = revalidate_after
+        # url -> {"digest", "size", "etag", "last_modified", "fetched", "used"}
+        self._index: Dict[str, dict] = {}
+        self._images: SizedLRU[Image.Image] = SizedLRU(max_memory)
+        self._valid: Dict[str, bool] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._decoding: Dict[tuple, asyncio.Future] = {}
+        self._load_lock = asyncio.Lock()
+        self._loaded = False
+        self.memory_hits = 0
+        self.memory_misses = 0
+        self.disk_hits = 0
+        self.downloads = 0
+        self.revalidated = 0
+        self.failed = 0
+
+    @property
+    def disk_size(self) -> int:
+        return sum({e["digest"]: e["size"] for e in self._index.values()}.values())
+
+    @property
+    def disk_files(self) -> int:
+        return len({e["digest"] for e in self._index.values()})
+
+    def __len__(self):
+        return len(self._images)
+
+    def _blob(self, digest: str) -> Path:
+        return self.path / "blobs" / digest
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _load_index(self) -> Dict[str, dict]:
+        (self.path / "blobs").mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.path / "index.json", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index = {url: e for url, e in index.items() if self._blob(e["digest"]).is_file()}
+        # remove files left by interrupted writes and evictions
+        referenced = {e["digest"] for e in index.values()}
+        for file in (self.path / "blobs").iterdir():
+            if file.name not in referenced:
+                file.unlink()
+        return index
+
+    def _save_index(self, index: Dict[str, dict]):
+        temp = self.path / "index.json.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        temp.replace(self.path / "index.json")
+
+    def _write_blob(self, digest: str, data: bytes):
+        path = self._blob(digest)
+        if not path.is_file():
+            temp = path.with_suffix(".tmp")
+            temp.write_bytes(data)
+            temp.replace(path)
+
+    def _remove_blobs(self, digests: set):
+        for digest in digests:
+            path = self._blob(digest)
+            if path.is_file():
+                path.unlink()
+
+    async def _load(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                self._index = await self._run(self._load_index)
+                self._loaded = True
+
+    async def _entry(self, url: str) -> Optional[dict]:
+        """Index entry of URL, downloading or revalidating it if needed"""
+        await self._load()
+        entry = self._index.get(url)
+        if entry is not None and time.time() - entry["fetched"] < self.revalidate_after:
+            entry["used"] = time.time()
+            self.disk_hits += 1
+            return entry
+        task = self._inflight.get(url)
+        if task is None:
+            task = self._inflight[url] = asyncio.ensure_future(self._download(url, entry))
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        # one download is shared between all waiting renders
+        return await asyncio.shield(task)
+
+    async def _download(self, url: str, entry: Optional[dict]) -> Optional[dict]:
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            async with self.session.get(url, headers=headers) as r:
+                if r.status == 304 and entry is not None:
+                    entry["fetched"] = entry["used"] = time.time()
+                    self.revalidated += 1
+                    return entry
+                if r.status != 200:
+                    raise ValueError(f"HTTP {r.status}")
+                if (r.content_length or 0) > self.max_image_size:
+                    raise ValueError(f"image is larger than {self.max_image_size} bytes")
+                data = bytearray()
+                async for chunk in r.content.iter_chunked(64 * 1024):
+                    data += chunk
+                    if len(data) > self.max_image_size:
+                        raise ValueError(f"image is larger than {self.max_image_size} bytes")
+                etag = r.headers.get("ETag")
+                last_modified = r.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.failed += 1
+            log.debug("Unable to download image %s: %s", url, e)
+            # outdated image is better than no image
+            return entry
+        self.downloads += 1
+        data = bytes(data)
+        digest = sha256(data).hexdigest()
+        try:
+            await self._run(self._write_blob, digest, data)
+        except OSError as e:
+            self.failed += 1
+            log.warning("Unable to save image %s to disk cache: %s", url, e)
+            return entry
+        now = time.time()
+        entry = {
+            "digest": digest,
+            "size": len(data),
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched": now,
+            "used": now,
+        }
+        old = self._index.get(url)
+        self._index[url] = entry
+        removed = self._evict_disk()
+        if old is not None:
+            removed.add(old["digest"])
+        removed -= {e["digest"] for e in self._index.values()}
+        for digest in removed:
+            self._valid.pop(digest, None)
+        try:
+            await self._run(self._save_index, dict(self._index))
+            await self._run(self._remove_blobs, removed)
+        except OSError as e:
+            log.warning("Unable to update image disk cache: %s", e)
+        return entry
+
+    def _evict_disk(self) -> set:
+        """Drop least recently used URLs until disk cache fits in its size
+
+        Returns digests of dropped URLs."""
+        dropped = set()
+        total = self.disk_size
+        for url, entry in sorted(self._index.items(), key=lambda i: i[1]["used"]):
+            if total <= self.max_disk_size:
+                break
+            del self._index[url]
+            dropped.add(entry["digest"])
+            if all(e["digest"] != entry["digest"] for e in self._index.values()):
+                total -= entry["size"]
+        return dropped
+
+    async def get(self, url: str, size: Size = None, crop: Box = None) -> Optional[Image.Image]:
+        """Get RGBA image from URL, resized to `size` and cropped to `crop`
+
+        Returns None if image can't be downloaded or is not valid image."""
+        entry = await self._entry(url)
+        if entry is None:
+            return None
+        digest = entry["digest"]
+        key = (digest, size, crop)
+        image = self._images.get(key)
+        if image is not None:
+            self.memory_hits += 1
+            return image
+        self.memory_misses += 1
+        if self._valid.get(digest) is False:
+            return None
+        task = self._decoding.get(key)
+        if task is None:
+            task = self._decoding[key] = asyncio.ensure_future(
+                self._run(_decode, self._blob(digest), size, crop)
+            )
+            task.add_done_callback(lambda _: self._decoding.pop(key, None))
+        image = await asyncio.shield(task)
+        self._valid[digest] = image is not None
+        if image is None:
+            return None
+        self._images.put(key, image)
+        return image
+
+    async def digest(self, url: str) -> Optional[str]:
+        """Digest of URL's current content, to key things derived from image"""
+        entry = await self._entry(url)
+        return entry and entry["digest"]
+
+    async def get_bytes(self, url: str) -> Optional[bytes]:
+        """Get raw content of URL"""
+        entry = await self._entry(url)
+        if entry is None:
+            return None
+        return await self._run(self._blob(entry["digest"]).read_bytes)
+
+    async def validate(self, url: str) -> bool:
+        """Check that URL is a valid image"""
+        entry = await self._entry(url)
+        if entry is None:
+            return False
+        digest = entry["digest"]
+        if digest not in self._valid:
+            image = await self._run(_decode, self._blob(digest), None, None)
+            self._valid[digest] = image is not None
+            if image is not None:
+                image.close()
+        return self._valid[digest]
+
+    def clear_memory(self):
+        self._images.clear()
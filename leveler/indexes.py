@@ -0,0 +1,193 @@
+from logging import getLogger
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING
+from pymongo import errors as mongoerrors
+
+log = getLogger("red.fixator10-cogs.leveler")
+
+# MongoDB allows up to 64 indexes per collection
+MAX_GUILD_INDEXES = 48
+
+GLOBAL_INDEXES = {
+    "total_exp_desc": [("total_exp", DESCENDING)],
+    "rep_desc": [("rep", DESCENDING)],
+}
+USER_ID_INDEX = "user_id_unique"
+GUILD_INDEX_PREFIX = "guild_level_"
+# members collection has same indexes for all guilds, see members.py
+MEMBER_UNIQUE_INDEX = "members_guild_user_unique"
+MEMBER_INDEXES = {
+    MEMBER_UNIQUE_INDEX: [("guild_id", ASCENDING), ("user_id", ASCENDING)],
+    "members_guild_level_desc": [
+        ("guild_id", ASCENDING),
+        ("level", DESCENDING),
+        ("current_exp", DESCENDING),
+    ],
+    "members_guild_rep_desc": [("guild_id", ASCENDING), ("rep", DESCENDING)],
+    "members_user_id": [("user_id", ASCENDING)],
+}
+
+
+def guild_index_keys(guild_id) -> list:
+    return [
+        (f"servers.{guild_id}.level", DESCENDING),
+        (f"servers.{guild_id}.current_exp", DESCENDING),
+    ]
+
+
+def plan_stages(plan: dict) -> str:
+    """Human-readable chain of stages from explain's winning plan"""
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if index_name := plan.get("indexName"):
+            stage = f"{stage}({index_name})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or next(iter(plan.get("inputStages", [])), None)
+    return " <- ".join(stages)
+
+
+class IndexManager:
+    """Creates and verifies indexes of users and members collections.
+
+    Global indexes are created on connect,
+    per-guild leaderboard indexes are created on first leaderboard request for guild."""
+
+    def __init__(self):
+        self.users: Optional[AsyncIOMotorCollection] = None
+        self.members: Optional[AsyncIOMotorCollection] = None
+        self.status: Dict[str, str] = {}
+        self.guild_indexes: set = set()
+
+    async def setup(self, users: AsyncIOMotorCollection):
+        self.users = users
+        self.members = None
+        self.status.clear()
+        self.guild_indexes.clear()
+        info = await users.index_information()
+        await self._ensure_user_id(info)
+        for name, keys in GLOBAL_INDEXES.items():
+            await self._create(name, keys)
+        self.guild_indexes.update(
+            name[len(GUILD_INDEX_PREFIX) :] for name in info if name.startswith(GUILD_INDEX_PREFIX)
+        )
+
+    async def setup_members(self, members: AsyncIOMotorCollection):
+        """Create indexes of members collection, if it's used"""
+        self.members = members
+        for name, keys in MEMBER_INDEXES.items():
+            await self._create(
+                name,
+                keys,
+                collection=members,
+                unique=name == MEMBER_UNIQUE_INDEX,
+            )
+
+    async def _create(
+        self, name: str, keys: list, collection: AsyncIOMotorCollection = None, **kwargs
+    ) -> bool:
+        try:
+            await (collection or self.users).create_index(keys, name=name, **kwargs)
+        except mongoerrors.OperationFailure as e:
+            log.warning("Unable to create index %s: %s", name, e)
+            self.status[name] = f"failed: {e}"
+            return False
+        self.status[name] = "ok"
+        return True
+
+    async def _ensure_user_id(self, info: dict):
+        existing = [
+            name
+            for name, spec in info.items()
+            if spec["key"] == [("user_id", ASCENDING)] and name != USER_ID_INDEX
+        ]
+        if USER_ID_INDEX in info:
+            self.status[USER_ID_INDEX] = "ok"
+            return
+        duplicates = await self.users.aggregate(
+            [
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+                {"$count": "duplicates"},
+            ],
+            allowDiskUse=True,
+        ).to_list(None)
+        if duplicates:
+            log.warning(
+                "Users collection has %s duplicated users, user_id index will be not unique. "
+                "Check `lvladmin debug database duplicates`.",
+                duplicates[0]["duplicates"],
+            )
+            if not existing:
+                await self.users.create_index("user_id")
+            self.status[USER_ID_INDEX] = "not unique: {} duplicated users".format(
+                duplicates[0]["duplicates"]
+            )
+            return
+        # same keys with different options can't coexist
+        for name in existing:
+            await self.users.drop_index(name)
+        if not await self._create(USER_ID_INDEX, [("user_id", ASCENDING)], unique=True):
+            await self.users.create_index("user_id")
+
+    async def ensure_guild(self, guild_id) -> bool:
+        """Create leaderboard index for guild if possible
+
+        Returns True if guild has index."""
+        guild_id = str(guild_id)
+        if guild_id in self.guild_indexes:
+            return True
+        if self.users is None or len(self.guild_indexes) >= MAX_GUILD_INDEXES:
+            return False
+        if not await self._create(
+            GUILD_INDEX_PREFIX + guild_id,
+            guild_index_keys(guild_id),
+            partialFilterExpression={f"servers.{guild_id}.level": {"$exists": True}},
+        ):
+            return False
+        self.guild_indexes.add(guild_id)
+        return True
+
+    async def drop_guild(self, guild_id) -> bool:
+        guild_id = str(guild_id)
+        if guild_id not in self.guild_indexes:
+            return False
+        await self.users.drop_index(GUILD_INDEX_PREFIX + guild_id)
+        self.guild_indexes.discard(guild_id)
+        self.status.pop(GUILD_INDEX_PREFIX + guild_id, None)
+        return True
+
+    async def describe(self) -> List[tuple]:
+        """List of (name, keys, options) of existing indexes"""
+        collections = [self.users] if self.members is None else [self.users, self.members]
+        return [
+            (
+                f"{collection.name}.{name}",
+                ", ".join(f"{k}: {d}" for k, d in spec["key"]),
+                ", ".join(
+                    f"{k}={v}"
+                    for k, v in spec.items()
+                    if k in ("unique", "partialFilterExpression")
+                ),
+            )
+            for collection in collections
+            for name, spec in (await collection.index_information()).items()
+        ]
+
+    async def explain_find(
+        self, query: dict, sort: list = None, collection: AsyncIOMotorCollection = None
+    ) -> str:
+        cursor = (collection or self.users).find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        return plan_stages(explained["queryPlanner"]["winningPlan"])
+
+    async def explain_count(self, query: dict, collection: AsyncIOMotorCollection = None) -> str:
+        collection = collection or self.users
+        explained = await collection.database.command(
+            {"explain": {"count": collection.name, "query": query}, "verbosity": "queryPlanner"}
+        )
+        return plan_stages(explained["queryPlanner"]["winningPlan"])
@@ -0,0 +1,107 @@
+from typing import Awaitable, Callable, List
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+
+# users per bulk_write, when total XP is repaired
+CHUNK_SIZE = 1000
+
+
+def level_exp_expr(level) -> dict:
+    """Aggregation expression, same as `levels.level_exp`"""
+    # level * (level - 1) is always even, so division is exact
+    return {
+        "$add": [
+            {"$multiply": [65, level]},
+            {"$divide": [{"$multiply": [139, level, {"$subtract": [level, 1]}]}, 2]},
+        ]
+    }
+
+
+# total XP of user, calculated from levels and XP on every server
+CALCULATED_EXP = {
+    "$toLong": {
+        "$sum": {
+            "$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$servers", {}]}},
+                "as": "server",
+                "in": {
+                    "$add": [
+                        level_exp_expr({"$ifNull": ["$$server.v.level", 0]}),
+                        {"$ifNull": ["$$server.v.current_exp", 0]},
+                    ]
+                },
+            }
+        }
+    }
+}
+TOTAL_EXP = {"$ifNull": ["$total_exp", 0]}
+
+
+def summary_pipeline() -> List[dict]:
+    """Aggregation pipeline, that counts users with valid (`_id` is True) and invalid total XP"""
+    return [
+        {"$group": {"_id": {"$eq": [CALCULATED_EXP, TOTAL_EXP]}, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+    ]
+
+
+def mismatch_pipeline() -> List[dict]:
+    """Aggregation pipeline, that finds users with invalid total XP"""
+    return [
+        {
+            "$project": {
+                "_id": 0,
+                "username": 1,
+                "user_id": 1,
+                "calculated": CALCULATED_EXP,
+                "total_exp": TOTAL_EXP,
+            }
+        },
+        {"$match": {"$expr": {"$ne": ["$calculated", "$total_exp"]}}},
+        {"$set": {"diff": {"$subtract": ["$total_exp", "$calculated"]}}},
+    ]
+
+
+def repair_pipeline() -> List[dict]:
+    """Update pipeline, that sets total XP of user to calculated one
+
+    Total XP is calculated at time of write,
+    so it doesn't conflict with XP written concurrently by `xp_buffer.exp_pipeline`."""
+    return [{"$set": {"total_exp": CALCULATED_EXP}}]
+
+
+async def repair(
+    users: AsyncIOMotorCollection,
+    repaired: Callable[[List[str]], Awaitable] = None,
+) -> int:
+    """Fix total XP of users with invalid one, in `bulk_write` chunks of `CHUNK_SIZE` users
+
+    `repaired` is called with ids of users from every written chunk.
+    Returns count of fixed users."""
+    fixed = 0
+    chunk = []
+    cursor = users.aggregate(
+        mismatch_pipeline() + [{"$project": {"user_id": 1}}], allowDiskUse=True
+    )
+    async for user in cursor:
+        chunk.append(user["user_id"])
+        if len(chunk) >= CHUNK_SIZE:
+            fixed += await _repair_chunk(users, chunk, repaired)
+            chunk = []
+    if chunk:
+        fixed += await _repair_chunk(users, chunk, repaired)
+    return fixed
+
+
+async def _repair_chunk(
+    users: AsyncIOMotorCollection,
+    chunk: List[str],
+    repaired: Callable[[List[str]], Awaitable],
+) -> int:
+    result = await users.bulk_write(
+        [UpdateOne({"user_id": user_id}, repair_pipeline()) for user_id in chunk], ordered=False
+    )
+    if repaired is not None:
+        await repaired(chunk)
+    return result.modified_count
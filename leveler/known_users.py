@@ -0,0 +1,42 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+KnownUser = Tuple[str, Optional[str], str]
+
+
+class KnownUsers:
+    """Users that are known to exist in database with current username and guild entry
+
+    Used to skip `_create_user` database access for users that were already created.
+    Should be invalidated for users whose documents are deleted or replaced."""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        # (user_id, guild_id, username); guild_id is None for users checked outside of guild
+        self._known: "OrderedDict[KnownUser, None]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._known)
+
+    def __contains__(self, key: KnownUser) -> bool:
+        if key in self._known:
+            self._known.move_to_end(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, key: KnownUser):
+        self._known[key] = None
+        self._known.move_to_end(key)
+        while len(self._known) > self.max_size:
+            self._known.popitem(last=False)
+
+    def discard(self, user_id: str):
+        for key in [k for k in self._known if k[0] == user_id]:
+            del self._known[key]
+
+    def clear(self):
+        self._known.clear()
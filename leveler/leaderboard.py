@@ -0,0 +1,407 @@
+import asyncio
+import time
+from array import array
+from collections import OrderedDict, abc
+from textwrap import shorten
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from .levels import find_level
+
+GLOBAL = "global"
+
+
+class Leaderboard:
+    """Snapshot of one leaderboard, sorted by score, in compact form"""
+
+    __slots__ = ("user_ids", "names", "scores", "levels", "positions", "created")
+
+    def __init__(self, with_levels: bool = False):
+        self.user_ids: List[str] = []
+        self.names: List[str] = []
+        self.scores = array("q")
+        self.levels: Optional[array] = array("q") if with_levels else None
+        self.positions: Dict[str, int] = {}
+        self.created = time.monotonic()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @classmethod
+    def from_columns(
+        cls,
+        user_ids: List[str],
+        names: List[str],
+        scores: Sequence[int],
+        levels: Sequence[int] = None,
+    ) -> "Leaderboard":
+        """Build board from already sorted columns"""
+        board = cls(with_levels=levels is not None)
+        board.user_ids = user_ids
+        board.names = names
+        board.scores = array("q", scores)
+        if levels is not None:
+            board.levels = array("q", levels)
+        board.positions = dict(zip(user_ids, range(len(user_ids))))
+        return board
+
+    def rank(self, user_id: str) -> Optional[int]:
+        pos = self.positions.get(user_id)
+        return None if pos is None else pos + 1
+
+    def stat(self, user_id: str) -> list:
+        """User's rank and score, as used by TopPager"""
+        pos = self.positions.get(user_id)
+        if pos is None:
+            return []
+        return [pos + 1, self.scores[pos]]
+
+    def score_rank(self, user_id: str) -> Optional[int]:
+        """Rank of user by score, users with same score share rank"""
+        pos = self.positions.get(user_id)
+        if pos is None:
+            return None
+        score, scores = self.scores[pos], self.scores
+        lo, hi = 0, pos
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if scores[mid] > score:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo + 1
+
+    def _bisect(self, score: int, lo: int, hi: int) -> int:
+        """First position in `lo:hi` with score lower than `score`"""
+        scores = self.scores
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if scores[mid] < score:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _columns(self) -> list:
+        return [
+            column
+            for column in (self.user_ids, self.names, self.scores, self.levels)
+            if column is not None
+        ]
+
+    def _reindex(self, start: int, stop: int):
+        self.positions.update(zip(self.user_ids[start:stop], range(start, stop)))
+
+    def update(self, user_id: str, score: int, level: int = None, max_shift: int = None) -> bool:
+        """Change user's score, keeping board sorted
+
+        Returns False if user is not on the board,
+        or if user would be moved further than `max_shift` positions (board is not changed then)."""
+        pos = self.positions.get(user_id)
+        if pos is None:
+            return False
+        if pos > 0 and self.scores[pos - 1] < score:
+            new_pos = self._bisect(score, 0, pos)
+        elif pos < len(self) - 1 and self.scores[pos + 1] > score:
+            new_pos = self._bisect(score, pos + 1, len(self)) - 1
+        else:
+            new_pos = pos
+        if max_shift is not None and abs(new_pos - pos) > max_shift:
+            return False
+        self.scores[pos] = score
+        if self.levels is not None and level is not None:
+            self.levels[pos] = level
+        if new_pos != pos:
+            # columns are moved by C-level list/array operations, only positions are updated in loop
+            for column in self._columns():
+                column.insert(new_pos, column.pop(pos))
+            self._reindex(min(pos, new_pos), max(pos, new_pos) + 1)
+        return True
+
+    def replace(self, rows: Dict[str, Optional[tuple]]):
+        """Add, replace or remove (if row is None) users' `(name, score, level)` rows
+
+        Columns are rebuilt from slices, so all rows are applied in two passes over board."""
+        removed = sorted(
+            self.positions.pop(user_id) for user_id in rows if user_id in self.positions
+        )
+        self._set_columns(
+            [
+                self._splice(column, [(pos, pos + 1, ()) for pos in removed])
+                for column in self._columns()
+            ]
+        )
+        added = sorted(
+            (
+                (user_id, name, score, level or 0)
+                for user_id, row in rows.items()
+                if row is not None
+                for name, score, level in (row,)
+            ),
+            key=lambda row: -row[2],
+        )
+        # users with same position are inserted together, keeping order of scores
+        edits = []
+        for row in added:
+            pos = self._bisect(row[2], 0, len(self))
+            if edits and edits[-1][0] == pos:
+                edits[-1][2].append(row)
+            else:
+                edits.append((pos, pos, [row]))
+        self._set_columns(
+            [
+                self._splice(
+                    column,
+                    [(start, stop, [row[i] for row in values]) for start, stop, values in edits],
+                )
+                for i, column in enumerate(self._columns())
+            ]
+        )
+        self._reindex(
+            min(removed[:1] + [edit[0] for edit in edits[:1]], default=len(self)), len(self)
+        )
+
+    @staticmethod
+    def _splice(column, edits):
+        """Copy of column, with `start:stop` slices replaced by values, edits are sorted by start"""
+        result = column[:0]
+        prev = 0
+        for start, stop, values in edits:
+            result.extend(column[prev:start])
+            result.extend(values)
+            prev = stop
+        result.extend(column[prev:])
+        return result
+
+    def _set_columns(self, columns: list):
+        self.user_ids, self.names, self.scores = columns[:3]
+        if self.levels is not None:
+            self.levels = columns[3]
+
+
+class LeaderboardRows(abc.Sequence):
+    """Read-only view of leaderboard as rows for TopPager
+
+    Rows are built only for requested slice.
+    With `total_levels`, levels are calculated from scores, that are total XP."""
+
+    def __init__(self, board: Leaderboard, total_levels: bool = False):
+        self.board = board
+        self.total_levels = total_levels
+
+    def __len__(self):
+        return len(self.board)
+
+    def _row(self, pos: int) -> tuple:
+        board = self.board
+        name = shorten(board.names[pos], 20, placeholder="\N{HORIZONTAL ELLIPSIS}")
+        if board.levels is not None:
+            return pos + 1, board.scores[pos], board.levels[pos], name
+        if self.total_levels:
+            return pos + 1, board.scores[pos], find_level(board.scores[pos]), name
+        return pos + 1, board.scores[pos], name
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._row(pos) for pos in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("leaderboard index out of range")
+        return self._row(item)
+
+
+class GlobalLeaderboards:
+    """Global leaderboards, kept in memory and refreshed in background
+
+    Boards are patched by XP changes, so global rank is a lookup and top page is a slice.
+    Users, that are changed in other way or are not on boards yet, are re-read on next refresh.
+    Boards are rebuilt from database, if too many or unknown users are changed,
+    or if they are older than `max_age` seconds.
+
+    Only "exp" and "rep" boards are kept, levels on global top are calculated for shown rows."""
+
+    def __init__(
+        self,
+        interval: int = 300,
+        max_age: int = 3600,
+        max_changed: int = 1000,
+        max_shift: int = 1000,
+    ):
+        self.interval = interval
+        self.max_age = max_age
+        self.max_changed = max_changed
+        self.max_shift = max_shift
+        self.boards: Dict[str, Leaderboard] = {}
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.building = False
+        self.last_build: Optional[float] = None
+        self.last_refresh: Optional[float] = None
+        self.last_refresh_duration = 0.0
+        self.builds = 0
+        self.refreshes = 0
+        self._changed: Set[str] = set()
+        self._full = True
+        # time of oldest change, that is not detached by `take` yet
+        self._changed_at: Optional[float] = None
+        # time of oldest change, that is being applied by refresh
+        self._taken_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.boards)
+
+    @property
+    def changed_count(self) -> int:
+        return len(self._changed)
+
+    @property
+    def staleness(self) -> float:
+        """Seconds since oldest change, that is not on boards yet"""
+        oldest = min(filter(None, (self._changed_at, self._taken_at)), default=None)
+        return 0.0 if oldest is None else time.time() - oldest
+
+    def get(self, board_type: str) -> Optional[Leaderboard]:
+        return self.boards.get(board_type)
+
+    def changed(self, user_id: str = None):
+        """Mark user's document as changed, or all documents if user is not specified"""
+        if user_id is None:
+            self._full = True
+        else:
+            self._changed.add(user_id)
+        if self._changed_at is None:
+            self._changed_at = time.time()
+
+    def patch(self, board_type: str, user_id: str, score: int, level: int = None):
+        board = self.boards.get(board_type)
+        if board is None:
+            return
+        # long moves are applied on refresh, since positions of all passed users are changed,
+        # and boards being built may miss this change
+        if not board.update(user_id, score, level, self.max_shift) or self.building:
+            self.changed(user_id)
+
+    def take(self, full: bool = False) -> Tuple[bool, Set[str]]:
+        """Detach changes, returns whether boards should be rebuilt and changed user ids
+
+        If refresh fails, changes should be returned back with `restore`."""
+        full = (
+            full
+            or self._full
+            or len(self._changed) > self.max_changed
+            or self.last_build is None
+            or time.time() - self.last_build > self.max_age
+        )
+        changed, self._changed = self._changed, set()
+        self._taken_at, self._changed_at = self._changed_at, None
+        self._full = False
+        self.building = full
+        return full, changed
+
+    def restore(self, full: bool, changed: Set[str]):
+        self.building = False
+        self._full = self._full or full
+        self._changed.update(changed)
+        if self._taken_at is not None:
+            self._changed_at = min(self._changed_at or self._taken_at, self._taken_at)
+        self._taken_at = None
+
+    def replace(self, boards: Dict[str, Leaderboard], started: float):
+        """Set boards built from database"""
+        self.boards = boards
+        self.building = False
+        self.builds += 1
+        self.last_build = time.time()
+        self._refreshed(started)
+
+    def apply(self, userinfos: Dict[str, Optional[dict]], started: float):
+        """Update boards with re-read user documents, users without document are removed"""
+        for board_type, board in self.boards.items():
+            rows = {}
+            for user_id, userinfo in userinfos.items():
+                if userinfo is None:
+                    rows[user_id] = None
+                    continue
+                rows[user_id] = (
+                    userinfo.get("username", user_id),
+                    userinfo.get("rep" if board_type == "rep" else "total_exp", 0),
+                    None,
+                )
+            board.replace(rows)
+        self.refreshes += 1
+        self._refreshed(started)
+
+    def _refreshed(self, started: float):
+        self.last_refresh = time.time()
+        self.last_refresh_duration = time.monotonic() - started
+        self._taken_at = None
+
+
+class LeaderboardCache:
+    """Per-guild leaderboard snapshots
+
+    Snapshots are rebuilt after `ttl` seconds, and patched in between by XP changes.
+    Global boards are kept in `global_boards` instead."""
+
+    def __init__(self, ttl: int = 60, max_boards: int = 128):
+        self.ttl = ttl
+        self.max_boards = max_boards
+        self._boards: "OrderedDict[Tuple[str, str], Leaderboard]" = OrderedDict()
+        self.global_boards = GlobalLeaderboards()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._boards)
+
+    def get(self, scope, board_type: str) -> Optional[Leaderboard]:
+        if scope == GLOBAL:
+            board = self.global_boards.get(board_type)
+            if board is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return board
+        key = (str(scope), board_type)
+        board = self._boards.get(key)
+        if board is None or time.monotonic() - board.created > self.ttl:
+            self._boards.pop(key, None)
+            self.misses += 1
+            return None
+        self._boards.move_to_end(key)
+        self.hits += 1
+        return board
+
+    def put(self, scope, board_type: str, board: Leaderboard):
+        self._boards[(str(scope), board_type)] = board
+        while len(self._boards) > self.max_boards:
+            self._boards.popitem(last=False)
+
+    def patch(self, scope, board_type: str, user_id: str, score: int, level: int = None):
+        """Update user's score on cached board
+
+        Board is dropped if user is not on it, since its members have changed."""
+        if scope == GLOBAL:
+            self.global_boards.patch(board_type, user_id, score, level)
+            return
+        key = (str(scope), board_type)
+        board = self._boards.get(key)
+        if board is not None and not board.update(user_id, score, level):
+            del self._boards[key]
+
+    def changed(self, user_id):
+        """Mark user as changed on global boards, e.g. after change of rep"""
+        self.global_boards.changed(str(user_id))
+
+    def invalidate(self, scope=None):
+        """Drop boards of guild, or all boards
+
+        Global boards are kept until they are rebuilt."""
+        if scope is None or scope == GLOBAL:
+            self.global_boards.changed()
+        if scope is None:
+            self._boards.clear()
+            return
+        for key in [k for k in self._boards if k[0] == str(scope)]:
+            del self._boards[key]
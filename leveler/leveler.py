@@ -1,18 +1,34 @@
 import asyncio
+from contextlib import suppress
 from inspect import getsource
 from logging import getLogger
 
 import aiohttp
 from redbot.core import Config, commands
 from redbot.core.bot import Red
+from redbot.core.data_manager import bundled_data_path, cog_data_path
 
 from .abc import CompositeMetaClass
+from .announcements import AnnouncementQueue
+from .avatar_cache import AvatarCache
+from .card_cache import CardCache
 from .commands import LevelerCommands
 from .def_imgen_utils import DefaultImageGeneratorsUtils
 from .exp import XP
+from .guild_settings import GuildSettingsCache
+from .image_cache import ImageCache
 from .image_generators import ImageGenerators
+from .indexes import IndexManager
+from .known_users import KnownUsers
+from .leaderboard import LeaderboardCache
+from .locks import StripedLock
+from .members import OFF, MembersStore, delete_op
 from .mongodb import MongoDB
+from .render_pool import RenderPool
+from .rewards import RewardIndex
+from .spam_gate import SpamGate
 from .utils import Utils
+from .xp_buffer import XPBuffer
 
 DISABLE_COG_IN_GUILD_ANNOTATIONS = {"cog_name": "str", "guild_id": "int", "return": "bool"}
 
@@ -52,6 +68,13 @@ class Leveler(
             "allow_global_top": False,
             "global_levels": False,
             "rep_rotation": False,
+            "xp_flush_interval": 10,
+            "global_top_interval": 300,
+            "render_pool": "thread",
+            "render_workers": 2,
+            "card_encoder": "auto",
+            # layout of per-guild user data, see members.py
+            "members_migration": {"state": OFF, "last_id": None, "users": 0, "members": 0},
             "backgrounds": {
                 "profile": {
                     "alice": "http://i.imgur.com/MUSuMao.png",
@@ -91,10 +114,25 @@ class Leveler(
         self.config.register_guild(**default_guild)
 
         self._db_ready = False
-        self._db_lock = asyncio.Lock()
+        self._user_locks = StripedLock()
+        self._xp_buffer = XPBuffer()
+        self._xp_flush_task = None
+        self._global_top_task = None
+        self._indexes = IndexManager()
+        self._leaderboards = LeaderboardCache()
         self.client = None
         self.db = None
         self.session = aiohttp.ClientSession()
+        self._images = ImageCache(self.session, cog_data_path(self) / "image_cache")
+        self._cards = CardCache()
+        self._avatars = AvatarCache(bundled_data_path(self) / "defaultavatar.png")
+        self._render_pool = RenderPool()
+        self._guild_settings = GuildSettingsCache(self.config)
+        self._spam_gate = SpamGate()
+        self._known_users = KnownUsers()
+        self._rewards = RewardIndex()
+        self._announcements = AnnouncementQueue(self._announce_levelups)
+        self._members = MembersStore()
 
         self._db_user_required_commands = [
             c.qualified_name
@@ -142,7 +180,12 @@ class Leveler(
 
     async def initialize(self):
         await self.config_converter()
+        await self._render_pool.configure(
+            await self.config.render_workers(), await self.config.render_pool()
+        )
         await self._connect_to_mongo()
+        self._xp_flush_task = asyncio.create_task(self._xp_flush_loop())
+        self._global_top_task = asyncio.create_task(self._global_leaderboards_loop())
 
     async def cog_check(self, ctx):
         if (ctx.command.parent is self.levelerset) or ctx.command is self.levelerset:
@@ -153,15 +196,35 @@ class Leveler(
         # creates user if not exists
         if ctx.command.qualified_name in self._db_user_required_commands:
             await self._create_user(ctx.author, ctx.guild)
+            await self._flush_xp_buffer(str(ctx.author.id))
 
     def cog_unload(self):
         self.bot.loop.create_task(self.session.close())
-        self._disconnect_mongo()
+        self.bot.loop.create_task(self._unload_db())
+        self._render_pool.shutdown()
+        self._announcements.close()
+        self._members.stop()
+        if self._global_top_task:
+            self._global_top_task.cancel()
         self.bot.remove_dev_env_value("leveler")
 
+    async def _unload_db(self):
+        # pending XP should be written before connection is closed
+        if self._xp_flush_task:
+            self._xp_flush_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._xp_flush_task
+        self._disconnect_mongo()
+
     def format_help_for_context(self, ctx: commands.Context) -> str:  # Thanks Sinbad!
         pre_processed = super().format_help_for_context(ctx)
         return f"{pre_processed}\n\n**Version**: {self.__version__}"
 
     async def red_delete_data_for_user(self, *, requester, user_id: int):
+        await self._evict_xp_state(str(user_id))
         await self.db.users.delete_one({"user_id": str(user_id)})
+        await self._members.write([delete_op(user_id)])
+        self._known_users.discard(str(user_id))
+        # rendered cards are keyed by digest, so user's cards can't be found
+        self._cards.clear()
+        self._leaderboards.invalidate()
@@ -0,0 +1,63 @@
+import math
+from typing import Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Level `n` requires `139 * n + 65` XP to reach level `n + 1`,
+# so total XP of level `n` is `65 * n + 139 * n * (n - 1) / 2`.
+
+
+def required_exp(level: int) -> int:
+    """XP required to get from `level` to next one"""
+    return 0 if level < 0 else 139 * level + 65
+
+
+def level_exp(level: int) -> int:
+    """Total XP required to reach `level` from zero"""
+    return level * 65 + 139 * level * (level - 1) // 2
+
+
+def find_level(total_exp: int) -> int:
+    """Level reached with `total_exp`"""
+    level = int((9 + math.sqrt(81 + 1112 * total_exp)) / 278)
+    # float precision correction for large values
+    while level > 0 and level_exp(level) > total_exp:
+        level -= 1
+    while level_exp(level + 1) <= total_exp:
+        level += 1
+    return level
+
+
+def server_exp(level: int, current_exp: int) -> int:
+    """Total XP on server, from server's level and XP on that level"""
+    return level_exp(level) + current_exp
+
+
+def server_exp_batch(levels: Sequence[int], current_exps: Sequence[int]) -> list:
+    """`server_exp` for columns of levels and current XPs
+
+    Uses numpy, if available."""
+    if numpy is None:
+        return [server_exp(level, exp) for level, exp in zip(levels, current_exps)]
+    levels = numpy.asarray(levels, dtype=numpy.int64)
+    result = levels * 65 + 139 * levels * (levels - 1) // 2
+    result += numpy.asarray(current_exps, dtype=numpy.int64)
+    return result.tolist()
+
+
+def find_level_batch(totals: Sequence[int]) -> list:
+    """`find_level` for column of total XPs
+
+    Uses numpy, if available."""
+    if numpy is None:
+        return [find_level(total) for total in totals]
+    totals = numpy.asarray(totals, dtype=numpy.int64)
+    levels = ((9 + numpy.sqrt(81 + 1112 * totals.astype(numpy.float64))) / 278).astype(numpy.int64)
+    # float precision correction, same as in find_level
+    levels -= (levels * 65 + 139 * levels * (levels - 1) // 2) > totals
+    nxt = levels + 1
+    levels += (nxt * 65 + 139 * nxt * (nxt - 1) // 2) <= totals
+    return levels.tolist()
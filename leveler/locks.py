@@ -0,0 +1,86 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Tuple, Union
+
+
+class LockStripe:
+    """One lock of StripedLock with its usage stats"""
+
+    __slots__ = ("lock", "acquisitions", "contended", "max_waiters")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.max_waiters = 0
+
+    @property
+    def waiters(self) -> int:
+        # noinspection PyProtectedMember
+        return len(self.lock._waiters or ())
+
+    async def __aenter__(self):
+        if self.lock.locked():
+            self.contended += 1
+            self.max_waiters = max(self.max_waiters, self.waiters + 1)
+        await self.lock.acquire()
+        self.acquisitions += 1
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.lock.release()
+
+
+class StripedLock:
+    """Per-user locking with bounded memory usage.
+
+    User IDs are mapped to fixed amount of locks ("stripes"),
+    so unrelated users rarely wait for each other,
+    while memory usage does not depend on amount of users.
+
+    Locks are not reentrant, and only one user lock should be held at a time."""
+
+    def __init__(self, stripes: int = 64):
+        self.stripes = [LockStripe() for _ in range(stripes)]
+
+    def __call__(self, user_id: Union[int, str]) -> LockStripe:
+        return self.stripes[int(user_id) % len(self.stripes)]
+
+    @asynccontextmanager
+    async def all(self):
+        """Lock all users. Locks are acquired in same order every time."""
+        acquired = []
+        try:
+            for stripe in self.stripes:
+                await stripe.__aenter__()
+                acquired.append(stripe)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                await stripe.__aexit__(None, None, None)
+
+    def stats(self, top: int = 10) -> List[Tuple[int, bool, int, int, int, int]]:
+        """Stats of most contended stripes
+
+        Returns list of (stripe, locked, waiters, max waiters, acquisitions, contended)"""
+        rows = [
+            (i, s.lock.locked(), s.waiters, s.max_waiters, s.acquisitions, s.contended)
+            for i, s in enumerate(self.stripes)
+        ]
+        rows.sort(key=lambda r: (r[2], r[5]), reverse=True)
+        return rows[:top]
+
+    @property
+    def locked_count(self) -> int:
+        return sum(s.lock.locked() for s in self.stripes)
+
+    @property
+    def waiters(self) -> int:
+        return sum(s.waiters for s in self.stripes)
+
+    @property
+    def acquisitions(self) -> int:
+        return sum(s.acquisitions for s in self.stripes)
+
+    @property
+    def contended(self) -> int:
+        return sum(s.contended for s in self.stripes)
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterator, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+def image_size(image) -> int:
+    """Memory used by pixels of RGBA image"""
+    return image.width * image.height * 4
+
+
+class SizedLRU(Generic[V]):
+    """In-memory LRU cache, limited by total size of values
+
+    By default every value has size of 1, so cache is limited by number of values.
+    Most recently added value is kept, even if it's larger than limit by itself."""
+
+    def __init__(self, max_size: int, sizeof: Callable[[V], int] = lambda value: 1):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._values: "OrderedDict[Hashable, V]" = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key: Hashable):
+        return key in self._values
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._values)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        value = self._values.get(key)
+        if value is not None:
+            self._values.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V):
+        """Add value, evicting least recently used ones if cache is over its size"""
+        self.pop(key)
+        self._values[key] = value
+        self.size += self.sizeof(value)
+        while self.size > self.max_size and len(self._values) > 1:
+            # evicted images may still be used by running renders, so they are not closed here
+            self.size -= self.sizeof(self._values.popitem(last=False)[1])
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        value = self._values.pop(key, None)
+        if value is not None:
+            self.size -= self.sizeof(value)
+        return value
+
+    def clear(self):
+        self._values.clear()
+        self.size = 0
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, List
+
+import aiohttp
+from pymongo import UpdateOne
+
+from .xp_buffer import set_level_pipeline
+
+MEE6_URL = "https://mee6.xyz/api/plugins/levels/leaderboard/{guild_id}"
+# players per page, maximum allowed by Mee6 API. Every page is written with one bulk_write
+PAGE_SIZE = 999
+# pages fetched at once
+CONCURRENCY = 4
+
+
+class Mee6Error(Exception):
+    """Mee6 API returned no data"""
+
+
+class ImportStats:
+    """Counters and timings of Mee6 import"""
+
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.pages = 0
+        self.players = 0
+        self.imported = 0
+        self.skipped = 0
+        self.roles_updated = 0
+        self.roles_failed = 0
+        self.roles_skipped = 0
+        self.badges_given = 0
+        self.fetch_time = 0.0
+        self.write_time = 0.0
+        self.rewards_time = 0.0
+        self.started = time.monotonic()
+
+    def rows(self) -> List[tuple]:
+        total = time.monotonic() - self.started
+        return [
+            ("Pages", self.pages),
+            ("Players", self.players),
+            ("To import" if self.dry_run else "Imported", self.imported),
+            ("Skipped (not in server)", self.skipped),
+            ("Role updates needed" if self.dry_run else "Role updates", self.roles_updated),
+            ("Failed role updates", self.roles_failed),
+            ("Skipped role updates (missing permissions)", self.roles_skipped),
+            ("Badge rewards due" if self.dry_run else "Badges given", self.badges_given),
+            ("Waiting for Mee6, s", round(self.fetch_time, 2)),
+            ("Writing, s", round(self.write_time, 2)),
+            ("Rewards, s", round(self.rewards_time, 2)),
+            ("Total, s", round(total, 2)),
+            ("Players/s", round(self.players / total) if total else 0),
+        ]
+
+
+async def _fetch_page(session: aiohttp.ClientSession, url: str, page: int) -> List[dict]:
+    async with session.get(url, params={"page": page, "limit": PAGE_SIZE}) as r:
+        if r.status != 200:
+            raise Mee6Error(f"Mee6 API returned status {r.status} for page {page}.")
+        data = await r.json()
+    return data.get("players", [])
+
+
+async def fetch_players(
+    session: aiohttp.ClientSession,
+    guild_id: int,
+    pages: int,
+    stats: ImportStats,
+    url: str = MEE6_URL,
+    concurrency: int = CONCURRENCY,
+) -> AsyncIterator[List[dict]]:
+    """Yield players of Mee6 leaderboard of guild, page by page
+
+    Up to `concurrency` next pages are fetched while previous page is processed.
+    Stops on first empty page. `url` is formatted with `guild_id`."""
+    url = url.format(guild_id=guild_id)
+    fetching = deque()
+    next_page = 0
+
+    def prefetch():
+        nonlocal next_page
+        while next_page < pages and len(fetching) < concurrency:
+            fetching.append(asyncio.ensure_future(_fetch_page(session, url, next_page)))
+            next_page += 1
+
+    try:
+        prefetch()
+        while fetching:
+            started = time.monotonic()
+            players = await fetching.popleft()
+            stats.fetch_time += time.monotonic() - started
+            if not players:
+                break
+            stats.pages += 1
+            stats.players += len(players)
+            prefetch()
+            yield players
+    finally:
+        for task in fetching:
+            task.cancel()
+        await asyncio.gather(*fetching, return_exceptions=True)
+
+
+def level_ops(user_id, username: str, guild_id, level: int, new_user: dict) -> List[UpdateOne]:
+    """Create user if needed, and set level on guild, with XP from start of that level
+
+    Total XP is adjusted by database, see `xp_buffer.set_level_pipeline`.
+    `new_user` are fields of new user document, see `mongodb.new_user_fields`."""
+    return [
+        UpdateOne(
+            {"user_id": str(user_id)},
+            {"$set": {"username": username}, "$setOnInsert": new_user},
+            upsert=True,
+        ),
+        UpdateOne({"user_id": str(user_id)}, set_level_pipeline(guild_id, level)),
+    ]
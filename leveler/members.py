@@ -0,0 +1,161 @@
+import asyncio
+from logging import getLogger
+from typing import Awaitable, Callable, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import ASCENDING, DeleteMany, UpdateMany, UpdateOne
+from pymongo import errors as mongoerrors
+
+log = getLogger("red.fixator10-cogs.leveler")
+
+# members collection is not used
+OFF = "off"
+# members are written along with user documents, and copied from them in background
+MIGRATING = "migrating"
+# members are written along with user documents, and used for server leaderboards and ranks
+READY = "ready"
+
+# fields of user document that members are copied from
+SOURCE_FIELDS = {"user_id": 1, "username": 1, "rep": 1, "servers": 1}
+
+
+def member_filter(guild_id, user_id) -> dict:
+    return {"guild_id": str(guild_id), "user_id": str(user_id)}
+
+
+def exp_op(guild_id, user_id, level: int, current_exp: int) -> UpdateOne:
+    """Set member's level and XP to values already written to user document
+
+    Values are absolute, so write is correct even if member is copied concurrently."""
+    return UpdateOne(
+        member_filter(guild_id, user_id),
+        {"$set": {"level": level, "current_exp": current_exp}},
+        upsert=True,
+    )
+
+
+def rep_op(user_id, rep: int) -> UpdateMany:
+    return UpdateMany({"user_id": str(user_id)}, {"$set": {"rep": rep}})
+
+
+def delete_op(user_id) -> DeleteMany:
+    return DeleteMany({"user_id": str(user_id)})
+
+
+def member_ops(userinfo: dict) -> List[UpdateOne]:
+    """Copy per-guild data of user document to members
+
+    Level and XP of existing members are not overwritten,
+    since they are written along with user document and may be newer."""
+    user_id = userinfo["user_id"]
+    servers = userinfo.get("servers")
+    if not isinstance(servers, dict):
+        return []
+    return [
+        UpdateOne(
+            member_filter(guild_id, user_id),
+            {
+                "$set": {
+                    "username": userinfo.get("username", user_id),
+                    "rep": userinfo.get("rep", 0),
+                },
+                "$setOnInsert": {
+                    "level": server.get("level", 0),
+                    "current_exp": server.get("current_exp", 0),
+                },
+            },
+            upsert=True,
+        )
+        for guild_id, server in servers.items()
+    ]
+
+
+class MembersStore:
+    """Per-guild user data in `members` collection, one document per guild and user
+
+    Legacy layout keeps this data in `servers.<guild_id>` of user documents,
+    that can't be indexed for all guilds at once.
+    While members are migrated, both layouts are written, but only user documents are read.
+    After migration server leaderboards and ranks are read from members,
+    falling back to user documents for missing members.
+    User documents are still written, so layout can be switched back at any time."""
+
+    def __init__(self):
+        self.members: Optional[AsyncIOMotorCollection] = None
+        self.state = OFF
+        self.writes = 0
+        self.failed_writes = 0
+        self.migration: Optional[asyncio.Task] = None
+
+    @property
+    def writing(self) -> bool:
+        return self.members is not None and self.state != OFF
+
+    @property
+    def reading(self) -> bool:
+        return self.members is not None and self.state == READY
+
+    @property
+    def migrating(self) -> bool:
+        """Whether members are being copied right now"""
+        return self.migration is not None and not self.migration.done()
+
+    def setup(self, db: AsyncIOMotorDatabase, state: str):
+        self.members = db.members
+        self.state = state
+
+    async def write(self, ops: list):
+        """Write changes of user documents to members, if members are used
+
+        Failures are logged, since user documents are already written."""
+        if not ops or not self.writing:
+            return
+        try:
+            await self.members.bulk_write(ops, ordered=False)
+        except mongoerrors.PyMongoError as e:
+            self.failed_writes += 1
+            log.error("Unable to write %s changes to members", len(ops), exc_info=e)
+        else:
+            self.writes += len(ops)
+
+    async def find(self, guild_id, user_id) -> Optional[dict]:
+        """Member document, if members are read and member is migrated"""
+        if not self.reading:
+            return None
+        return await self.members.find_one(member_filter(guild_id, user_id))
+
+    async def migrate(
+        self,
+        users: AsyncIOMotorCollection,
+        progress: dict,
+        save: Callable[[dict], Awaitable],
+        batch_size: int = 500,
+    ):
+        """Copy members from user documents, in batches ordered by _id
+
+        Progress is saved after every batch, so migration continues from where it stopped."""
+        last_id = ObjectId(progress["last_id"]) if progress["last_id"] else None
+        while True:
+            query = {} if last_id is None else {"_id": {"$gt": last_id}}
+            batch = (
+                await users.find(query, projection=SOURCE_FIELDS)
+                .sort("_id", ASCENDING)
+                .limit(batch_size)
+                .to_list(None)
+            )
+            if not batch:
+                return
+            ops = [op for userinfo in batch for op in member_ops(userinfo)]
+            if ops:
+                await self.members.bulk_write(ops, ordered=False)
+            last_id = batch[-1]["_id"]
+            progress["last_id"] = str(last_id)
+            progress["users"] += len(batch)
+            progress["members"] += len(ops)
+            await save(progress)
+
+    def stop(self):
+        """Stop copying members. Migration can be continued later."""
+        if self.migrating:
+            self.migration.cancel()
@@ -0,0 +1,29 @@
+import discord
+from redbot.core.utils import chat_formatting as chat
+from redbot.vendored.discord.ext import menus
+from tabulate import tabulate
+
+
+class IntegrityPager(menus.AsyncIteratorPageSource):
+    """Users with invalid total XP, read from aggregation cursor as pages are shown"""
+
+    def __init__(self, cursor):
+        super().__init__(cursor, per_page=15)
+
+    async def format_page(self, menu: menus.MenuPages, entries):
+        table = tabulate(
+            [
+                (
+                    user["username"],
+                    user["user_id"],
+                    user["calculated"],
+                    user["total_exp"],
+                    user["diff"],
+                )
+                for user in entries
+            ],
+            headers=["Username", "ID", "Calculated total XP", "Total XP", "Diff"],
+        )
+        embed = discord.Embed(color=await menu.ctx.embed_color(), description=chat.box(table))
+        embed.set_footer(text="Page {}".format(menu.current_page + 1))
+        return embed
@@ -1,7 +1,11 @@
+import asyncio
+
 from .abc import MixinMeta
+from .members import READY, SOURCE_FIELDS, member_ops
 
 try:
     from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo import UpdateOne
     from pymongo import errors as mongoerrors
 except Exception as e:
     raise RuntimeError(f"Can't load pymongo/motor:{e}\nInstall 'pymongo' and 'motor' packages")
@@ -10,6 +14,28 @@ except Exception as e:
 REQUIRED_MONGODB_VERSION = [4, 4]
 
 
+def new_user_fields(backgrounds: dict) -> dict:
+    """Fields of new user document, except `user_id` and `username`"""
+    return {
+        "servers": {},
+        "total_exp": 0,
+        "profile_background": backgrounds["profile"]["default"],
+        "rank_background": backgrounds["rank"]["default"],
+        "levelup_background": backgrounds["levelup"]["default"],
+        "title": "",
+        "info": "I am a mysterious person.",
+        "rep": 0,
+        "badges": {},
+        "active_badges": {},
+        "rep_color": [],
+        "badge_col_color": [],
+        "rep_block": 0,
+        "chat_block": 0,
+        "lastrep": 0,
+        "last_message": "",
+    }
+
+
 class MongoDBUnsupportedVersion(Exception):
     def __init__(self, version, current_version):
         super().__init__(
@@ -25,6 +51,12 @@ class MongoDB(MixinMeta):
     async def _connect_to_mongo(self):
         self.log.info("Connecting to MongoDB...")
         if self._db_ready:
+            await self._flush_xp_buffer()
+            self._xp_buffer.clear()
+            self._spam_gate.clear()
+            self._known_users.clear()
+            self._rewards.invalidate()
+            self._members.stop()
             self._db_ready = False
         self._disconnect_mongo()
         config = await self.config.custom("MONGODB").all()
@@ -37,6 +69,13 @@ class MongoDB(MixinMeta):
                     ".".join(map(str, REQUIRED_MONGODB_VERSION)), info.get("version", "?")
                 )
             self.db = self.client[config["db_name"]]
+            self._members.setup(self.db, (await self.config.members_migration())["state"])
+            try:
+                await self._indexes.setup(self.db.users)
+                if self._members.writing:
+                    await self._indexes.setup_members(self.db.members)
+            except mongoerrors.PyMongoError as e:
+                self.log.exception("Unable to set up MongoDB indexes.", exc_info=e)
             self._db_ready = True
             self.log.info("MongoDB: connection established.")
         except (
@@ -63,56 +102,70 @@ class MongoDB(MixinMeta):
             return
         if user.bot:
             return
-        async with self._db_lock:
+        key = (str(user.id), str(server.id) if server else None, user.name)
+        if key in self._known_users:
+            return
+        async with self._user_locks(user.id):
             self.log.debug("Locking db for user %s creation", user)
-            try:
-                userinfo = await self.db.users.find_one({"user_id": str(user.id)})
-                backgrounds = await self.config.backgrounds()
-                if not userinfo:
-                    new_account = {
-                        "user_id": str(user.id),
-                        "username": user.name,
-                        "servers": {},
-                        "total_exp": 0,
-                        "profile_background": backgrounds["profile"]["default"],
-                        "rank_background": backgrounds["rank"]["default"],
-                        "levelup_background": backgrounds["levelup"]["default"],
-                        "title": "",
-                        "info": "I am a mysterious person.",
-                        "rep": 0,
-                        "badges": {},
-                        "active_badges": {},
-                        "rep_color": [],
-                        "badge_col_color": [],
-                        "rep_block": 0,
-                        "chat_block": 0,
-                        "lastrep": 0,
-                        "last_message": "",
-                    }
-                    await self.db.users.insert_one(new_account)
-
-                userinfo = await self.db.users.find_one({"user_id": str(user.id)})
-
-                if "username" not in userinfo or userinfo["username"] != user.name:
-                    await self.db.users.update_one(
-                        {"user_id": str(user.id)},
-                        {"$set": {"username": user.name}},
-                        upsert=True,
-                    )
-
-                if server and (
-                    "servers" not in userinfo or str(server.id) not in userinfo["servers"]
-                ):
-                    await self.db.users.update_one(
-                        {"user_id": str(user.id)},
+            backgrounds = await self.config.backgrounds()
+            # new account is created, and username is updated in one request
+            ops = [
+                UpdateOne(
+                    {"user_id": str(user.id)},
+                    {
+                        "$set": {"username": user.name},
+                        "$setOnInsert": new_user_fields(backgrounds),
+                    },
+                    upsert=True,
+                )
+            ]
+            if server:
+                # matches only if user has no data on this server yet
+                ops.append(
+                    UpdateOne(
+                        {"user_id": str(user.id), f"servers.{server.id}": {"$exists": False}},
                         {
                             "$set": {
-                                "servers.{}.level".format(server.id): 0,
-                                "servers.{}.current_exp".format(server.id): 0,
+                                f"servers.{server.id}.level": 0,
+                                f"servers.{server.id}.current_exp": 0,
                             }
                         },
-                        upsert=True,
                     )
-            except AttributeError as error:
+                )
+            try:
+                await self.db.users.bulk_write(ops, ordered=True)
+            except mongoerrors.PyMongoError as error:
                 self.log.error(f"Unable to create/update user {user.id}.", exc_info=error)
+            else:
+                if self._members.writing and (
+                    userinfo := await self.db.users.find_one(
+                        {"user_id": str(user.id)}, projection=SOURCE_FIELDS
+                    )
+                ):
+                    # also updates username of user on other guilds
+                    await self._members.write(member_ops(userinfo))
+                self._known_users.add(key)
             self.log.debug("Unlocking db after user %s creation", user)
+
+    async def _migrate_members(self, batch_size: int):
+        """Copy per-guild data from user documents to members, and switch reads to members"""
+        progress = await self.config.members_migration()
+        self.log.info("Migrating members from user %s...", progress["last_id"] or "start")
+        try:
+            await self._members.migrate(
+                self.db.users, progress, self.config.members_migration.set, batch_size
+            )
+        except asyncio.CancelledError:
+            self.log.info("Members migration paused after %s users.", progress["users"])
+            raise
+        except mongoerrors.PyMongoError as e:
+            self.log.error("Members migration failed, it can be continued later.", exc_info=e)
+            return
+        progress["state"] = self._members.state = READY
+        await self.config.members_migration.set(progress)
+        self._leaderboards.invalidate()
+        self.log.info(
+            "Members migration finished: %s members of %s users.",
+            progress["members"],
+            progress["users"],
+        )
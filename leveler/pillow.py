@@ -0,0 +1,30 @@
+from redbot.core.errors import CogLoadError
+
+# Rendering modules import Pillow from here, so broken installation
+# is reported with link to wiki in one place.
+
+try:
+    from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps
+    from PIL import features as pil_features
+except Exception as e:
+    raise CogLoadError(
+        f"Can't load pillow: {e}\n"
+        "Please follow next steps on wiki: "
+        "https://github.com/fixator10/Fixator10-Cogs/wiki/"
+        "Installing-Leveler#my-bot-throws-error-on-load-something-related-to-pillow."
+    )
+
+try:
+    LANCZOS = Image.Resampling.LANCZOS
+except AttributeError:
+    from PIL.Image import LANCZOS
+
+__all__ = (
+    "Image",
+    "ImageChops",
+    "ImageDraw",
+    "ImageFont",
+    "ImageOps",
+    "LANCZOS",
+    "pil_features",
+)
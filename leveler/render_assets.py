@@ -0,0 +1,121 @@
+import threading
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from typing import Callable, Dict, FrozenSet, Iterator, Optional, Tuple
+
+from fontTools.ttLib import TTFont
+
+from .pillow import LANCZOS, Image, ImageDraw, ImageFont
+
+# Assets are cached per process and shared between renders,
+# so cached images should never be modified or closed.
+
+# caches used by renders in current thread instead of shared ones, see `isolated`
+_local = threading.local()
+
+
+def cached(maxsize: int):
+    """`lru_cache`, that is replaced by separate cache in `isolated` context"""
+
+    def decorator(func: Callable) -> Callable:
+        shared = lru_cache(maxsize=maxsize)(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            caches = getattr(_local, "caches", None)
+            if caches is None:
+                return shared(*args, **kwargs)
+            if (cache := caches.get(func)) is None:
+                cache = caches[func] = lru_cache(maxsize=maxsize)(func)
+            return cache(*args, **kwargs)
+
+        wrapper.cache_info = shared.cache_info
+        wrapper.cache_clear = shared.cache_clear
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def isolated() -> Iterator[Dict[Callable, Callable]]:
+    """Use separate empty asset caches for renders in current thread, e.g. for benchmarks
+
+    Clearing yielded dict drops everything cached in this context."""
+    _local.caches = caches = {}
+    try:
+        yield caches
+    finally:
+        _local.caches = None
+
+
+@cached(64)
+def font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    """Font file loaded with given size"""
+    return ImageFont.truetype(path, size)
+
+
+@cached(16)
+def font_coverage(path: str) -> FrozenSet[int]:
+    """Unicode codepoints that have glyphs in font file"""
+    with TTFont(path, lazy=True) as ttfont:
+        return frozenset(
+            codepoint
+            for cmap in ttfont["cmap"].tables
+            if cmap.isUnicode()
+            for codepoint in cmap.cmap
+        )
+
+
+@cached(32)
+def circle_mask(raw_length: int, size: int) -> Image.Image:
+    """Antialiased circle mask, drawn at `raw_length` and downscaled to `size`"""
+    mask = Image.new("L", (raw_length, raw_length), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((0, 0) + (raw_length, raw_length), fill=255, outline=0)
+    if raw_length == size:
+        return mask
+    resized = mask.resize((size, size), LANCZOS)
+    mask.close()
+    return resized
+
+
+@cached(32)
+def filled_circle(
+    raw_length: int, size: int, fill: Tuple[int, ...], outline: Optional[Tuple[int, ...]] = None
+) -> Image.Image:
+    """Antialiased RGBA circle of `fill` color, drawn at `raw_length` and downscaled to `size`"""
+    circle = Image.new("RGBA", (raw_length, raw_length))
+    draw = ImageDraw.Draw(circle)
+    draw.ellipse([0, 0, raw_length, raw_length], fill=fill, outline=outline)
+    resized = circle.resize((size, size), LANCZOS)
+    circle.close()
+    return resized
+
+
+@cached(32)
+def corners_alpha(size: Tuple[int, int], rad: int, multiplier: int = 6) -> Image.Image:
+    """Alpha channel for image of `size` with rounded corners of `rad` radius"""
+    raw_length = rad * 2 * multiplier
+    circle = circle_mask(raw_length, rad * 2)
+    alpha = Image.new("L", size, 255)
+    w, h = size
+    alpha.paste(circle.crop((0, 0, rad, rad)), (0, 0))
+    alpha.paste(circle.crop((0, rad, rad, rad * 2)), (0, h - rad))
+    alpha.paste(circle.crop((rad, 0, rad * 2, rad)), (w - rad, 0))
+    alpha.paste(circle.crop((rad, rad, rad * 2, rad * 2)), (w - rad, h - rad))
+    return alpha
+
+
+def cache_stats() -> list:
+    """Rows of (asset, cached, hits, misses) for debug info"""
+    return [
+        (func.__name__, info.currsize, info.hits, info.misses)
+        for func in (font, font_coverage, circle_mask, filled_circle, corners_alpha)
+        for info in (func.cache_info(),)
+    ]
+
+
+def clear():
+    """Drop all cached assets"""
+    for func in (font, font_coverage, circle_mask, filled_circle, corners_alpha):
+        func.cache_clear()
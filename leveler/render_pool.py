@@ -0,0 +1,91 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+POOL_TYPES = ("thread", "process")
+
+
+class RenderPool:
+    """Long-lived executor for image rendering
+
+    At most `workers` renders are submitted to executor at once, others wait in queue,
+    so levelup storms don't pile up work in executor.
+    Functions run in process pool should be module-level, with picklable arguments."""
+
+    def __init__(self, workers: int = 2, pool_type: str = "thread"):
+        self.workers = workers
+        self.pool_type = pool_type
+        self._executor: Optional[Executor] = None
+        # notified when render finishes or pool is resized
+        self._slots = asyncio.Condition()
+        self.running = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.render_time = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="leveler_render"
+                )
+        return self._executor
+
+    async def configure(self, workers: int, pool_type: str):
+        """Change pool size or type
+
+        Renders that are already running are finished by old executor,
+        and count towards new `workers` limit until then."""
+        if pool_type not in POOL_TYPES:
+            raise ValueError(f"Unknown pool type: {pool_type}")
+        if (workers, pool_type) == (self.workers, self.pool_type):
+            return
+        self.shutdown()
+        async with self._slots:
+            self.workers = workers
+            self.pool_type = pool_type
+            self._slots.notify_all()
+
+    async def run(self, func, *args, **kwargs):
+        """Run func in pool, waiting for free worker"""
+        queued_at = time.perf_counter()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            async with self._slots:
+                # pool may be resized while waiting
+                await self._slots.wait_for(lambda: self.running < self.workers)
+                self.running += 1
+        finally:
+            self.queued -= 1
+        started = time.perf_counter()
+        self.wait_time += started - queued_at
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(func, *args, **kwargs)
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            self.render_time += time.perf_counter() - started
+            return result
+        finally:
+            async with self._slots:
+                self.running -= 1
+                # waiter cancelled after notify would swallow single wakeup
+                self._slots.notify_all()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
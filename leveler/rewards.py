@@ -0,0 +1,89 @@
+from typing import Dict, NamedTuple, Set, Tuple
+
+import discord
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+
+class LevelRewards(NamedTuple):
+    """Rewards given on reaching level in guild"""
+
+    add_roles: Tuple[int, ...]
+    remove_roles: Tuple[int, ...]
+    # user's badge key (`name_serverid`) -> badge data
+    badges: Dict[str, dict]
+
+
+class RewardIndex:
+    """Per-guild index of level rewards, built from role and badge links
+
+    Linked roles are stored by name, so they are resolved to ids when index is built.
+    Index should be invalidated by commands that change role/badge links or linked badges,
+    and when guild's roles are changed."""
+
+    def __init__(self):
+        self._guilds: Dict[int, Dict[int, LevelRewards]] = {}
+        # changed on every invalidation, so index built during invalidation is not stored
+        self._generation = 0
+        self.builds = 0
+
+    def __len__(self):
+        return len(self._guilds)
+
+    async def get(self, db: AsyncIOMotorDatabase, guild: discord.Guild) -> Dict[int, LevelRewards]:
+        """Get rewards of guild, by level"""
+        index = self._guilds.get(guild.id)
+        if index is not None:
+            return index
+        generation = self._generation
+        server_roles = await db.roles.find_one({"server_id": str(guild.id)})
+        badge_links = await db.badgelinks.find_one({"server_id": str(guild.id)})
+        server_badges = None
+        if badge_links and badge_links.get("badges"):
+            server_badges = await db.badges.find_one({"server_id": str(guild.id)})
+        index = self._build(guild, server_roles, badge_links, server_badges)
+        self.builds += 1
+        if generation == self._generation:
+            self._guilds[guild.id] = index
+        return index
+
+    @staticmethod
+    def _build(guild, server_roles, badge_links, server_badges) -> Dict[int, LevelRewards]:
+        # first role with name wins, same as with `discord.utils.get`
+        role_ids = {}
+        for role in guild.roles:
+            role_ids.setdefault(role.name, role.id)
+        rewards: Dict[int, Tuple[list, list, dict]] = {}
+        for name, link in (server_roles or {}).get("roles", {}).items():
+            add_roles, remove_roles, _ = rewards.setdefault(int(link["level"]), ([], [], {}))
+            if name in role_ids:
+                add_roles.append(role_ids[name])
+            if link.get("remove_role") in role_ids:
+                remove_roles.append(role_ids[link["remove_role"]])
+        badges = (server_badges or {}).get("badges", {})
+        for name, level in (badge_links or {}).get("badges", {}).items():
+            if name in badges:
+                _, _, level_badges = rewards.setdefault(int(level), ([], [], {}))
+                level_badges[f"{name}_{guild.id}"] = badges[name]
+        return {
+            level: LevelRewards(tuple(add_roles), tuple(remove_roles), level_badges)
+            for level, (add_roles, remove_roles, level_badges) in rewards.items()
+        }
+
+    def invalidate(self, guild_id: int = None):
+        """Drop index of guild, or all indexes if guild is not specified"""
+        self._generation += 1
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
+
+
+def reached_roles(rewards: Dict[int, LevelRewards], level: int, role_ids: Set[int]) -> Set[int]:
+    """Roles of user with `role_ids`, after getting rewards of every level up to `level`
+
+    Rewards are applied in order of levels, same as on level-ups one by one."""
+    role_ids = set(role_ids)
+    for reward_level in sorted(reward_level for reward_level in rewards if reward_level <= level):
+        role_ids.difference_update(rewards[reward_level].remove_roles)
+        role_ids.update(rewards[reward_level].add_roles)
+    return role_ids
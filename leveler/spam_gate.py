@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from hashlib import md5
+from typing import Optional, Tuple
+
+# seconds between messages that give XP
+CHAT_COOLDOWN = 120
+
+
+def message_digest(content: str) -> str:
+    """Digest of message content, as stored in user's `last_message`"""
+    # md5 of message is faster than executor roundtrip
+    return md5(content.encode()).hexdigest()
+
+
+class SpamGate:
+    """Cooldown and last message digest of recently active users
+
+    Used to drop messages that can't give XP before user is read from database.
+    Users are added from their database state, and updated when they get XP."""
+
+    def __init__(self, max_users: int = 50000):
+        self.max_users = max_users
+        # user_id -> (chat_block, last_message digest)
+        self._users: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self.blocked = 0
+        self.passed = 0
+        self.unknown = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def check(self, user_id: str, now: float, digest: str) -> Optional[bool]:
+        """Check if message can give XP
+
+        Returns None if user's state is unknown."""
+        state = self._users.get(user_id)
+        if state is None:
+            self.unknown += 1
+            return None
+        self._users.move_to_end(user_id)
+        chat_block, last_message = state
+        if now - chat_block < CHAT_COOLDOWN or digest == last_message:
+            self.blocked += 1
+            return False
+        self.passed += 1
+        return True
+
+    def update(self, user_id: str, chat_block: float, last_message: Optional[str]):
+        self._users[user_id] = (float(chat_block or 0), last_message)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def discard(self, user_id: str):
+        self._users.pop(user_id, None)
+
+    def clear(self):
+        self._users.clear()
@@ -0,0 +1,92 @@
+from itertools import groupby
+from typing import List, Sequence, Tuple
+
+from . import render_assets
+from .pillow import ImageDraw, ImageFont
+
+Font = ImageFont.FreeTypeFont
+Run = Tuple[Font, str]
+
+# Text is drawn with chain of fonts: each character is drawn with first font that has glyph for it,
+# and last font of chain is used for characters that no font has.
+# Consecutive characters of same font form a run, that is drawn with one call.
+
+
+def advance(font: Font, char: str) -> float:
+    """Advance width of character's glyph
+
+    Font should be loaded with `render_assets.font`, it's loaded again by path on cache miss."""
+    return _advance((font.path, font.size), char)
+
+
+# glyphs of few fonts used by cards, enough for names and infos in many scripts
+@render_assets.cached(4096)
+def _advance(font_key: Tuple[str, int], char: str) -> float:
+    font = render_assets.font(*font_key)
+    try:
+        return font.getlength(char)
+    except AttributeError:
+        return font.getsize(char)[0]
+
+
+def _font_picker(fonts: Sequence[Font]):
+    coverages = [(font, render_assets.font_coverage(font.path)) for font in fonts[:-1]]
+    fallback = fonts[-1]
+
+    def pick(char: str) -> Font:
+        codepoint = ord(char)
+        for font, coverage in coverages:
+            if codepoint in coverage:
+                return font
+        return fallback
+
+    return pick
+
+
+def runs(text: str, fonts: Sequence[Font]) -> List[Run]:
+    """Split text into runs of characters that are drawn with same font of chain"""
+    return [(font, "".join(chars)) for font, chars in groupby(text, key=_font_picker(fonts))]
+
+
+def text_width(text: str, fonts: Sequence[Font]) -> float:
+    pick = _font_picker(fonts)
+    return sum(advance(pick(char), char) for char in text)
+
+
+def fit(text: str, fonts: Sequence[Font], max_width: float, ellipsis: str = "…") -> str:
+    """Truncate text with ellipsis, so it's no wider than `max_width` when drawn"""
+    pick = _font_picker(fonts)
+    widths = [advance(pick(char), char) for char in text]
+    if sum(widths) <= max_width:
+        return text
+    available = max_width - sum(advance(pick(char), char) for char in ellipsis)
+    length = 0
+    for length, width in enumerate(widths):
+        available -= width
+        if available < 0:
+            break
+    return text[:length] + ellipsis
+
+
+def draw_text(
+    draw: ImageDraw.ImageDraw, xy: Tuple[float, float], text: str, fonts: Sequence[Font], fill
+) -> float:
+    """Draw text with chain of fonts, one call per run
+
+    Returns x position where text ends."""
+    x, y = xy
+    for font, run in runs(text, fonts):
+        draw.text((round(x), y), run, font=font, fill=fill)
+        x += sum(advance(font, char) for char in run)
+    return x
+
+
+def cache_stats() -> list:
+    """Rows of (asset, cached, hits, misses) for debug info"""
+    info = _advance.cache_info()
+    return [("glyph_advances", info.currsize, info.hits, info.misses)]
+
+
+def clear():
+    """Drop cached glyph advances"""
+    _advance.cache_clear()
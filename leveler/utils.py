@@ -1,7 +1,5 @@
 from asyncio import TimeoutError as AsyncTimeoutError
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import partial
-from hashlib import md5
 
 import discord
 from redbot.core import bank
@@ -20,6 +18,21 @@ except Exception as e:
     )
 
 
+def truncate_text(text, max_length):
+    if len(text) > max_length:
+        return text[: max_length - 1] + "…"
+    return text
+
+
+def get_character_pixel_width(font: ImageFont.FreeTypeFont, char: str) -> int:
+    """Use getlength over using getsize for character pixel width, if available in PIL."""
+    try:
+        write_pos = int(font.getlength(char))
+    except AttributeError:
+        write_pos = font.getsize(char)[0]
+    return write_pos
+
+
 class Utils(MixinMeta):
     """Utility methods"""
 
@@ -27,16 +40,6 @@ class Utils(MixinMeta):
         """Run func in executor"""
         return await self.bot.loop.run_in_executor(None, partial(func, *args, **kwargs))
 
-    async def asyncify_thread(self, func, *args, **kwargs):
-        """Run func in thread executor"""
-        with ThreadPoolExecutor() as pool:
-            return await self.bot.loop.run_in_executor(pool, partial(func, *args, **kwargs))
-
-    async def asyncify_process(self, func, *args, **kwargs):
-        """Run func in process executor"""
-        with ProcessPoolExecutor() as pool:
-            return await self.bot.loop.run_in_executor(pool, partial(func, *args, **kwargs))
-
     async def _badge_convert_dict(self, userinfo):
         if "badges" not in userinfo or not isinstance(userinfo["badges"], dict):
             await self.db.users.update_one(
@@ -44,9 +47,6 @@ class Utils(MixinMeta):
             )
         return await self.db.users.find_one({"user_id": userinfo["user_id"]})
 
-    async def hash_with_md5(self, string: str):
-        return (await self.asyncify(md5, string.encode())).hexdigest()
-
     # converts hex to rgb
     async def _hex_to_rgb(self, hex_num: str, a: int):
         h = hex_num.lstrip("#")
@@ -91,15 +91,8 @@ class Utils(MixinMeta):
         return True
 
     def _truncate_text(self, text, max_length):
-        if len(text) > max_length:
-            return text[: max_length - 1] + "…"
-        return text
+        return truncate_text(text, max_length)
 
     @staticmethod
     def _get_character_pixel_width(font: ImageFont.FreeTypeFont, char: str) -> int:
-        """Use getlength over using getsize for character pixel width, if available in PIL."""
-        try:
-            write_pos = int(font.getlength(char))
-        except AttributeError:
-            write_pos = font.getsize(char)[0]
-        return write_pos
+        return get_character_pixel_width(font, char)
@@ -0,0 +1,259 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+from .integrity import level_exp_expr
+from .levels import level_exp, required_exp
+
+XP_FIELDS = ("user_id", "total_exp", "chat_block", "last_message")
+
+
+def apply_exp(userinfo: dict, server_id: str, exp: int) -> bool:
+    """Add XP to user's state on server, returns True if user leveled up
+
+    Level is increased at most once, same as by `exp_pipeline`."""
+    server = userinfo["servers"][server_id]
+    required = required_exp(server["level"])
+    leveled_up = server["current_exp"] + exp >= required
+    userinfo["total_exp"] += exp
+    if leveled_up:
+        server["level"] += 1
+        server["current_exp"] += exp - required
+    else:
+        server["current_exp"] += exp
+    return leveled_up
+
+
+def exp_pipeline(servers: Dict[str, int], fields: dict) -> List[dict]:
+    """Update pipeline, that adds XP to user document and applies level-ups in database
+
+    `servers` maps server id to XP gained on it, `fields` are set as is.
+    Mirrors `apply_exp`, so result doesn't depend on XP state cached by this bot."""
+    added = {
+        "total_exp": {"$add": [{"$ifNull": ["$total_exp", 0]}, sum(servers.values())]},
+        **{field: {"$literal": value} for field, value in fields.items()},
+    }
+    leveled = {}
+    for server_id, exp in servers.items():
+        level = f"servers.{server_id}.level"
+        current_exp = f"servers.{server_id}.current_exp"
+        added[level] = {"$ifNull": [f"${level}", 0]}
+        added[current_exp] = {"$add": [{"$ifNull": [f"${current_exp}", 0]}, exp]}
+        required = {"$add": [{"$multiply": [139, f"${level}"]}, 65]}
+        leveled_up = {"$gte": [f"${current_exp}", required]}
+        leveled[level] = {"$cond": [leveled_up, {"$add": [f"${level}", 1]}, f"${level}"]}
+        leveled[current_exp] = {
+            "$cond": [leveled_up, {"$subtract": [f"${current_exp}", required]}, f"${current_exp}"]
+        }
+    return [{"$set": added}, {"$set": leveled}]
+
+
+def set_level_pipeline(server_id, level: int) -> List[dict]:
+    """Update pipeline, that sets user's level on server, with XP from start of that level
+
+    Total XP is adjusted by database, using XP that user had on server at time of write,
+    so XP written concurrently is not lost."""
+    server = f"servers.{server_id}"
+    old_exp = {
+        "$add": [
+            level_exp_expr({"$ifNull": [f"${server}.level", 0]}),
+            {"$ifNull": [f"${server}.current_exp", 0]},
+        ]
+    }
+    return [
+        {
+            "$set": {
+                "total_exp": {
+                    "$toLong": {
+                        "$add": [
+                            {"$subtract": [{"$ifNull": ["$total_exp", 0]}, old_exp]},
+                            level_exp(level),
+                        ]
+                    }
+                },
+                f"{server}.level": level,
+                f"{server}.current_exp": 0,
+            }
+        }
+    ]
+
+
+class XPBuffer:
+    """Write-behind accumulator for chat XP.
+
+    Keeps XP-related state of recently active users in memory
+    (in the same shape as user document, but only with fields used in XP handling)
+    and collects changes to it, so they can be written to database in batches.
+
+    Users with pending changes are never evicted from the cache,
+    so cached state is always at least as fresh as the database one.
+    """
+
+    def __init__(self, max_users: int = 10000, max_pending: int = 1000):
+        self.max_users = max_users
+        self.max_pending = max_pending
+        self.wakeup = asyncio.Event()
+        self._users: "OrderedDict[str, dict]" = OrderedDict()
+        # user_id -> {server_id: exp not yet written}
+        self._pending: Dict[str, list] = {}
+        # users, whose changes are being written right now -> event set when write is done
+        self._writing: Dict[str, asyncio.Event] = {}
+        self.flushed_ops = 0
+        self.failed_flushes = 0
+        self.last_flush: Optional[float] = None
+        self.last_flush_duration = 0.0
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id: str):
+        return user_id in self._users
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def get(self, user_id: str, server_id: str) -> Optional[dict]:
+        """Get cached state of user, if it contains data for server"""
+        userinfo = self._users.get(user_id)
+        if userinfo is None or server_id not in userinfo["servers"]:
+            return None
+        self._users.move_to_end(user_id)
+        return userinfo
+
+    def seed(self, userinfo: dict, server_id: str) -> dict:
+        """Put data from user document into cache and return cached state"""
+        user_id = userinfo["user_id"]
+        cached = self._users.get(user_id)
+        if cached is None:
+            cached = {field: userinfo.get(field) for field in XP_FIELDS}
+            cached["chat_block"] = cached["chat_block"] or 0
+            cached["servers"] = {}
+            self._users[user_id] = cached
+        server = userinfo.get("servers", {}).get(server_id, {})
+        cached["servers"].setdefault(
+            server_id,
+            {"level": server.get("level", 0), "current_exp": server.get("current_exp", 0)},
+        )
+        self._users.move_to_end(user_id)
+        return cached
+
+    def add(self, user_id: str, server_id: str, exp: int):
+        """Mark user's cached state as changed, with `exp` gained on server"""
+        pending = self._pending.setdefault(user_id, {})
+        pending[server_id] = pending.get(server_id, 0) + exp
+        if len(self._pending) >= self.max_pending:
+            self.wakeup.set()
+
+    def clear(self):
+        """Forget all cached state. Pending changes are lost."""
+        self._users.clear()
+        self._pending.clear()
+
+    def discard(self, user_id: str):
+        """Forget cached state of user. Pending changes are lost."""
+        self._users.pop(user_id, None)
+        self._pending.pop(user_id, None)
+
+    def take(self, user_ids: Iterable[str] = None) -> Tuple[List[UpdateOne], dict]:
+        """Detach pending changes and build database operations for them
+
+        If write fails, changes should be returned back with `restore`."""
+        if user_ids is None:
+            taken, self._pending = self._pending, {}
+        else:
+            taken = {
+                user_id: self._pending.pop(user_id)
+                for user_id in user_ids
+                if user_id in self._pending
+            }
+        done = asyncio.Event()
+        self._writing.update(dict.fromkeys(taken, done))
+        ops = [
+            UpdateOne({"user_id": user_id}, self.pipeline(user_id, servers))
+            for user_id, servers in taken.items()
+        ]
+        return ops, taken
+
+    async def written(self, user_id: str):
+        """Wait until changes of user detached by `take` are written, restored or dropped"""
+        if (done := self._writing.get(user_id)) is not None:
+            await done.wait()
+
+    def _done(self, taken: dict):
+        for user_id in taken:
+            if (done := self._writing.pop(user_id, None)) is not None:
+                done.set()
+
+    def pipeline(self, user_id: str, servers: Dict[str, int]) -> List[dict]:
+        """Update pipeline for XP gained by user on servers"""
+        userinfo = self._users[user_id]
+        return exp_pipeline(
+            servers,
+            {"chat_block": userinfo["chat_block"], "last_message": userinfo["last_message"]},
+        )
+
+    def refresh(self, userinfo: dict, before: dict, servers: Dict[str, int]) -> Set[str]:
+        """Replace cached state of user with state written by `pipeline`
+
+        `before` is user document before update, with data of all servers from `servers`.
+        Returns ids of servers, where user leveled up."""
+        userinfo["total_exp"] = before.get("total_exp", 0)
+        leveled_up = set()
+        for server_id, exp in servers.items():
+            server = before.get("servers", {}).get(server_id, {})
+            userinfo["servers"][server_id] = {
+                "level": server.get("level", 0),
+                "current_exp": server.get("current_exp", 0),
+            }
+            if apply_exp(userinfo, server_id, exp):
+                leveled_up.add(server_id)
+        return leveled_up
+
+    def states(self, taken: dict) -> List[Tuple[str, str, dict]]:
+        """Cached (user id, server id, server state) of users and servers from `take`"""
+        return [
+            (user_id, server_id, self._users[user_id]["servers"][server_id])
+            for user_id, servers in taken.items()
+            if user_id in self._users
+            for server_id in servers
+        ]
+
+    def restore(self, taken: dict):
+        """Return changes detached by `take` back to pending"""
+        self._done(taken)
+        for user_id, servers in taken.items():
+            if user_id not in self._users:
+                continue
+            pending = self._pending.setdefault(user_id, {})
+            for server_id, exp in servers.items():
+                pending[server_id] = pending.get(server_id, 0) + exp
+
+    def drop(self, taken: dict):
+        """Forget changes detached by `take`, that may be written or not, with cached state
+
+        Cached state of users is read from database again. Pending changes of them are lost."""
+        self._done(taken)
+        for user_id in taken:
+            self.discard(user_id)
+
+    def flushed(self, taken: dict, started: float):
+        """Record successful write of changes detached by `take`
+
+        Evicts least recently used users without pending changes, if cache is full."""
+        self._done(taken)
+        self.flushed_ops += len(taken)
+        self.last_flush = time.time()
+        self.last_flush_duration = time.monotonic() - started
+        overflow = len(self._users) - self.max_users
+        if overflow <= 0:
+            return
+        for user_id in list(self._users):
+            if overflow <= 0:
+                break
+            if user_id not in self._pending and user_id not in self._writing:
+                del self._users[user_id]
+                overflow -= 1